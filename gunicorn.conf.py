@@ -0,0 +1,21 @@
+"""
+Gunicorn settings, read from the working directory when the app is
+served with `gunicorn manage:app`.
+
+/api/events holds its request open while it waits for events (and
+for good when streaming), so the workers are threaded: a waiting
+client ties up one thread instead of a whole sync worker. The threads
+share the worker's event buffer and poller.
+"""
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+worker_class = 'gthread'
+# the in-memory broker only reaches clients of its own worker process
+workers = int(os.environ.get(
+    'WEB_CONCURRENCY',
+    2 if os.environ.get('EVENT_BROKER') == 'database' else 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 50))
+# a thread handling a long poll doesn't stop the worker's heartbeat
+timeout = 30
+graceful_timeout = 30
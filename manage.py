@@ -1,4 +1,5 @@
 import os
+import time
 import subprocess
 import random
 from datetime import datetime
@@ -10,16 +11,20 @@ from flask.cli import FlaskGroup
 
 from src import create_app, db
 from src.lib.perms import set_model_perms
-from src.lib.search import add_to_index, TagsIndex, UsersIndex
+from src.lib import jobs
+from src.lib.broker import DatabaseBroker, NullBroker
+from src.lib.search import reindex, sync_changes, query_index, \
+    TagsIndex, UsersIndex
 from src.blueprints.users.models import User
 from src.blueprints.posts.models import Post
 from src.blueprints.profiles.models import Profile
-from src.blueprints.tags.models import Tag
+from src.blueprints.tags.models import Tag, TagStats
 from src.blueprints.messages.models import Message, Chat, LastReadMessage
 from src.blueprints.admin.models import Group
 from src.blueprints.admin.models import Permission
 from src.blueprints.admin.models import grp_members, grp_perms
-from src.blueprints.users.models import user_perms
+from src.blueprints.users.models import user_perms, followers, \
+    TimelineEntry, FollowSuggestion, RevokedToken
 
 app = create_app()
 cli = FlaskGroup(create_app=create_app)
@@ -66,12 +71,321 @@ def routes():
 
 
 @cli.command()
-def index_search_fields():
+@click.option("--chunk-size", default=500, help="Documents per bulk request.")
+@click.option("--threads", default=4, help="Parallel bulk requests.")
+def index_search_fields(chunk_size, threads):
     """
-    Index searchable fields.
+    Rebuild the search indices into new versions and swap them in.
+
+    :param chunk_size: Number of documents per bulk request
+    :param threads: Number of bulk requests in flight
+    """
+    if app.elasticsearch is None:
+        raise click.UsageError(
+            'ELASTICSEARCH_URL is not set, the in-process search engine '
+            'builds its indices from the rows on first use.')
+
+    for doc in (TagsIndex, UsersIndex):
+        alias = doc.Index.name
+
+        def progress(sent, elapsed):
+            rate = sent / elapsed if elapsed else 0
+            print(f'{alias}: sent {sent} documents, {rate:.0f} docs/s...')
+
+        name = reindex(app.elasticsearch, doc, chunk_size, threads, progress)
+        print(f'{alias}: now serving {name}...')
+
+
+@cli.command()
+@click.option("--queries", default=200, help="Queries per index.")
+def bench_search(queries):
+    """
+    Time search-as-you-type queries against the configured search
+    backend, Elasticsearch or the in-process engine.
+
+    :param queries: Number of queries to run per index
     """
-    add_to_index(TagsIndex, Tag)
-    add_to_index(UsersIndex, User)
+    names = [name for name, in db.session.query(Profile.name).order_by(
+        db.func.random()).limit(queries)]
+    terms = [name[:random.randint(1, len(name))] for name in names if name]
+
+    for doc in (TagsIndex, UsersIndex):
+        timings = []
+
+        for term in terms:
+            start = time.perf_counter()
+            query_index(doc, term)
+            timings.append((time.perf_counter() - start) * 1000)
+
+        if not timings:
+            print('No profiles to take queries from...')
+            return
+
+        timings.sort()
+        print(f'{doc.Index.name}: {len(timings)} queries, '
+              f'p50 {timings[len(timings) // 2]:.2f}ms, '
+              f'p95 {timings[int(len(timings) * 0.95)]:.2f}ms, '
+              f'max {timings[-1]:.2f}ms')
+
+
+@cli.command()
+@click.option("--batch-size", default=500, help="Changes per bulk request.")
+@click.option("--interval", default=1.0, help="Seconds to wait when idle.")
+@click.option("--once", is_flag=True, help="Exit once the queue is empty.")
+def sync_search(batch_size, interval, once):
+    """
+    Apply queued search changes to the search indices.
+
+    :param batch_size: Number of changes to apply per bulk request
+    :param interval: Seconds to sleep while the queue is empty
+    :param once: Stop when the queue is drained
+    """
+    if app.elasticsearch is None:
+        raise click.UsageError(
+            'ELASTICSEARCH_URL is not set, there are no indices to sync.')
+
+    while True:
+        try:
+            applied = sync_changes(app.elasticsearch, batch_size)
+        except Exception as e:
+            db.session.rollback()
+            app.logger.exception(e)
+            applied = 0
+
+            if once:
+                raise
+
+        if applied:
+            print(f'Applied {applied} search changes...')
+
+        if applied < batch_size:
+            if once:
+                break
+            time.sleep(interval)
+
+
+@cli.command()
+@click.option("--interval", default=1.0, help="Seconds to wait when idle.")
+@click.option("--once", is_flag=True, help="Exit once the queue is empty.")
+def run_jobs(interval, once):
+    """
+    Run queued background jobs. Start one process per worker wanted,
+    they never run the same job. Every minute, jobs held past their
+    lease are requeued, finished jobs and expired revoked tokens are
+    pruned, and the next rollup of the tag stats windows is queued.
+
+    :param interval: Seconds to sleep while no job is due
+    :param once: Stop when no job is due
+    """
+    # only the database broker carries the events published by jobs to
+    # the clients of the web workers, other brokers would keep them here
+    if not isinstance(app.broker, DatabaseBroker):
+        print('Events published by jobs are dropped, '
+              'set EVENT_BROKER=database to deliver them.')
+        app.broker = NullBroker()
+
+    worker = jobs.worker_id()
+    next_maintenance = 0
+
+    while True:
+        if time.monotonic() >= next_maintenance:
+            jobs.requeue_stale(app.config['JOB_LEASE'])
+            jobs.prune(app.config['JOB_RETENTION'])
+            RevokedToken.prune()
+            # keyed, so only one rollup waits at a time
+            jobs.enqueue('rollup_tag_stats', key='periodic',
+                         delay=app.config['TAG_STATS_INTERVAL'])
+            db.session.commit()
+            next_maintenance = time.monotonic() + 60
+
+        try:
+            job = jobs.run_next(
+                worker, max_attempts=app.config['JOB_MAX_ATTEMPTS'],
+                retry_delay=app.config['JOB_RETRY_DELAY'])
+        except Exception as e:
+            db.session.rollback()
+            app.logger.exception(e)
+            job = None
+
+        if job is not None:
+            print(f'{job.name} job {job.id}: {job.state}')
+        elif once:
+            break
+        else:
+            time.sleep(interval)
+
+
+@cli.command()
+def job_stats():
+    """Print the job counts by state and the lag of the job queue."""
+    stats = jobs.queue_stats()
+    print(f'queued {stats["queued"]}, running {stats["running"]}, '
+          f'done {stats["done"]}, failed {stats["failed"]}, '
+          f'lag {stats["lagSeconds"]}s')
+
+
+@cli.command()
+def prune_revoked_tokens():
+    """
+    Delete the revoked tokens that have expired since. `run_jobs` does
+    it every minute.
+    """
+    count = RevokedToken.prune()
+    print(f'Pruned {count} revoked tokens...')
+
+
+@cli.command()
+@click.option("--chunk-size", default=1000, help="Rows per transaction.")
+def reconcile_counters(chunk_size):
+    """
+    Recount denormalized counters from their source tables.
+
+    :param chunk_size: Number of rows to reconcile per transaction
+    """
+    last_id = db.session.query(db.func.max(Post.id)).scalar() or 0
+
+    for first_id in range(1, last_id + 1, chunk_size):
+        Post.reconcile_counters(first_id, first_id + chunk_size - 1)
+
+    print(f'Reconciled counters for posts up to id {last_id}...')
+
+    last_id = db.session.query(db.func.max(Tag.id)).scalar() or 0
+
+    for first_id in range(1, last_id + 1, chunk_size):
+        Tag.reconcile_followers(first_id, first_id + chunk_size - 1)
+
+    print(f'Reconciled followers for tags up to id {last_id}...')
+
+    last_id = db.session.query(db.func.max(Chat.id)).scalar() or 0
+
+    for first_id in range(1, last_id + 1, chunk_size):
+        LastReadMessage.reconcile_unread(first_id, first_id + chunk_size - 1)
+
+    print(f'Reconciled unread messages for chats up to id {last_id}...')
+
+    last_id = db.session.query(db.func.max(User.id)).scalar() or 0
+
+    for first_id in range(1, last_id + 1, chunk_size):
+        User.reconcile_unread_notifs(first_id, first_id + chunk_size - 1)
+
+    print(f'Reconciled unread notifications for users up to id {last_id}...')
+
+
+@cli.command()
+@click.option("--chunk-size", default=1000, help="Rows per transaction.")
+def rebuild_rankings(chunk_size):
+    """
+    Recompute the hot score of every post.
+
+    :param chunk_size: Number of posts to rank per transaction
+    """
+    last_id = db.session.query(db.func.max(Post.id)).scalar() or 0
+
+    for first_id in range(1, last_id + 1, chunk_size):
+        Post.rebuild_hot_scores(first_id, first_id + chunk_size - 1)
+
+    print(f'Ranked posts up to id {last_id}...')
+
+
+@cli.command()
+@click.option("--chunk-size", default=1000, help="Rows per transaction.")
+def backfill_chat_activity(chunk_size):
+    """
+    Point every chat at its latest message.
+
+    :param chunk_size: Number of chats to update per transaction
+    """
+    last_id = db.session.query(db.func.max(Chat.id)).scalar() or 0
+
+    for first_id in range(1, last_id + 1, chunk_size):
+        Chat.refresh_last_messages(first_id, first_id + chunk_size - 1)
+        db.session.commit()
+
+    print(f'Backfilled chats up to id {last_id}...')
+
+
+@cli.command()
+@click.option("--size", default=500, help="Posts per timeline.")
+def backfill_timelines(size):
+    """
+    Rebuild every user's home timeline, after flagging the authors
+    whose posts are fanned out on read.
+
+    :param size: Number of posts to put on each timeline
+    """
+    popular = db.session.query(followers.c.followed_id).group_by(
+        followers.c.followed_id).having(db.func.count() > app.config[
+            'TIMELINE_FANOUT_LIMIT'])
+    User.query.update({
+        User.fanout_on_read: User.id.in_(popular.subquery())
+    }, synchronize_session=False)
+    db.session.commit()
+
+    user_ids = [id for id, in db.session.query(User.id).order_by(User.id)]
+
+    for i, user_id in enumerate(user_ids, 1):
+        TimelineEntry.rebuild(user_id, size)
+        db.session.commit()
+
+        if i % 100 == 0:
+            print(f'Rebuilt {i} of {len(user_ids)} timelines...')
+
+    print(f'Rebuilt {len(user_ids)} timelines...')
+
+
+@cli.command()
+@click.option("--size", default=50, help="Candidates per user.")
+def build_follow_suggestions(size):
+    """
+    Recompute every user's ranked follow candidates.
+
+    :param size: Number of candidates to keep per user
+    """
+    user_ids = [id for id, in db.session.query(User.id).order_by(User.id)]
+
+    for i, user_id in enumerate(user_ids, 1):
+        FollowSuggestion.rebuild(user_id, size)
+        db.session.commit()
+
+        if i % 100 == 0:
+            print(f'Ranked candidates for {i} of {len(user_ids)} users...')
+
+    print(f'Ranked candidates for {len(user_ids)} users...')
+
+
+@cli.command()
+def rebuild_tag_stats():
+    """
+    Recount the posts of every tag, overall and in the last hour, day
+    and week. Posts are counted as they are tagged and `run_jobs` drops
+    the aged ones from the windows, run it to backfill or reconcile.
+    """
+    TagStats.rebuild()
+    print(f'Rebuilt stats for {TagStats.query.count()} tags...')
+
+
+@cli.command()
+def rebuild_permissions():
+    """
+    Rebuild every user's effective permission set.
+    """
+    perm_bits = {}
+    own_perms = db.session.query(user_perms.c.user_id, user_perms.c.perm_id)
+    group_perms = db.session.query(
+        grp_members.c.user_id, grp_perms.c.perm_id).join(
+            grp_perms, grp_perms.c.group_id == grp_members.c.group_id)
+
+    for user_id, perm_id in own_perms.union(group_perms):
+        perm_bits[user_id] = perm_bits.get(user_id, 0) | 1 << perm_id
+
+    db.session.query(User).update(
+        {User.perm_bits: '0'}, synchronize_session=False)
+    db.session.bulk_update_mappings(User, [
+        {'id': user_id, 'perm_bits': format(mask, 'x')}
+        for user_id, mask in perm_bits.items()
+    ])
+    db.session.commit()
+    print(f'Rebuilt permissions for {len(perm_bits)} users...')
 
 
 @cli.command()
@@ -123,6 +437,13 @@ def seed_db(num_of_users, num_of_posts, num_of_comments):
     seed_comments(num_of_comments)
     seed_conversations()
     seed_messages()
+    rebuild_permissions.callback()
+    reconcile_counters.callback(chunk_size=1000)
+    rebuild_rankings.callback(chunk_size=1000)
+    backfill_chat_activity.callback(chunk_size=1000)
+    backfill_timelines.callback(size=500)
+    build_follow_suggestions.callback(size=50)
+    rebuild_tag_stats.callback()
 
 
 def db_init():
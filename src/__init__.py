@@ -25,6 +25,15 @@ def create_app(config=app_settings):
 
     :return - object: Flask app
     """
+    from src.lib.cache import TTLCache
+    from src.lib.featured import FeaturedPool
+    from src.lib.hashing import PasswordHasher
+    from src.lib.revocation import RevocationList
+    from src.lib.search import SEARCH_INDICES, SearchClient
+    from src.lib.breaker import CircuitBreaker
+    from src.lib.search_engine import LocalSearch
+    from src.lib.broker import InProcessBroker, DatabaseBroker
+
     # Instantiate app
     app = Flask(__name__)
 
@@ -37,9 +46,49 @@ def create_app(config=app_settings):
     cors.init_app(app)
 
     es = app.config['ELASTICSEARCH_URL']
-    app.elasticsearch = Elasticsearch(es) if es else None
-    app.search_host = app.config['ES_HOST'] if app.config['ES_HOST'] else None
-    app.search_port = app.config['ES_PORT'] if app.config['ES_PORT'] else None
+    app.elasticsearch = Elasticsearch(
+        es, maxsize=app.config['SEARCH_POOL_SIZE']) if es else None
+    app.search_client = SearchClient(
+        app.elasticsearch,
+        timeout=app.config['SEARCH_TIMEOUT'],
+        cache=TTLCache(
+            maxsize=app.config['SEARCH_CACHE_SIZE'],
+            ttl=app.config['SEARCH_CACHE_TTL']),
+        breaker=CircuitBreaker(
+            failure_threshold=app.config['SEARCH_BREAKER_THRESHOLD'],
+            reset_timeout=app.config['SEARCH_BREAKER_RESET'])) if es else None
+    app.local_search = None if es else LocalSearch(
+        SEARCH_INDICES, refresh_interval=app.config['LOCAL_SEARCH_REFRESH'])
+    app.identity_cache = TTLCache(
+        maxsize=app.config['IDENTITY_CACHE_SIZE'],
+        ttl=app.config['IDENTITY_CACHE_TTL'])
+    app.permission_cache = TTLCache(
+        maxsize=app.config['PERMISSION_CACHE_SIZE'],
+        ttl=app.config['PERMISSION_CACHE_TTL'])
+    app.password_hasher = PasswordHasher(
+        method=app.config['PASSWORD_HASH_METHOD'],
+        workers=app.config['PASSWORD_HASH_WORKERS'],
+        queue_size=app.config['PASSWORD_HASH_QUEUE_SIZE'],
+        timeout=app.config['PASSWORD_HASH_TIMEOUT'])
+    app.revoked_tokens = RevocationList(
+        refresh_interval=app.config['TOKEN_REVOCATION_REFRESH'],
+        rebuild_interval=app.config['TOKEN_REVOCATION_REBUILD'],
+        size=app.config['TOKEN_REVOCATION_FILTER_BITS'],
+        hashes=app.config['TOKEN_REVOCATION_FILTER_HASHES'])
+    app.featured_posts = FeaturedPool(
+        size=app.config['FEATURED_POOL_SIZE'],
+        refresh_interval=app.config['FEATURED_POOL_REFRESH'])
+
+    if app.config['EVENT_BROKER'] == 'database':
+        app.broker = DatabaseBroker(
+            app,
+            buffer_size=app.config['EVENT_BUFFER_SIZE'],
+            poll_interval=app.config['EVENT_POLL_INTERVAL'],
+            retention=app.config['EVENT_RETENTION'],
+            gap_timeout=app.config['EVENT_GAP_TIMEOUT'])
+    else:
+        app.broker = InProcessBroker(
+            buffer_size=app.config['EVENT_BUFFER_SIZE'])
 
     @app.route('/api/ping')
     def ping():
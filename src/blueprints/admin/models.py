@@ -1,3 +1,5 @@
+from flask import current_app
+
 from src import db
 from src.lib.mixins import ResourceMixin
 
@@ -77,34 +79,79 @@ class Group(db.Model, ResourceMixin):
         return self.members.filter(
             grp_members.c.user_id == user.id).count() > 0
 
+    def get_permission_mask(self):
+        """
+        Get the bitset of the permissions granted by this group.
+
+        :return: int
+        """
+        return Permission.mask_of(
+            perm_id for perm_id, in self.permissions.with_entities(
+                Permission.id))
+
     def add_members(self, members):
+        added = []
+
         for member in members:
             if not self.is_group_member(member):
                 self.members.append(member)
+                added.append(member)
                 self.save()
 
+        if added:
+            mask = self.get_permission_mask()
+            update_permission_bits(
+                added, lambda user: user.grant_perm_bits(mask))
+
     def remove_members(self, members):
+        removed = []
+
         for member in members:
             if self.is_group_member(member):
                 self.members.remove(member)
+                removed.append(member)
                 self.save()
 
+        update_permission_bits(
+            removed, lambda user: user.rebuild_perm_bits())
+
     def has_perm(self, perm):
         return self.permissions.filter(
             grp_perms.c.perm_id == perm.id).count() > 0
 
     def add_permissions(self, perms):
+        added = []
+
         for perm in perms:
             if not self.has_perm(perm):
                 self.permissions.append(perm)
+                added.append(perm)
                 self.save()
 
+        if added:
+            mask = Permission.mask_of(perm.id for perm in added)
+            update_permission_bits(
+                self.members.all(), lambda user: user.grant_perm_bits(mask))
+
     def remove_permissions(self, perms):
+        removed = False
+
         for perm in perms:
             if self.has_perm(perm):
                 self.permissions.remove(perm)
+                removed = True
                 self.save()
 
+        if removed:
+            update_permission_bits(
+                self.members.all(), lambda user: user.rebuild_perm_bits())
+
+    def delete(self):
+        members = self.members.all()
+        result = super(Group, self).delete()
+        update_permission_bits(members, lambda user: user.rebuild_perm_bits())
+        return result
+
 
 class Permission(db.Model, ResourceMixin):
     __tablename__ = 'permissions'
@@ -131,6 +178,16 @@ class Permission(db.Model, ResourceMixin):
     def __repr__(self):
         return f'<Permission: {self.name}>'
 
+    def save(self):
+        result = super(Permission, self).save()
+        current_app.permission_cache.clear()
+        return result
+
+    def delete(self):
+        result = super(Permission, self).delete()
+        current_app.permission_cache.clear()
+        return result
+
     @classmethod
     def set_code_name(cls, name):
         return name.strip(',. ').replace(' ', '_').lower()
@@ -139,6 +196,47 @@ class Permission(db.Model, ResourceMixin):
     def find_by_name(cls, code_name):
         return cls.query.filter((cls.code_name == code_name)).first()
 
+    @staticmethod
+    def mask_of(perm_ids):
+        """
+        Build a bitset with one bit set per permission id.
+
+        :param perm_ids: Iterable of permission ids
+        :return: int
+        """
+        mask = 0
+
+        for perm_id in perm_ids:
+            mask |= 1 << perm_id
+
+        return mask
+
+    @classmethod
+    def mask_for(cls, code_names):
+        """
+        Build the bitset of the permissions with the given code names.
+        Code name to id lookups are cached, so a warm call issues no
+        query. Saving or deleting a permission clears this worker's
+        cache, other workers see the change within PERMISSION_CACHE_TTL.
+
+        :param code_names: List of permission code names
+        :return: int, or None if a permission does not exist
+        """
+        cache = current_app.permission_cache
+        ids = {name: cache.get(name) for name in code_names}
+        missing = [name for name, perm_id in ids.items() if perm_id is None]
+
+        if missing:
+            for name, perm_id in db.session.query(
+                    cls.code_name, cls.id).filter(cls.code_name.in_(missing)):
+                cache.set(name, perm_id)
+                ids[name] = perm_id
+
+        if None in ids.values():
+            return None
+
+        return cls.mask_of(ids.values())
+
 
 class Model(db.Model, ResourceMixin):
     __tablename__ = 'models'
@@ -153,3 +251,31 @@ class Model(db.Model, ResourceMixin):
 
     def __repr__(self):
         return f'<Model: {self.name}>'
+
+
+def update_permission_bits(users, update):
+    """
+    Apply an update to the permission bitsets of some users, and drop
+    them from the identity cache. The users' rows are locked and their
+    bitsets reloaded first, so concurrent permission changes apply one
+    after the other instead of overwriting each other's bits.
+
+    :param users: List of User instances
+    :param update: Callable applied to each user
+    :return: None
+    """
+    from src.blueprints.users.models import User
+
+    if not users:
+        return
+
+    ids = sorted(user.id for user in users)
+
+    for user in User.query.filter(User.id.in_(ids)).order_by(
+            User.id).with_for_update().populate_existing():
+        update(user)
+
+    db.session.commit()
+
+    for user_id in ids:
+        ResourceMixin.invalidate_identity(user_id)
@@ -10,3 +10,4 @@ def ping():
 
 import src.blueprints.admin.routes.users
 import src.blueprints.admin.routes.groups
+import src.blueprints.admin.routes.stats
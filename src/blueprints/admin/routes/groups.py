@@ -3,6 +3,7 @@ from sqlalchemy import exc
 from flask import request, url_for, jsonify, current_app
 
 from src import db
+from src.lib.auth import permission_required
 from src.blueprints.errors import error_response, \
     bad_request, server_error, not_found
 from src.blueprints.admin.routes import admin
@@ -13,7 +14,7 @@ from src.blueprints.admin.schema import GroupSchema
 
 @admin.route('/groups/page/<int:page>', methods=['GET'])
 @admin.route('/groups', methods=['GET'])
-# @permission_required(['can_view_Group'])
+@permission_required(['can_view_groups'])
 def get_groups(page=1):
     """Get list of groups"""
     groups = Group.query.paginate(
@@ -31,7 +32,7 @@ def get_groups(page=1):
 
 
 @admin.route('/groups/<int:id>', methods=['GET'])
-# @permission_required(['can_view_user'])
+@permission_required(['can_view_groups'])
 def get_group(id):
     """Get a single group"""
     group = Group.find_by_id(id)
@@ -41,7 +42,7 @@ def get_group(id):
 
 
 @admin.route('/groups', methods=['POST'])
-# @permission_required(['can_view_user'])
+@permission_required(['can_add_groups'])
 def add_group():
     request_data = request.get_json()
 
@@ -77,7 +78,7 @@ def add_group():
 
 
 @admin.route('/groups/<int:id>', methods=['PUT'])
-# @permission_required(['can_view_user'])
+@permission_required(['can_edit_groups'])
 def update_group(id):
     request_data = request.get_json()
 
@@ -110,7 +111,7 @@ def update_group(id):
 
 
 @admin.route('/groups/<int:id>', methods=['DELETE'])
-# @permission_required(['can_delete_user'])
+@permission_required(['can_delete_groups'])
 def delete_group(id):
     try:
         group = Group.find_by_id(id)
@@ -125,7 +126,7 @@ def delete_group(id):
 
 
 @admin.route('/groups/<int:grp_id>/members', methods=['PUT'])
-# @permission_required(['can_delete_user'])
+@permission_required(['can_add_group_members'])
 def add_group_members(grp_id):
     data = request.get_json()
     group = Group.find_by_id(grp_id)
@@ -140,7 +141,7 @@ def add_group_members(grp_id):
 
 
 @admin.route('/groups/<int:grp_id>/members', methods=['DELETE'])
-# @permission_required(['can_delete_user'])
+@permission_required(['can_delete_group_members'])
 def remove_group_members(grp_id):
     data = request.get_json()
     group = Group.find_by_id(grp_id)
@@ -155,7 +156,7 @@ def remove_group_members(grp_id):
 
 
 @admin.route('/groups/<int:grp_id>/permissions', methods=['PUT'])
-# @permission_required(['can_delete_user'])
+@permission_required(['can_add_group_permissions'])
 def add_group_permissions(grp_id):
     data = request.get_json()
     group = Group.find_by_id(grp_id)
@@ -170,7 +171,7 @@ def add_group_permissions(grp_id):
 
 
 @admin.route('/groups/<int:grp_id>/permissions', methods=['DELETE'])
-# @permission_required(['can_delete_perms'])
+@permission_required(['can_delete_group_permissions'])
 def remove_group_permissions(grp_id):
     data = request.get_json()
     group = Group.find_by_id(grp_id)
@@ -0,0 +1,35 @@
+from flask import current_app
+
+from src.lib.auth import permission_required
+from src.lib.jobs import queue_stats
+from src.blueprints.admin.routes import admin
+
+
+@admin.route('/stats/caches', methods=['GET'])
+@permission_required(['can_view_users'])
+def get_cache_stats():
+    """Get the hit/miss counters of this worker's caches"""
+    return {
+        'identity': current_app.identity_cache.stats(),
+        'permissions': current_app.permission_cache.stats(),
+    }
+
+
+@admin.route('/stats/search', methods=['GET'])
+@permission_required(['can_view_users'])
+def get_search_stats():
+    """Get the latency, cache and circuit breaker stats of search"""
+    if current_app.search_client is None:
+        return {'backend': 'local'}
+
+    return {
+        'backend': 'elasticsearch',
+        **current_app.search_client.stats(),
+    }
+
+
+@admin.route('/stats/jobs', methods=['GET'])
+@permission_required(['can_view_users'])
+def get_job_stats():
+    """Get the job counts by state and the lag of the job queue"""
+    return queue_stats()
@@ -3,6 +3,7 @@ from flask import jsonify, request, url_for, current_app
 from marshmallow import ValidationError
 
 from src import db
+from src.lib.auth import permission_required
 from src.blueprints.errors import error_response, \
     bad_request, not_found, server_error
 from src.blueprints.admin.routes import admin
@@ -14,7 +15,7 @@ from src.blueprints.users.schema import UserSchema
 
 @admin.route('/users/page/<int:page>', methods=['GET'])
 @admin.route('/users', methods=['GET'])
-# @permission_required(['can_view_user'])
+@permission_required(['can_view_users'])
 def get_users(page=1):
     """Get list of users"""
     users = User.query.paginate(
@@ -32,7 +33,7 @@ def get_users(page=1):
 
 
 @admin.route('/users/<int:id>', methods=['GET'])
-# @permission_required(['can_view_user'])
+@permission_required(['can_view_users'])
 def get_user(id):
     """Get a single user"""
     user = User.find_by_id(id)
@@ -42,7 +43,7 @@ def get_user(id):
 
 
 @admin.route('/users', methods=['POST'])
-# @permission_required(['can_add_user'])
+@permission_required(['can_add_users'])
 def add_user():
     request_data = request.get_json()
 
@@ -87,7 +88,7 @@ def add_user():
 
 
 @admin.route('/users/<int:id>', methods=['PUT'])
-# @permission_required(['can_update_user'])
+@permission_required(['can_edit_users'])
 def update_user(id):
     request_data = request.get_json()
 
@@ -123,7 +124,7 @@ def update_user(id):
 
 
 @admin.route('/users/<int:id>', methods=['DELETE'])
-# @permission_required(['can_delete_user'])
+@permission_required(['can_delete_users'])
 def delete_user(id):
     try:
         user = User.find_by_id(id)
@@ -138,7 +139,7 @@ def delete_user(id):
 
 
 @admin.route('/users/<int:id>/permissions', methods=['PUT'])
-# @permission_required(['can_delete_user'])
+@permission_required(['can_add_user_permissions'])
 def add_user_permissions(id):
     data = request.get_json()
     user = User.find_by_id(id)
@@ -153,7 +154,7 @@ def add_user_permissions(id):
 
 
 @admin.route('/users/<int:id>/permissions', methods=['DELETE'])
-# @permission_required(['can_delete_user'])
+@permission_required(['can_delete_user_permissions'])
 def remove_user_permissions(id):
     data = request.get_json()
     user = User.find_by_id(id)
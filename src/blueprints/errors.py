@@ -2,6 +2,7 @@ from flask import jsonify, Blueprint
 from werkzeug.http import HTTP_STATUS_CODES
 
 from src import db
+from src.lib.pagination import InvalidCursor
 
 errors = Blueprint('errors', __name__)
 
@@ -29,6 +30,12 @@ def server_error(message):
     return error_response(500, message)
 
 
+def service_unavailable(message, retry_after):
+    response = error_response(503, message)
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
 @errors.app_errorhandler(404)
 def not_found_error(error):
     return not_found('Not found.')
@@ -39,6 +46,11 @@ def not_allowed_error(error):
     return error_response(405, 'Method not allowed')
 
 
+@errors.app_errorhandler(InvalidCursor)
+def invalid_cursor_error(error):
+    return bad_request('Invalid cursor.')
+
+
 @errors.app_errorhandler(500)
 def internal_error(error):
     db.session.rollback()
@@ -1,5 +1,7 @@
 from datetime import datetime
-from sqlalchemy import and_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy import and_, or_, case, exists, null, select, union_all
+from sqlalchemy.sql import func
 from src import db
 
 
@@ -7,17 +9,59 @@ class Chat(db.Model):
     __tablename__ = 'chats'
     __table_args__ = (
         db.Index('_chat_users_idx', 'user2_id', 'user1_id', unique=True),
+        # a user's chats list is read from both sides by recent activity
+        db.Index('ix_chats_user1_activity',
+                 'user1_id', 'last_activity_at', 'id'),
+        db.Index('ix_chats_user2_activity',
+                 'user2_id', 'last_activity_at', 'id'),
     )
 
     id = db.Column(db.Integer, primary_key=True)
     user1_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
     user2_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    last_message_id = db.Column(db.Integer, db.ForeignKey(
+        "messages.id", ondelete='SET NULL', use_alter=True,
+        name='fk_chats_last_message_id'))
+    last_activity_at = db.Column(
+        db.DateTime, default=datetime.utcnow, nullable=False)
     messages = db.relationship(
-        'Message', backref='chat', cascade='all, delete-orphan')
+        'Message', backref='chat', cascade='all, delete-orphan',
+        foreign_keys='Message.chat_id')
 
     def __repr__(self):
         return f"<Chat: user_{self.user1_id} <-> user_{self.user2_id}>"
 
+    @classmethod
+    def record_message(cls, message):
+        '''
+        Point a chat at a new message, unless a later message got there
+        first.
+        '''
+        cls.query.filter(
+            cls.id == message.chat_id,
+            or_(cls.last_message_id.is_(None),
+                cls.last_activity_at <= message.created_on)).update({
+                    cls.last_message_id: message.id,
+                    cls.last_activity_at: message.created_on,
+                }, synchronize_session=False)
+
+    @classmethod
+    def refresh_last_messages(cls, first_id, last_id):
+        '''
+        Point the chats with ids in a range at their latest message. Chats
+        left without messages keep their last activity time.
+        '''
+        cls.query.filter(cls.id >= first_id, cls.id <= last_id).update({
+            cls.last_message_id: db.select([Message.id]).where(
+                Message.chat_id == cls.id).order_by(
+                    Message.created_on.desc(), Message.id.desc()).limit(
+                        1).as_scalar(),
+            cls.last_activity_at: func.coalesce(
+                db.select([func.max(Message.created_on)]).where(
+                    Message.chat_id == cls.id).as_scalar(),
+                cls.last_activity_at),
+        }, synchronize_session=False)
+
 
 class LastReadMessage(db.Model):
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
@@ -25,6 +69,8 @@ class LastReadMessage(db.Model):
         "users.id"), primary_key=True, nullable=False)
     chat_id = db.Column(db.Integer, db.ForeignKey(
         "chats.id"), primary_key=True, nullable=False)
+    # messages from the other participant since the user last read
+    unread_count = db.Column(db.Integer, default=0, nullable=False)
 
     def save(self):
         """
@@ -41,9 +87,86 @@ class LastReadMessage(db.Model):
             and_(cls.user_id == user_id, cls.chat_id == chat_id)
         ).first()
 
+    @classmethod
+    def mark_read(cls, user_id, chat_id):
+        '''Record that a user has read a chat up to now.'''
+        lrm = cls.find_by_pk(user_id, chat_id)
+
+        if not lrm:
+            lrm = cls(user_id=user_id, chat_id=chat_id)
+            db.session.add(lrm)
+        lrm.timestamp = datetime.utcnow()
+        lrm.unread_count = 0
+        return lrm
+
+    @classmethod
+    def add_unread(cls, user_id, chat_id):
+        '''Count a new message as unread for a chat participant.'''
+        def increment():
+            return cls.query.filter(
+                cls.user_id == user_id, cls.chat_id == chat_id).update({
+                    cls.unread_count: cls.unread_count + 1
+                }, synchronize_session=False)
+
+        if increment():
+            return
+
+        try:
+            with db.session.begin_nested():
+                db.session.add(cls(
+                    user_id=user_id, chat_id=chat_id, timestamp=null(),
+                    unread_count=1))
+        except IntegrityError:
+            # another request counted the chat's first message
+            increment()
+
+    @classmethod
+    def remove_unread(cls, user_id, chat_id, created_on):
+        '''
+        Uncount a deleted message for a participant who hadn't read it.
+        '''
+        cls.query.filter(
+            cls.user_id == user_id, cls.chat_id == chat_id,
+            cls.unread_count > 0,
+            or_(cls.timestamp.is_(None), cls.timestamp < created_on)).update({
+                cls.unread_count: cls.unread_count - 1
+            }, synchronize_session=False)
+
+    @classmethod
+    def reconcile_unread(cls, first_id, last_id):
+        '''
+        Recount the unread messages of both participants of the chats
+        with ids in a range.
+        '''
+        in_range = and_(Chat.id >= first_id, Chat.id <= last_id)
+        members = union_all(
+            select([Chat.user1_id.label('user_id'),
+                    Chat.id.label('chat_id')]).where(in_range),
+            select([Chat.user2_id, Chat.id]).where(in_range)).alias()
+        db.session.execute(cls.__table__.insert().from_select(
+            ['user_id', 'chat_id', 'timestamp', 'unread_count'],
+            select([members.c.user_id, members.c.chat_id, null(), 0]).where(
+                ~exists().where(and_(
+                    cls.user_id == members.c.user_id,
+                    cls.chat_id == members.c.chat_id)))))
+
+        cls.query.filter(
+            cls.chat_id >= first_id, cls.chat_id <= last_id).update({
+                cls.unread_count: select([func.count()]).where(and_(
+                    Message.chat_id == cls.chat_id,
+                    Message.author_id != cls.user_id,
+                    or_(cls.timestamp.is_(None),
+                        Message.created_on > cls.timestamp))).as_scalar()
+            }, synchronize_session=False)
+        db.session.commit()
+
 
 class Message(db.Model):
     __tablename__ = "messages"
+    __table_args__ = (
+        db.Index('ix_messages_chat_created_on', 'chat_id', 'created_on',
+                 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.Text())
@@ -88,6 +211,12 @@ class Message(db.Model):
 
 class Notification(db.Model):
     __tablename__ = "notifications"
+    __table_args__ = (
+        db.Index('ix_notifications_user_group', 'user_id', 'group_key',
+                 unique=True),
+        db.Index('ix_notifications_user_timestamp', 'user_id', 'timestamp',
+                 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     subject = db.Column(db.String(128), index=True)
@@ -96,11 +225,150 @@ class Notification(db.Model):
     doer_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
     user_id = db.Column(db.Integer, nullable=False)
     post_id = db.Column(db.Integer, db.ForeignKey("posts.id"))
+    # aggregated notifications share one row per recipient and group,
+    # e.g. 'like:<post id>', counting the actors and keeping the latest
+    group_key = db.Column(db.String(64))
+    actor_count = db.Column(db.Integer, default=1, nullable=False)
+    actor_sample = db.Column(db.JSON, default=list, nullable=False)
     post = db.relationship('Post', backref='notif', lazy='joined')
+    sample_size = 3
 
     def __repr__(self):
         return "<Notification {}>".format(self.subject)
 
+    @classmethod
+    def aggregate(cls, subject, group_item, user_id, doer_id, item_id,
+                  post_id=None):
+        '''
+        Add an actor to a recipient's notification group, which is
+        created by its first actor and moves to the top of the
+        recipient's notifications with every new one.
+
+        :param subject: Notification subject
+        :param group_item: Id of what the group is about, e.g. the post
+        :param user_id: Recipient id
+        :param doer_id: Actor id
+        :param item_id: Id of the item the actor created or acted on
+        :param post_id: Post the notification links to
+        :return: Notification instance
+        '''
+        from src.blueprints.users.models import User
+
+        key = f'{subject}:{group_item}'
+        # the row stays locked until the transaction ends, so concurrent
+        # actors update the sample in turn
+        notif = cls.query.filter_by(
+            user_id=user_id, group_key=key).with_for_update().first()
+
+        if notif is None:
+            notif = cls(
+                subject=subject, group_key=key, user_id=user_id,
+                doer_id=doer_id, item_id=item_id, post_id=post_id,
+                actor_count=1, actor_sample=[doer_id])
+
+            try:
+                with db.session.begin_nested():
+                    db.session.add(notif)
+            except IntegrityError:
+                # another request created the group first
+                notif = cls.query.filter_by(
+                    user_id=user_id, group_key=key).with_for_update().first()
+            else:
+                User.notifs_changed([user_id], unread=1)
+                return notif
+
+        # a group the user has read becomes unread again
+        User.notifs_changed([user_id], unread=case(
+            [(User.notif_unread(notif.timestamp), 0)], else_=1))
+        sample = [id for id in notif.actor_sample or [] if id != doer_id]
+        notif.actor_count = cls.actor_count + 1
+        notif.actor_sample = [doer_id] + sample[:cls.sample_size - 1]
+        notif.doer_id = doer_id
+        notif.item_id = item_id
+        notif.timestamp = datetime.utcnow()
+        return notif
+
+    @classmethod
+    def retract(cls, subject, group_item, user_id, doer_id, actors):
+        '''
+        Remove an actor from a recipient's notification group, deleting
+        it with its last actor. When the actor was sampled the sample is
+        refilled from the remaining actors.
+
+        :param subject: Notification subject
+        :param group_item: Id of what the group is about
+        :param user_id: Recipient id
+        :param doer_id: Actor id
+        :param actors: Query of the remaining actors' ids, latest first
+        :return: None
+        '''
+        from src.blueprints.users.models import User
+
+        notif = cls.query.filter_by(
+            user_id=user_id,
+            group_key=f'{subject}:{group_item}').with_for_update().first()
+
+        if notif is None:
+            return
+
+        if notif.actor_count <= 1:
+            notif.remove()
+            return
+
+        User.notifs_changed([user_id])
+        notif.actor_count = cls.actor_count - 1
+
+        if doer_id in (notif.actor_sample or []):
+            notif.actor_sample = [
+                id for id, in actors.limit(cls.sample_size)]
+
+            if notif.actor_sample:
+                notif.doer_id = notif.actor_sample[0]
+
+    @classmethod
+    def repoint(cls, subject, group_item, user_id, item_id, items):
+        '''
+        Point a recipient's notification group that links to a deleted
+        item to the latest remaining one.
+
+        :param subject: Notification subject
+        :param group_item: Id of what the group is about
+        :param user_id: Recipient id
+        :param item_id: Id of the deleted item
+        :param items: Query of the remaining items' ids, latest first
+        :return: None
+        '''
+        cls.query.filter_by(
+            user_id=user_id, group_key=f'{subject}:{group_item}',
+            item_id=item_id).update({
+                cls.item_id: items.limit(1).as_scalar(),
+            }, synchronize_session=False)
+
+    def remove(self):
+        '''Delete a notification, uncounting it when it is unread.'''
+        from src.blueprints.users.models import User
+
+        User.notifs_changed([self.user_id], unread=case(
+            [(User.notif_unread(self.timestamp), -1)], else_=0))
+        db.session.delete(self)
+
+    @classmethod
+    def remove_for_post(cls, post_id):
+        '''
+        Delete the notifications linking to a post, uncounting the
+        unread ones of each recipient.
+        '''
+        from src.blueprints.users.models import User
+
+        unread = select([func.count()]).where(and_(
+            cls.post_id == post_id, cls.user_id == User.id,
+            User.notif_unread(cls.timestamp))).as_scalar()
+        User.notifs_changed(
+            db.session.query(cls.user_id).filter(cls.post_id == post_id),
+            unread=-unread)
+        cls.query.filter(cls.post_id == post_id).delete(
+            synchronize_session=False)
+
     @classmethod
     def find_by_id(cls, id):
         """
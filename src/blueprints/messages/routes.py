@@ -1,12 +1,14 @@
 from datetime import datetime
 from sqlalchemy.exc import IntegrityError, ProgrammingError
-from flask import json, jsonify, request, url_for, Blueprint, current_app
+from flask import json, jsonify, request, url_for, Blueprint, \
+    current_app, Response, stream_with_context
 from src.blueprints.messages.schema import NotificationSchema
 from src.blueprints.messages.models import Notification
 
 from src import db
-from src.lib import urlsafe_base64
 from src.lib.auth import authenticate
+from src.lib.broker import user_channel
+from src.lib.pagination import page_args, paginate, split_page
 from src.blueprints.errors import error_response, bad_request, \
      server_error, not_found
 from src.blueprints.users.models import User
@@ -26,40 +28,28 @@ def ping():
 @messages.route('/chats', methods=['GET'])
 @authenticate
 def get_messages(user):
-    cursor = request.args.get('cursor')
-    items_per_page = current_app.config['ITEMS_PER_PAGE']
-    last_messages = None
-    nextCursor = None
+    after, limit = page_args()
     messages = []
 
     try:
-        stmt, query = user.get_chat_last_messages()
-        if cursor == '0':
-            last_messages = query.limit(items_per_page + 1).all()
-        else:
-            cursor = urlsafe_base64(cursor, from_base64=True)
-            last_messages = query.filter(
-                stmt.c.last_messages < cursor).limit(items_per_page + 1).all()
+        chats, nextCursor = split_page(
+            user.get_chat_last_messages(limit + 1, after), limit,
+            lambda row: (row[0].last_activity_at, row[0].id))
     except (IntegrityError, ValueError) as e:
         db.session.rollback()
         print(e)
         return server_error('Something went wrong, please try again.')
 
-    if len(last_messages) > items_per_page:
-        nextCursor = urlsafe_base64(
-            last_messages[items_per_page - 1].last_messages.isoformat())
-
-    for msg, user1, user2, _ in last_messages[:items_per_page]:
-        author = user2 if user.id == user1.id else user1
-        last_read_msg = user.last_read_msg_ts(msg.chat_id)
+    for chat, msg, author, unread_count in chats:
         message = MessageSchema(exclude=('author_id',)).dump(msg)
-        message['isRead'] = False if not last_read_msg else \
-            last_read_msg.timestamp >= msg.created_on
+        message['unreadCount'] = unread_count or 0
+        message['isRead'] = not unread_count
         message['user'] = UserSchema(only=('id', 'profile',)).dump(author)
         messages.append(message)
 
     return {
         'data': messages,
+        'totalUnread': user.get_total_unread(),
         'nextCursor': nextCursor,
     }
 
@@ -68,11 +58,8 @@ def get_messages(user):
 @authenticate
 def get_chat_messages(user):
     username = request.args.get('username', '')
-    cursor = request.args.get('cursor')
-    items_per_page = current_app.config['ITEMS_PER_PAGE']
+    after, limit = page_args()
     a_user = Profile.find_by_username(username).user
-    nextCursor = None
-    msgs = None
 
     if not a_user:
         return not_found('User not found.')
@@ -80,37 +67,19 @@ def get_chat_messages(user):
     try:
         query = user.get_chat_messages(a_user)
         chat = user.get_chat(a_user)
+        msgs, nextCursor = paginate(
+            query, (Message.created_on.desc(), Message.id.desc()),
+            after, limit)
 
-        if cursor == '0':
-            msgs = query.limit(items_per_page + 1).all()
-        else:
-            cursor = urlsafe_base64(cursor, from_base64=True)
-            msgs = query.filter(
-                Message.created_on < cursor).limit(items_per_page + 1).all()
-
-        if len(msgs) > items_per_page:
-            nextCursor = urlsafe_base64(
-                msgs[items_per_page - 1].created_on.isoformat())
-
-        # check if lrm exist
         if chat:
-            lrm = LastReadMessage.find_by_pk(user.id, chat.id)
-
-            if lrm:
-                lrm.timestamp = datetime.utcnow()
-            else:
-                lrm = LastReadMessage()
-                lrm.user_id = user.id
-                lrm.chat_id = chat.id
-                lrm.timestamp = datetime.utcnow()
-            lrm.save()
+            LastReadMessage.mark_read(user.id, chat.id).save()
     except Exception as e:
         db.session.rollback()
         print(e)
         return server_error('Something went wrong, please try again.')
     else:
         return {
-            'data': MessageSchema(many=True).dump(msgs[:items_per_page]),
+            'data': MessageSchema(many=True).dump(msgs),
             'nextCursor': nextCursor
         }
 
@@ -143,20 +112,17 @@ def create_message(user):
         message.created_on = datetime.utcnow()
         message.chat_id = chat.id
         db.session.add(message)
-
-        lrm = LastReadMessage.find_by_pk(user.id, chat.id)
-
-        if lrm:
-            lrm.timestamp = datetime.utcnow()
-        else:
-            lrm = LastReadMessage()
-            lrm.user_id = user.id
-            lrm.chat_id = chat.id
-            lrm.timestamp = message.created_on
-            db.session.add(lrm)
+        db.session.flush()
+        Chat.record_message(message)
+        LastReadMessage.mark_read(user.id, chat.id)
+        LastReadMessage.add_unread(a_user.id, chat.id)
 
         user.add_notification(
             subject='message', item_id=message.id, id=a_user.id)
+        current_app.broker.publish(
+            user_channel(a_user.id), 'message',
+            {'chatId': chat.id, 'messageId': message.id,
+             'authorId': user.id})
         user.save()
     except (IntegrityError, ProgrammingError, AttributeError, ValueError) as e:
         db.session.rollback()
@@ -187,56 +153,133 @@ def delete_message(user, msg_id):
         if user.id != message.author_id:
             return error_response(403, "Cannot delete another user's message.")
 
-        db.session.delete(
-            Notification.find_by_attr(subject='message', item_id=msg_id))
-        message.delete()
+        chat_id = message.chat_id
+        chat = message.chat
+        recipient_id = chat.user2_id if user.id == chat.user1_id \
+            else chat.user1_id
+        LastReadMessage.remove_unread(
+            recipient_id, chat_id, message.created_on)
+        notif = Notification.find_by_attr(subject='message', item_id=msg_id)
+
+        if notif:
+            notif.remove()
+        # read before the delete, whose foreign key nulls the pointer
+        was_last = chat.last_message_id == msg_id
+        db.session.delete(message)
+        db.session.flush()
+
+        if was_last:
+            Chat.refresh_last_messages(chat_id, chat_id)
+        db.session.commit()
         return {'message': 'Successfully deleted.'}
     except (IntegrityError, ValueError):
         db.session.rollback()
         return server_error('Something went wrong, please try again.')
 
 
-@messages.route('/notifications/count', methods=['GET'])
+@messages.route('/events', methods=['GET'])
 @authenticate
-def get_notifications_count(user):
-    """Get the count of new notifications"""
+def get_events(user):
+    """
+    Wait for the user's new messages and notifications. Clients send
+    back the cursor of the last response, and refetch their lists when
+    `missed` is set. With `Accept: text/event-stream` the events are
+    streamed as server-sent events instead.
+    """
+    after = request.args.get('cursor', None, int)
+    max_timeout = current_app.config['EVENT_WAIT_TIMEOUT']
+    timeout = min(request.args.get('timeout', max_timeout, float), max_timeout)
+    broker = current_app.broker
+    channels = [user_channel(user.id)]
+
+    # waiting clients don't hold on to a database connection
+    db.session.remove()
+
+    if request.accept_mimetypes.best == 'text/event-stream':
+        if after is None:
+            after = request.headers.get('Last-Event-ID', None, int)
+
+        def stream(after):
+            while True:
+                events, after, missed = broker.wait(channels, after, timeout)
+
+                if missed:
+                    yield f'id: {after}\nevent: reset\ndata: {{}}\n\n'
+
+                for event in events:
+                    yield (f'id: {event["id"]}\nevent: {event["type"]}\n'
+                           f'data: {json.dumps(event["data"])}\n\n')
+
+                if not events and not missed:
+                    yield ': keep-alive\n\n'
+
+        return Response(
+            stream_with_context(stream(after)),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    events, cursor, missed = broker.wait(channels, after, timeout)
     return {
-        'count': user.get_notifications().filter(
-            Notification.timestamp > user.last_notif_read_time).count()
+        'data': events,
+        'cursor': cursor,
+        'missed': missed,
     }
 
 
+@messages.route('/notifications/count', methods=['GET'])
+@authenticate
+def get_notifications_count(user):
+    """
+    Get the count of new notifications. The response carries the
+    version of the user's notifications as its ETag, and clients that
+    send it back in If-None-Match get a 304 until something changes.
+    """
+    count, version = db.session.query(
+        User.unread_notifs, User.notifs_version).filter(
+            User.id == user.id).one()
+    etag = f'{user.id}.{version}'
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify({'count': count})
+
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
 @messages.route('/notifications', methods=['GET'])
 @authenticate
 def get_notifications(user):
-    cursor = request.args.get('cursor')
-    items_per_page = current_app.config['ITEMS_PER_PAGE']
-    nextCursor = None
-    notifs = None
+    after, limit = page_args()
 
     try:
-        if cursor == '0':
-            notifs = user.get_notifications().limit(items_per_page + 1).all()
-        else:
-            cursor = urlsafe_base64(cursor, from_base64=True)
-            notifs = user.get_notifications().filter(
-                Notification.timestamp < cursor).limit(
-                    items_per_page + 1).all()
-
-        if len(notifs) > items_per_page:
-            nextCursor = urlsafe_base64(
-                notifs[items_per_page - 1].timestamp.isoformat())
-
-        user.last_notif_read_time = datetime.utcnow()
-        user.save()
+        notifs, nextCursor = paginate(
+            user.get_notifications(),
+            (Notification.timestamp.desc(), Notification.id.desc()),
+            after, limit)
+
+        User.read_notifs(user.id)
+        db.session.commit()
     except (IntegrityError, ValueError) as e:
         db.session.rollback()
         print(e)
         return server_error('Something went wrong, please try again.')
     else:
+        sampled = {id for notif in notifs for id in notif.actor_sample or []}
+        actors = {actor['id']: actor for actor in UserSchema(
+            many=True, only=('id', 'profile',)).dump(
+                User.query.filter(User.id.in_(sampled)).all()
+                if sampled else [])}
+        data = NotificationSchema(many=True).dump(notifs)
+
+        for notif, item in zip(notifs, data):
+            item['actors'] = [actors[id] for id in notif.actor_sample or []
+                              if id in actors]
+
         return {
-            'data': NotificationSchema(many=True).dump(
-                notifs[:items_per_page]),
+            'data': data,
             'nextCursor': nextCursor
         }
 
@@ -250,10 +293,11 @@ def delete_notification(user, notif_id):
         if not notif:
             return not_found('Notification not found.')
 
-        if user.id != notif.owner_id:
+        if user.id != notif.user_id:
             return error_response(403, "Not allowed!")
 
-        notif.delete()
+        notif.remove()
+        db.session.commit()
         return {'message': 'Successfully removed.'}
     except (IntegrityError, ValueError) as e:
         db.session.rollback()
@@ -0,0 +1,68 @@
+from flask import current_app
+
+from src import db
+from src.lib.jobs import handler
+from src.lib.broker import user_channel
+from src.blueprints.messages.models import Notification
+from src.blueprints.posts.models import Post
+
+
+@handler('fan_out_post')
+def fan_out_post(job):
+    """
+    Add a new post to the home timelines of its author's followers and
+    of the subscribers of its tags.
+
+    :param job: Job with the post_id payload
+    :return: None
+    """
+    from src.blueprints.users.models import TimelineEntry
+
+    post = Post.find_by_id(job.payload['post_id'])
+
+    if post is None:
+        return
+
+    TimelineEntry.fan_out(post, post.author)
+
+
+@handler('notify_followers')
+def notify_followers(job):
+    """
+    Notify the followers of a post's author, one chunk of followers per
+    transaction. Each chunk is a single bulk INSERT committed with the
+    job's progress, so a retried job picks up after the last chunk.
+
+    :param job: Job with the post_id payload
+    :return: None
+    """
+    from src.blueprints.users.models import User, followers
+
+    post = Post.find_by_id(job.payload['post_id'])
+
+    if post is None:
+        return
+
+    chunk_size = current_app.config['NOTIFY_FOLLOWERS_CHUNK_SIZE']
+    after = job.payload.get('after', 0)
+
+    while True:
+        ids = [id for id, in db.session.query(followers.c.follower_id).filter(
+            followers.c.followed_id == post.user_id,
+            followers.c.follower_id > after).order_by(
+                followers.c.follower_id).limit(chunk_size)]
+
+        if not ids:
+            break
+
+        db.session.execute(Notification.__table__.insert(), [
+            {'subject': 'post', 'item_id': post.id, 'user_id': id,
+             'doer_id': post.user_id, 'post_id': post.id,
+             'actor_sample': [post.user_id]} for id in ids])
+        User.notifs_changed(ids, unread=1)
+        current_app.broker.publish_many(
+            [user_channel(id) for id in ids], 'post',
+            {'postId': post.id, 'authorId': post.user_id})
+        after = ids[-1]
+        job.checkpoint(after=after)
+        db.session.commit()
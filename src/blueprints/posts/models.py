@@ -1,4 +1,9 @@
+import math
+from datetime import datetime
+from flask import current_app
 from sqlalchemy.sql import func
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm.attributes import set_committed_value
 from src import db
 from src.lib.mixins import ResourceMixin
 
@@ -16,7 +21,10 @@ post_likes = db.Table(
         db.Integer,
         db.ForeignKey('posts.id', ondelete='CASCADE',  onupdate='CASCADE'),
         primary_key=True
-    )
+    ),
+    db.Column('created_on', db.DateTime, default=datetime.utcnow),
+    # a post's latest likers sample its like notifications
+    db.Index('ix_post_likes_post_created', 'post_id', 'created_on')
 )
 
 
@@ -37,8 +45,31 @@ post_tags = db.Table(
 )
 
 
+def hot_score(reactions, created_on):
+    '''
+    Rank a post by its reactions, decayed by its age. Every
+    HOT_SCORE_DECAY seconds of age weigh as much as a tenfold increase
+    in reactions. Newer posts score higher by construction, so scores
+    only need updating when reactions change.
+    '''
+    age = (created_on - datetime(2020, 1, 1)).total_seconds()
+    return round(math.log10(max(reactions, 1)) +
+                 age / current_app.config['HOT_SCORE_DECAY'], 7)
+
+
+def initial_hot_score(context):
+    created_on = context.get_current_parameters().get('created_on')
+    return hot_score(0, created_on or datetime.utcnow())
+
+
 class Post(db.Model, ResourceMixin):
     __tablename__ = 'posts'
+    __table_args__ = (
+        db.Index('ix_posts_hot_score', 'hot_score', 'id'),
+        # keysets of the post lists, see `src.lib.pagination`
+        db.Index('ix_posts_created_on', 'created_on', 'id'),
+        db.Index('ix_posts_user_created_on', 'user_id', 'created_on', 'id'),
+    )
 
     # Identification
     id = db.Column(db.Integer, primary_key=True)
@@ -46,6 +77,10 @@ class Post(db.Model, ResourceMixin):
     user_id = db.Column(db.Integer, db.ForeignKey(
         'users.id', ondelete='CASCADE', onupdate='CASCADE'))
     comment_id = db.Column(db.Integer, db.ForeignKey('posts.id'))
+    # denormalized reaction counters, see `bump_counters`
+    like_count = db.Column(db.Integer, default=0, nullable=False)
+    comment_count = db.Column(db.Integer, default=0, nullable=False)
+    hot_score = db.Column(db.Float, default=initial_hot_score, nullable=False)
     # relationships
     comments = db.relationship(
         "Post", lazy='dynamic', backref=db.backref('parent', remote_side=[id]))
@@ -62,21 +97,86 @@ class Post(db.Model, ResourceMixin):
         return self.likes.filter(
             post_likes.c.user_id == user.id).count() > 0
 
+    def get_liker_ids(self):
+        '''Get the ids of the users who like the post, latest first.'''
+        return db.session.query(post_likes.c.user_id).filter(
+            post_likes.c.post_id == self.id).order_by(
+                post_likes.c.created_on.desc(), post_likes.c.user_id.desc())
+
+    def get_commenter_ids(self, exclude=None):
+        '''
+        Get the ids of the users who commented on the post, by their
+        latest comment, leaving out one comment.
+        '''
+        return db.session.query(Post.user_id).filter(
+            Post.comment_id == self.id, Post.id != exclude).group_by(
+                Post.user_id).order_by(func.max(Post.created_on).desc())
+
+    def get_comment_ids(self, exclude=None):
+        '''Get the ids of the post's comments, latest first.'''
+        return db.session.query(Post.id).filter(
+            Post.comment_id == self.id, Post.id != exclude).order_by(
+                Post.created_on.desc(), Post.id.desc())
+
+    def has_other_comment_by(self, user, exclude):
+        return db.session.query(Post.id).filter(
+            Post.comment_id == self.id, Post.user_id == user.id,
+            Post.id != exclude).first() is not None
+
+    @classmethod
+    def bump_counters(cls, post_id, likes=0, comments=0):
+        '''
+        Atomically adjust a post's reaction counters in the current
+        transaction, so concurrent updates do not overwrite each other.
+        '''
+        cls.query.filter(cls.id == post_id).update({
+            cls.like_count: cls.like_count + likes,
+            cls.comment_count: cls.comment_count + comments,
+        }, synchronize_session=False)
+
+    @classmethod
+    def refresh_hot_score(cls, post_id):
+        '''
+        Recompute a post's hot score from its counters. Run it after
+        `bump_counters` in the same transaction, whose row lock keeps
+        concurrent reactions from interleaving.
+        '''
+        likes, comments, created_on = db.session.query(
+            cls.like_count, cls.comment_count, cls.created_on).filter(
+                cls.id == post_id).one()
+        cls.query.filter(cls.id == post_id).update({
+            cls.hot_score: hot_score(likes + comments, created_on)
+        }, synchronize_session=False)
+
+    @classmethod
+    def rebuild_hot_scores(cls, first_id, last_id):
+        '''Recompute the hot scores of the posts with ids in a range.'''
+        db.session.bulk_update_mappings(cls, [{
+            'id': id,
+            'hot_score': hot_score(likes + comments, created_on),
+        } for id, likes, comments, created_on in db.session.query(
+            cls.id, cls.like_count, cls.comment_count, cls.created_on).filter(
+                cls.id >= first_id, cls.id <= last_id)])
+        db.session.commit()
+
+    @classmethod
+    def reconcile_counters(cls, first_id, last_id):
+        '''Recount the reactions of the posts with ids in a range.'''
+        comments = db.aliased(cls)
+        cls.query.filter(cls.id >= first_id, cls.id <= last_id).update({
+            cls.like_count: db.select([func.count()]).where(
+                post_likes.c.post_id == cls.id).as_scalar(),
+            cls.comment_count: db.select([func.count(comments.id)]).where(
+                comments.comment_id == cls.id).as_scalar(),
+        }, synchronize_session=False)
+        db.session.commit()
+
     @classmethod
     def get_reactions(cls):
         '''Gets all posts and their reactions.'''
-        posts = cls.query.filter(cls.comment_id.is_(None)).subquery()
-        ncomments = db.session.query(posts.c.id, func.count(cls.id).label(
-            'num_comments')).outerjoin(
-                cls, posts.c.id == cls.comment_id).group_by(
-                    posts.c.id).subquery()
-        nlikes = db.session.query(cls.id, func.count(
-            post_likes.c.post_id).label('num_likes')).join(
-                post_likes, cls.id == post_likes.c.post_id).group_by(
-                    cls.id).subquery()
-        return db.session.query(ncomments.c.id, (
-            ncomments.c.num_comments + nlikes.c.num_likes).label(
-                'reactions')).outerjoin(nlikes, ncomments.c.id == nlikes.c.id)
+        return db.session.query(cls.id, (
+            cls.comment_count + cls.like_count).label('reactions')).filter(
+                cls.comment_id.is_(None))
 
     @classmethod
     def get_by_reactions(cls):
@@ -87,23 +187,82 @@ class Post(db.Model, ResourceMixin):
                 cls, posts.c.id == Post.id)
 
     def to_dict(self, auth):
-        return {
-            'id': self.id,
-            'body': self.body,
-            'likes': self.likes.count(),
-            'comments': self.comments.count(),
-            'isLiked': self.is_liked_by(auth),
-            'created_on': self.created_on,
+        return Post.to_dicts([self], auth)[0]
+
+    @classmethod
+    def to_dicts(cls, posts, auth):
+        """
+        Serialize a list of posts for a viewer. The viewer's likes and
+        follows, tags and author profiles are each fetched with one
+        grouped query for the whole list.
+
+        :param posts: List of Post instances
+        :param auth: The viewing User instance
+        :return: list of dict
+        """
+        from src.blueprints.users.models import followers
+        from src.blueprints.profiles.models import Profile
+        from src.blueprints.tags.models import Tag
+
+        if not posts:
+            return []
+
+        ids = [post.id for post in posts]
+        author_ids = {post.user_id for post in posts}
+
+        liked = {post_id for post_id, in db.session.query(
+            post_likes.c.post_id).filter(
+                post_likes.c.post_id.in_(ids),
+                post_likes.c.user_id == auth.id)}
+        following = {user_id for user_id, in db.session.query(
+            followers.c.followed_id).filter(
+                followers.c.follower_id == auth.id,
+                followers.c.followed_id.in_(author_ids))}
+        profiles = {profile.user_id: profile
+                    for profile in Profile.query.filter(
+                        Profile.user_id.in_(author_ids))}
+
+        tags = {}
+        for post_id, tag_id, name in db.session.query(
+                post_tags.c.post_id, Tag.id, Tag.name).join(
+                    Tag, Tag.id == post_tags.c.tag_id).filter(
+                        post_tags.c.post_id.in_(ids)):
+            tags.setdefault(post_id, []).append({'id': tag_id, 'name': name})
+
+        return [{
+            'id': post.id,
+            'body': post.body,
+            'likes': post.like_count,
+            'comments': post.comment_count,
+            'isLiked': post.id in liked,
+            'created_on': post.created_on,
             'author': {
-                'id': self.author.id,
-                'username': self.author.profile.username,
-                'name': self.author.profile.name,
-                'avatar': self.author.profile.avatar,
-                'isFollowing': auth.is_following(self.author)
-                if auth.id != self.author.id else None,
+                'id': post.user_id,
+                'username': profiles[post.user_id].username,
+                'name': profiles[post.user_id].name,
+                'avatar': profiles[post.user_id].avatar,
+                'isFollowing': post.user_id in following
+                if auth.id != post.user_id else None,
             },
-            'tags': [{
-                'id': tag.id,
-                'name': tag.name,
-            } for tag in self.tags],
-        }
+            'tags': tags.get(post.id, []),
+        } for post in posts]
+
+    @classmethod
+    def load_parents(cls, posts):
+        """
+        Load the parents of a list of comments, with their authors, in
+        one query so that accessing `parent` does not hit the database.
+
+        :param posts: List of Post instances
+        :return: None
+        """
+        parent_ids = {post.comment_id for post in posts if post.comment_id}
+
+        if not parent_ids:
+            return
+
+        parents = {parent.id: parent for parent in cls.query.options(
+            joinedload(cls.author)).filter(cls.id.in_(parent_ids))}
+
+        for post in posts:
+            set_committed_value(post, 'parent', parents.get(post.comment_id))
@@ -1,15 +1,18 @@
-import random
 from sqlalchemy import exc
-from sqlalchemy.sql import func
 from flask import url_for, request, jsonify, Blueprint, current_app
 
 from src import db
-from src.lib import urlsafe_base64
 from src.lib.auth import authenticate
+from src.lib.broker import user_channel
+from src.lib.jobs import enqueue
+from src.lib.pagination import page_args, paginate, split_page
 from src.blueprints.errors import server_error, bad_request, \
     not_found, error_response
 from src.blueprints.messages.models import Notification
 from src.blueprints.posts.models import Post
+from src.blueprints.posts import jobs  # noqa: F401, registers job handlers
+from src.blueprints.users.models import TimelineEntry
+from src.blueprints.tags.models import Tag, TagStats
 from src.blueprints.posts.schema import PostSchema
 
 
@@ -24,8 +27,8 @@ def ping():
 @posts.route('/posts/featured', methods=['GET'])
 def get_featured_posts():
     try:
-        res = Post.query.filter(Post.comment_id.is_(None)).all()
-        posts = random.sample(res, k=5)
+        posts = current_app.featured_posts.sample(
+            current_app.config['FEATURED_POSTS'])
     except Exception:
         return server_error('Something went wrong, please try again.')
 
@@ -57,49 +60,24 @@ def get_post(user, post_id):
 @authenticate
 def get_posts(user):
     feed = request.args.get('feed')
-    cursor = request.args.get('cursor')
-    items_per_page = current_app.config['ITEMS_PER_PAGE']
-    nextCursor = None
-    query = ''
+    after, limit = page_args()
 
     try:
-        sorted_posts = Post.get_by_reactions().subquery()
-        top_posts = db.session.query(Post, sorted_posts.c.sequence).join(
-            sorted_posts, sorted_posts.c.id == Post.id).order_by(
-                sorted_posts.c.sequence.desc())
-        latest_posts = Post.query.filter(
-            Post.comment_id.is_(None)).order_by(Post.created_on.desc())
+        query = Post.query.filter(Post.comment_id.is_(None))
+
+        if feed == 'latest':
+            posts, nextCursor = paginate(
+                query, (Post.created_on.desc(), Post.id.desc()), after, limit)
+        else:
+            posts, nextCursor = paginate(
+                query, (Post.hot_score.desc(), Post.id.desc()), after, limit)
     except Exception as e:
         db.session.rollback()
         print(e)
         return server_error('An unexpected error occured, please try again.')
 
-    if cursor == '0' and feed == 'latest':
-        query = latest_posts.limit(items_per_page + 1).all()
-    elif cursor == '0' and feed == 'top':
-        query = top_posts.limit(items_per_page + 1).all()
-    else:
-        if feed == 'latest':
-            cursor = urlsafe_base64(cursor, from_base64=True)
-            query = latest_posts.filter(
-                Post.created_on < cursor).limit(items_per_page + 1).all()
-        else:
-            cursor = urlsafe_base64(cursor, from_base64=True)
-            query = top_posts.filter(sorted_posts.c.sequence < cursor).limit(
-                items_per_page + 1).all()
-
-    if len(query) > items_per_page:
-        nextCursor = urlsafe_base64(
-            query[items_per_page - 1].created_on.isoformat()) \
-                if feed == 'latest' else urlsafe_base64(
-            str(query[items_per_page - 1][1]))
-
-    posts = [post.to_dict(user) for post in query[:items_per_page]] \
-        if feed == 'latest' else \
-            [post[0].to_dict(user) for post in query[:items_per_page]]
-
     return {
-        'data': posts,
+        'data': Post.to_dicts(posts, user),
         'nextCursor': nextCursor
     }
 
@@ -108,57 +86,24 @@ def get_posts(user):
 @authenticate
 def posts_feed(user):
     latest = request.args.get('latest')
-    top = request.args.get('top')
-    cursor = request.args.get('cursor')
-    items_per_page = current_app.config['ITEMS_PER_PAGE']
-    nextCursor = None
-    query = ''
+    after, limit = page_args()
 
     try:
-        followed_posts = user.get_followed_posts().subquery()
-        posts_reactions = Post.get_reactions().subquery()
-        top_followed_posts = db.session.query(
-            followed_posts, func.row_number().over(
-                order_by=posts_reactions.c.reactions).label(
-                    'sequence')).outerjoin(
-                        posts_reactions, followed_posts.c.posts_id ==
-                        posts_reactions.c.id).subquery()
-
-        top_posts = db.session.query(Post, top_followed_posts.c.sequence).join(
-            Post, top_followed_posts.c.posts_id == Post.id).order_by(
-                    top_followed_posts.c.sequence.desc())
-
-        latest_posts = db.session.query(Post, followed_posts.c.posts_id).join(
-            Post, Post.id == followed_posts.c.posts_id).order_by(
-                Post.created_on.desc())
+        if latest:
+            posts, nextCursor = split_page(
+                user.get_timeline(limit + 1, after), limit,
+                lambda post: (post.created_on, post.id))
+        else:
+            posts, nextCursor = paginate(
+                Post.query.filter(Post.id.in_(user.get_timeline_posts())),
+                (Post.hot_score.desc(), Post.id.desc()), after, limit)
     except Exception as e:
         db.session.rollback()
         print(e)
         return server_error('An unexpected error occured, please try again.')
 
-    if cursor == '0' and latest:
-        query = latest_posts.limit(items_per_page + 1).all()
-    elif cursor == '0' and top:
-        query = top_posts.limit(items_per_page + 1).all()
-    else:
-        if latest:
-            cursor = urlsafe_base64(cursor, from_base64=True)
-            query = latest_posts.filter(
-                Post.created_on < cursor).limit(items_per_page + 1).all()
-        else:
-            cursor = urlsafe_base64(cursor, from_base64=True)
-            query = top_posts.filter(
-                top_followed_posts.c.sequence < cursor).limit(
-                    items_per_page + 1).all()
-
-    if len(query) > items_per_page:
-        nextCursor = urlsafe_base64(
-            query[items_per_page - 1][0].created_on.isoformat()) \
-                if latest else urlsafe_base64(
-            str(query[items_per_page - 1][1]))
-
     return {
-        'data': [post[0].to_dict(user) for post in query[:items_per_page]],
+        'data': Post.to_dicts(posts, user),
         'nextCursor': nextCursor
     }
 
@@ -172,22 +117,42 @@ def create_post(user, post_id=None):
     if not req_data:
         return bad_request("No request data provided")
 
+    tag_ids = req_data.get('tags') or []
+
+    if not isinstance(tag_ids, list) or not all(
+            isinstance(tag_id, int) for tag_id in tag_ids):
+        return bad_request('Tags must be a list of tag ids.')
+
     post = Post()
     post.body = req_data.get('post')
     post.user_id = user.id
+    post.comment_id = post_id
+
+    # only posts are tagged, not comments
+    if tag_ids and not post_id:
+        post.tags = Tag.query.filter(Tag.id.in_(tag_ids)).all()
     db.session.add(post)
+    db.session.flush()
+    TagStats.count_posts(
+        [tag.id for tag in post.tags], post.created_on, 1)
 
     if post_id:
-        post.comment_id = post_id
         parent = Post.find_by_id(post_id)
-        db.session.add(user.add_notification(subject='comment',
-            item_id=post.id, id=parent.author.id, post_id=parent.id))
+        Post.bump_counters(parent.id, comments=1)
+        Post.refresh_hot_score(parent.id)
+
+        # commenters count once however many comments they leave
+        if not parent.has_other_comment_by(user, exclude=post.id):
+            Notification.aggregate(
+                'comment', parent.id, parent.user_id, user.id,
+                item_id=post.id, post_id=parent.id)
+        current_app.broker.publish(
+            user_channel(parent.author.id), 'notification',
+            {'subject': 'comment', 'itemId': post.id, 'postId': parent.id})
     else:
-        post_notifs = []
-        for u in user.followers.all():
-            post_notifs.append(user.add_notification(
-                    subject='post', item_id=post.id, id=u.id, post_id=post.id))
-        db.session.add_all(post_notifs)
+        TimelineEntry.add(post)
+        enqueue('fan_out_post', post_id=post.id)
+        enqueue('notify_followers', post_id=post.id)
 
     try:
         post.save()
@@ -213,14 +178,26 @@ def delete_post(user, post_id):
     if post.user_id != user.id:
         return error_response(401, "You cannot delete someone else's post.")
 
-    post_notif = Notification.find_by_attr(subject='post', item_id=post.id)
-    comment_notif = Notification.find_by_attr(
-        subject='comment', item_id=post.id)
-
-    [db.session.delete(notif) for notif in post_notif] if post_notif \
-        else db.session.delete(comment_notif)
-
     try:
+        Notification.remove_for_post(post.id)
+
+        if post.comment_id:
+            parent = post.parent
+
+            if not parent.has_other_comment_by(user, exclude=post.id):
+                Notification.retract(
+                    'comment', parent.id, parent.user_id, user.id,
+                    parent.get_commenter_ids(exclude=post.id))
+            Notification.repoint(
+                'comment', parent.id, parent.user_id, post.id,
+                parent.get_comment_ids(exclude=post.id))
+            Post.bump_counters(post.comment_id, comments=-1)
+            Post.refresh_hot_score(post.comment_id)
+        else:
+            TimelineEntry.query.filter_by(post_id=post.id).delete(
+                synchronize_session=False)
+        TagStats.count_posts(
+            [tag.id for tag in post.tags], post.created_on, -1)
         post.delete()
     except (exc.IntegrityError, ValueError):
         db.session.rollback()
@@ -240,12 +217,21 @@ def update_like(user, post_id):
     try:
         if post.is_liked_by(user):
             post.likes.remove(user)
-            db.session.delete(
-                Notification.find_by_attr(subject='like', item_id=post.id))
+            Post.bump_counters(post.id, likes=-1)
+            Post.refresh_hot_score(post.id)
+            Notification.retract(
+                'like', post.id, post.user_id, user.id,
+                post.get_liker_ids())
         else:
             post.likes.append(user)
-            db.session.add(user.add_notification(
-                'like', item_id=post.id, id=post.author.id, post_id=post.id))
+            Post.bump_counters(post.id, likes=1)
+            Post.refresh_hot_score(post.id)
+            Notification.aggregate(
+                'like', post.id, post.user_id, user.id, item_id=post.id,
+                post_id=post.id)
+            current_app.broker.publish(
+                user_channel(post.author.id), 'notification',
+                {'subject': 'like', 'itemId': post.id, 'postId': post.id})
 
         post.save()
     except (exc.IntegrityError, ValueError):
@@ -263,27 +249,14 @@ def get_post_comments(user, post_id):
     if not post:
         return not_found('Post not found.')
 
-    cursor = request.args.get('cursor')
-    items_per_page = current_app.config['ITEMS_PER_PAGE']
-    nextCursor = None
-    query = ''
-
-    if cursor == '0':
-        query = post.comments.order_by(
-            Post.created_on.desc()).limit(items_per_page + 1).all()
-    else:
-        cursor = urlsafe_base64(cursor, from_base64=True)
-        query = post.comments.order_by(
-            Post.created_on.desc()).filter(
-                Post.created_on < cursor).limit(items_per_page + 1).all()
+    after, limit = page_args()
+    page, nextCursor = paginate(
+        post.comments, (Post.created_on.desc(), Post.id.desc()), after, limit)
 
-    if len(query) > items_per_page:
-        nextCursor = urlsafe_base64(
-            query[items_per_page - 1].created_on.isoformat())
+    Post.load_parents(page)
 
     comments = []
-    for c in query[:items_per_page]:
-        comment = c.to_dict(user)
+    for c, comment in zip(page, Post.to_dicts(page, user)):
         comment['parent'] = PostSchema(
             only=('id', 'body', 'author',)).dump(c.parent)
         comments.append(comment)
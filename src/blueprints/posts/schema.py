@@ -7,8 +7,8 @@ class PostSchema(Schema):
         'PostSchema', only=('id', 'body', 'author',), dump_only=True)
     tags = fields.Nested(
         'TagSchema', only=('id', 'name',), many=True, dump_only=True)
-    likes = fields.Function(lambda post: post.likes.count())
-    comments = fields.Function(lambda post: post.comments.count())
+    likes = fields.Int(attribute='like_count', dump_only=True)
+    comments = fields.Int(attribute='comment_count', dump_only=True)
     author = fields.Nested('UserSchema', only=(
         'id', 'profile',), dump_only=True)
 
@@ -2,11 +2,13 @@ import random
 from hashlib import md5
 
 from src import db
-from src.lib.mixins import ResourceMixin
+from src.lib.mixins import ResourceMixin, SearchableMixin
 
 
-class Profile(db.Model, ResourceMixin):
+class Profile(db.Model, ResourceMixin, SearchableMixin):
     __tablename__ = 'profiles'
+    __search_index__ = 'users'
+    __search_fields__ = ('name', 'username', 'avatar')
 
     # Identification
     id = db.Column(db.Integer, primary_key=True)
@@ -25,6 +27,12 @@ class Profile(db.Model, ResourceMixin):
     def __repr__(self):
         return f'<Profile: {self.name}>'
 
+    def identity_key(self):
+        return self.user_id
+
+    def search_key(self):
+        return self.user_id
+
     @staticmethod
     def set_avatar(email, size=128):
         digest = md5(email.lower().encode('utf-8')).hexdigest()
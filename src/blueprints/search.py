@@ -1,8 +1,8 @@
-from flask import Blueprint, request
+from flask import Blueprint, current_app, request
 
 from src import db
 from src.lib.auth import authenticate
-from src.lib.search import TagsIndex, UsersIndex
+from src.lib.search import TagsIndex, UsersIndex, search_many
 from src.blueprints.errors import server_error
 from src.blueprints.users.models import User
 from src.blueprints.tags.models import Tag
@@ -17,6 +17,41 @@ def ping():
     return {'message': 'Search Route!'}
 
 
+def render_source_results(user, tags, users):
+    """
+    Render search results from the documents' display fields, only
+    looking up whether the user follows them.
+
+    :param user: The user searching
+    :param tags: Tag hits
+    :param users: User hits
+    :return: dict
+    """
+    followed_tags, followed_users = user.following_among(
+        [tag['id'] for tag in tags], [hit['id'] for hit in users])
+
+    return {
+        'results': {
+            'tags': [{
+                'id': tag['id'],
+                'name': tag['name'],
+                'isFollowing': tag['id'] in followed_tags,
+                'followerCount': tag.get('followers', 0),
+            } for tag in tags],
+            'users': [{
+                'id': hit['id'],
+                'profile': {
+                    'username': hit['username'],
+                    'name': hit['name'],
+                    'avatar': hit.get('avatar'),
+                },
+                'isFollowing': hit['id'] in followed_users,
+                'followerCount': hit.get('followers', 0),
+            } for hit in users],
+        }
+    }
+
+
 @search.route('', methods=['GET'])
 @authenticate
 def mainSearch(user):
@@ -26,11 +61,16 @@ def mainSearch(user):
         if q is None:
             return {[]}
 
-        tags = Tag.search(TagsIndex, q)
-        users = User.search(UsersIndex, q)
+        (tags, _), (users, _) = search_many([TagsIndex, UsersIndex], q)
+
+        if request.args.get('view') == 'source':
+            return render_source_results(user, tags, users)
+
+        tags = Tag.get_ranked([hit['id'] for hit in tags])
+        users = User.get_ranked([hit['id'] for hit in users])
     except Exception as e:
         db.session.rollback()
-        print(e)
+        current_app.logger.exception(e)
         return server_error('An unexpected error occured, please try again.')
     return {
         'results': {
@@ -56,7 +96,7 @@ def msg_Search(user):
         users = User.search(UsersIndex, q)
     except Exception as e:
         db.session.rollback()
-        print(e)
+        current_app.logger.exception(e)
         return server_error('An unexpected error occured, please try again.')
     return {
             'users': UserSchema(
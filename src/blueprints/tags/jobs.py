@@ -0,0 +1,14 @@
+from src.lib.jobs import handler
+from src.blueprints.tags.models import TagStats
+
+
+@handler('rollup_tag_stats')
+def rollup_tag_stats(job):
+    """
+    Drop the posts that aged out of the tag stats windows. `run_jobs`
+    queues it again TAG_STATS_INTERVAL seconds after the last run.
+
+    :param job: Job without payload
+    :return: None
+    """
+    TagStats.rollup()
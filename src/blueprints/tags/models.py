@@ -1,44 +1,219 @@
 import random
+from datetime import datetime, timedelta
+from sqlalchemy import and_, case, exists, select
 from sqlalchemy.sql import func
 from src import db
 from src.lib.mixins import ResourceMixin, SearchableMixin
-from src.blueprints.posts.models import post_tags
+from src.blueprints.posts.models import Post, post_tags
 from src.blueprints.users.schema import UserSchema
 
 
 class Tag(db.Model, ResourceMixin, SearchableMixin):
     __tablename__ = 'tags'
+    __search_index__ = 'tags'
+    __search_fields__ = ('name',)
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(32), nullable=False, index=True, unique=True)
+    follower_count = db.Column(db.Integer, default=0, nullable=False)
+    # ids of the most recent followers, picked from for tag cards
+    follower_sample = db.Column(db.JSON, default=list, nullable=False)
+    sample_size = 10
 
     def __repr__(self):
         return f'<Tag {self.name}>'
 
     @classmethod
-    def get_top_tags(cls, user):
-        tags = cls.query.except_(user.tags).subquery()
-        return db.session.query(tags.c.tags_id, func.count(
-            post_tags.c.tag_id).label('nPosts')).join(
-                post_tags, tags.c.tags_id == post_tags.c.tag_id).group_by(
-                    tags.c.tags_id)
+    def get_top_tags(cls, user, window='all'):
+        '''
+        Get the tags with posts in a window that a user doesn't follow,
+        with their post count in the window, as an anti-join of the
+        rolled up tag stats.
+        '''
+        from src.blueprints.users.models import user_tags
 
-    def to_dict(self, user):
-        followers = []
-        count = 0
+        count = TagStats.window_column(window)
+        return db.session.query(cls, count.label('nPosts')).join(
+            TagStats, TagStats.tag_id == cls.id).filter(
+                count > 0, ~exists().where(and_(
+                    user_tags.c.user_id == user.id,
+                    user_tags.c.tag_id == TagStats.tag_id)))
+
+    def lock(self):
+        '''
+        Reload the tag and lock its row until the transaction ends, so
+        concurrent follows and unfollows update the sample in turn.
+        '''
+        Tag.query.filter(Tag.id == self.id).with_for_update(
+        ).populate_existing().one()
+
+    def add_follower(self, user):
+        '''Count a new follower and rotate them into the sample.'''
+        self.lock()
+        Tag.query.filter(Tag.id == self.id).update({
+            Tag.follower_count: Tag.follower_count + 1
+        }, synchronize_session=False)
+        self.search_touch()
+        sample = [id for id in self.follower_sample or [] if id != user.id]
+        self.follower_sample = [user.id] + sample[:self.sample_size - 1]
+
+    def remove_follower(self, user):
+        '''
+        Uncount a follower. When they were in the sample it is refilled
+        with the most recent remaining followers.
+        '''
+        from src.blueprints.users.models import user_tags
+
+        self.lock()
+        Tag.query.filter(Tag.id == self.id).update({
+            Tag.follower_count: Tag.follower_count - 1
+        }, synchronize_session=False)
+        self.search_touch()
+
+        if user.id in (self.follower_sample or []):
+            self.follower_sample = [
+                id for id, in db.session.query(user_tags.c.user_id).filter(
+                    user_tags.c.tag_id == self.id,
+                    user_tags.c.user_id != user.id).order_by(
+                        user_tags.c.created_on.desc(),
+                        user_tags.c.user_id.desc()).limit(self.sample_size)]
+
+    @classmethod
+    def reconcile_followers(cls, first_id, last_id):
+        '''Recount the followers of the tags with ids in a range.'''
+        from src.blueprints.users.models import user_tags
 
-        if len(self.users) == 1 or len(self.users) == 2:
-            followers = UserSchema(
-                many=True, only=('id', 'profile',)).dump(user)
+        cls.query.filter(cls.id >= first_id, cls.id <= last_id).update({
+            cls.follower_count: db.select([func.count()]).where(
+                user_tags.c.tag_id == cls.id).as_scalar(),
+        }, synchronize_session=False)
 
-        if len(self.users) > 2:
-            followers = UserSchema(many=True, only=('id', 'profile',)).dump(
-                random.sample(self.users, k=2))
-            count = len(self.users) - 2
+        for tag in cls.query.filter(
+                cls.id >= first_id, cls.id <= last_id).with_for_update():
+            tag.follower_sample = [
+                id for id, in db.session.query(user_tags.c.user_id).filter(
+                    user_tags.c.tag_id == tag.id).order_by(
+                        user_tags.c.created_on.desc(),
+                        user_tags.c.user_id.desc()).limit(cls.sample_size)]
+        db.session.commit()
+
+    def to_dict(self, user):
+        from src.blueprints.users.models import User
+
+        sample = self.follower_sample or []
+        picked = random.sample(sample, k=min(len(sample), 2))
+        followers = UserSchema(many=True, only=('id', 'profile',)).dump(
+            User.query.filter(User.id.in_(picked)).all() if picked else [])
 
         return {
             'id': self.id,
             'name': self.name,
             'isFollowing': user.is_following_tag(self),
-            'followedBy': {'users': followers, 'count': count}
+            'followedBy': {
+                'users': followers,
+                'count': max(self.follower_count - len(followers), 0)
+            }
         }
+
+
+class TagStats(db.Model):
+    __tablename__ = 'tag_stats'
+    __table_args__ = (
+        db.Index('ix_tag_stats_post_count', 'post_count', 'tag_id'),
+        db.Index('ix_tag_stats_posts_1h', 'posts_1h', 'tag_id'),
+        db.Index('ix_tag_stats_posts_24h', 'posts_24h', 'tag_id'),
+        db.Index('ix_tag_stats_posts_7d', 'posts_7d', 'tag_id'),
+    )
+    # window name => (column, length of the window)
+    windows = {
+        'all': ('post_count', None),
+        '1h': ('posts_1h', timedelta(hours=1)),
+        '24h': ('posts_24h', timedelta(days=1)),
+        '7d': ('posts_7d', timedelta(days=7)),
+    }
+
+    tag_id = db.Column(
+        db.Integer,
+        db.ForeignKey('tags.id', ondelete='CASCADE', onupdate='CASCADE'),
+        primary_key=True
+    )
+    post_count = db.Column(db.Integer, default=0, nullable=False)
+    posts_1h = db.Column(db.Integer, default=0, nullable=False)
+    posts_24h = db.Column(db.Integer, default=0, nullable=False)
+    posts_7d = db.Column(db.Integer, default=0, nullable=False)
+    updated_on = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<TagStats tag_{self.tag_id}>'
+
+    @classmethod
+    def window_column(cls, window):
+        if window not in cls.windows:
+            raise ValueError(f'Unknown window "{window}".')
+        return getattr(cls, cls.windows[window][0])
+
+    @classmethod
+    def count_posts(cls, tag_ids, created_on, delta):
+        '''
+        Add a post to the counts of its tags, or take it away with a
+        negative delta, overall and in the windows it still falls in.
+        '''
+        if not tag_ids:
+            return
+
+        age = datetime.utcnow() - created_on
+        values = {}
+
+        for column, length in cls.windows.values():
+            if length is None or age < length:
+                values[getattr(cls, column)] = getattr(cls, column) + delta
+
+        cls.query.filter(cls.tag_id.in_(tag_ids)).update(
+            values, synchronize_session=False)
+
+    @classmethod
+    def rollup(cls):
+        '''
+        Recount the window counts of the tags with posts in the widest
+        window, so the posts that aged out of a window drop from it.
+        The overall count is kept up by `count_posts`.
+        '''
+        now = datetime.utcnow()
+        values = {cls.updated_on: now}
+
+        for column, length in cls.windows.values():
+            if length is not None:
+                values[getattr(cls, column)] = select([func.count()]).where(
+                    and_(post_tags.c.tag_id == cls.tag_id,
+                         post_tags.c.post_id == Post.id,
+                         Post.created_on >= now - length)).as_scalar()
+
+        cls.query.filter(cls.posts_7d > 0).update(
+            values, synchronize_session=False)
+        db.session.commit()
+
+    @classmethod
+    def rebuild(cls):
+        '''
+        Recount the posts of every tag, overall and in each window, with
+        one INSERT ... SELECT.
+        '''
+        now = datetime.utcnow()
+        columns = ['tag_id', 'updated_on']
+        counts = [Tag.id, db.literal(now, db.DateTime)]
+
+        for column, length in cls.windows.values():
+            columns.append(column)
+            counts.append(func.count(Post.id) if length is None else
+                          func.sum(case(
+                              [(Post.created_on >= now - length, 1)],
+                              else_=0)))
+
+        cls.query.delete(synchronize_session=False)
+        db.session.execute(cls.__table__.insert().from_select(
+            columns, select(counts).select_from(
+                Tag.__table__.outerjoin(
+                    post_tags, post_tags.c.tag_id == Tag.id).outerjoin(
+                        Post.__table__, Post.id == post_tags.c.post_id))
+            .group_by(Tag.id)))
+        db.session.commit()
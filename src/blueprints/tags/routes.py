@@ -1,14 +1,16 @@
 from sqlalchemy import exc
 from marshmallow import ValidationError
-from flask import Blueprint, current_app, jsonify, request
+from flask import Blueprint, jsonify, request
 
 from src import db
-from src.lib import urlsafe_base64
 from src.lib.auth import authenticate
+from src.lib.jobs import enqueue
+from src.lib.pagination import page_args, paginate
 from src.blueprints.errors import server_error, error_response, \
     bad_request, not_found
 from src.blueprints.posts.models import Post
-from src.blueprints.tags.models import Tag
+from src.blueprints.tags.models import Tag, TagStats
+from src.blueprints.tags import jobs  # noqa: F401, registers job handlers
 from src.blueprints.tags.schema import TagSchema
 
 
@@ -62,6 +64,9 @@ def add_tag(user):
     tag = Tag(name=name)
 
     try:
+        db.session.add(tag)
+        db.session.flush()
+        db.session.add(TagStats(tag_id=tag.id))
         tag.save()
     except (exc.IntegrityError, ValueError):
         db.session.rollback()
@@ -73,33 +78,24 @@ def add_tag(user):
 @authenticate
 def get_top_tags(user):
     """Get list of top tags not followed by user"""
-    cursor = request.args.get('cursor')
-    items_per_page = current_app.config['ITEMS_PER_PAGE']
-    nextCursor = None
-    tags = None
+    window = request.args.get('window', 'all')
+    after, limit = page_args()
 
-    try:
-        ord_tags = Tag.get_top_tags(user).subquery()
-        query = db.session.query(Tag, ord_tags.c.nPosts).join(
-            ord_tags, Tag.id == ord_tags.c.tags_id).order_by(
-                ord_tags.c.nPosts.desc())
+    if window not in TagStats.windows:
+        return bad_request(f'Unknown window "{window}".')
 
-        if cursor == '0':
-            tags = query.limit(items_per_page + 1).all()
-        else:
-            cursor = urlsafe_base64(cursor, from_base64=True)
-            tags = query.filter(
-                ord_tags.c.nPosts < cursor).limit(items_per_page + 1).all()
+    try:
+        tags, nextCursor = paginate(
+            Tag.get_top_tags(user, window),
+            (TagStats.window_column(window).desc(), TagStats.tag_id.desc()),
+            after, limit, key=lambda row: (row.nPosts, row.Tag.id))
     except (exc.IntegrityError, ValueError) as e:
         db.session.rollback()
         print(e)
         return server_error('Something went wrong, please try again.')
 
-    if len(tags) > items_per_page:
-        nextCursor = urlsafe_base64(str(tags[items_per_page - 1][1]))
-
     return {
-        'data': [tag[0].to_dict(user) for tag in tags[:items_per_page]],
+        'data': [tag[0].to_dict(user) for tag in tags],
         'nextCursor': nextCursor
     }
 
@@ -115,6 +111,7 @@ def follow_tag(user, tag_id):
     try:
         user.unfollow_tag(tag) \
             if user.is_following_tag(tag) else user.follow_tag(tag)
+        enqueue('rebuild_timeline', key=f'user:{user.id}', user_id=user.id)
         user.save()
     except (exc.IntegrityError, ValueError):
         db.session.rollback()
@@ -142,12 +139,8 @@ def get_tag(user):
 @tags.route('/<tag_name>', methods=['GET'])
 @authenticate
 def get_tag_posts(user, tag_name):
-    top = request.args.get('top', default=False)
     latest = request.args.get('latest', default=False)
-    cursor = request.args.get('cursor')
-    items_per_page = current_app.config['ITEMS_PER_PAGE']
-    nextCursor = None
-    query = ''
+    after, limit = page_args()
 
     try:
         tag = Tag.query.filter_by(name=tag_name).first()
@@ -157,46 +150,20 @@ def get_tag_posts(user, tag_name):
         return server_error('An unexpected error occured.')
 
     try:
-        sorted_posts = Post.get_by_reactions().subquery()
-        tag_posts = Post.query.with_parent(tag).subquery()
-        sort_top_posts = db.session.query(
-            tag_posts, sorted_posts.c.sequence).join(
-                sorted_posts, sorted_posts.c.id == tag_posts.c.id).subquery()
-        top_posts = db.session.query(Post, sort_top_posts.c.sequence).join(
-            sort_top_posts, Post.id == sort_top_posts.c.id).order_by(
-                sort_top_posts.c.sequence.desc())
-        latest_posts = Post.query.with_parent(tag).order_by(
-            Post.created_on.desc())
+        query = Post.query.with_parent(tag)
+
+        if latest:
+            posts, nextCursor = paginate(
+                query, (Post.created_on.desc(), Post.id.desc()), after, limit)
+        else:
+            posts, nextCursor = paginate(
+                query, (Post.hot_score.desc(), Post.id.desc()), after, limit)
     except Exception as e:
         db.session.rollback()
         print(e)
         return server_error('An unexpected error occured, please try again.')
 
-    if cursor == '0' and latest:
-        query = latest_posts.limit(items_per_page + 1).all()
-    elif cursor == '0' and top:
-        query = top_posts.limit(items_per_page + 1).all()
-    else:
-        if latest:
-            cursor = urlsafe_base64(cursor, from_base64=True)
-            query = latest_posts.filter(
-                Post.created_on < cursor).limit(items_per_page + 1).all()
-        else:
-            cursor = urlsafe_base64(cursor, from_base64=True)
-            query = top_posts.filter(sort_top_posts.c.sequence < cursor).limit(
-                items_per_page + 1).all()
-
-    if len(query) > items_per_page:
-        nextCursor = urlsafe_base64(
-            query[items_per_page - 1].created_on.isoformat()) \
-                if latest else urlsafe_base64(
-            str(query[items_per_page - 1][1]))
-
-    posts = [post.to_dict(user) for post in query[:items_per_page]] \
-        if latest else \
-            [post[0].to_dict(user) for post in query[:items_per_page]]
-
     return {
-        'data': posts,
+        'data': Post.to_dicts(posts, user),
         'nextCursor': nextCursor
     }
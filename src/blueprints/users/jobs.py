@@ -0,0 +1,63 @@
+from flask import current_app
+
+from src import db
+from src.lib.jobs import handler
+from src.blueprints.users.models import TimelineEntry, FollowSuggestion, \
+    followers
+
+
+@handler('rebuild_timeline')
+def rebuild_timeline(job):
+    """
+    Refill a user's timeline after they followed or unfollowed a user
+    or a tag.
+
+    :param job: Job with the user_id payload
+    :return: None
+    """
+    TimelineEntry.rebuild(
+        job.payload['user_id'], current_app.config['TIMELINE_SIZE'])
+
+
+@handler('rebuild_follow_suggestions')
+def rebuild_follow_suggestions(job):
+    """
+    Recompute the follow candidates of a user who followed or
+    unfollowed someone, then those of their followers, whose
+    candidates go through the users they follow. Followers past
+    FOLLOW_SUGGESTIONS_FANOUT_LIMIT are left to the periodic
+    `build_follow_suggestions` run. Each chunk of followers is
+    committed with the job's progress.
+
+    :param job: Job with the user_id payload
+    :return: None
+    """
+    user_id = job.payload['user_id']
+    size = current_app.config['FOLLOW_SUGGESTIONS_SIZE']
+    chunk_size = current_app.config['FOLLOW_SUGGESTIONS_CHUNK_SIZE']
+    limit = current_app.config['FOLLOW_SUGGESTIONS_FANOUT_LIMIT']
+    done = job.payload.get('done', 0)
+    after = job.payload.get('after')
+
+    if after is None:
+        FollowSuggestion.rebuild(user_id, size)
+        after = 0
+        job.checkpoint(after=after)
+        db.session.commit()
+
+    while done < limit:
+        ids = [id for id, in db.session.query(followers.c.follower_id).filter(
+            followers.c.followed_id == user_id,
+            followers.c.follower_id > after).order_by(
+                followers.c.follower_id).limit(min(chunk_size, limit - done))]
+
+        if not ids:
+            break
+
+        for id in ids:
+            FollowSuggestion.rebuild(id, size)
+
+        after = ids[-1]
+        done += len(ids)
+        job.checkpoint(after=after, done=done)
+        db.session.commit()
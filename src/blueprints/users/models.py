@@ -1,20 +1,46 @@
-import random
+import uuid
 import jwt
 from datetime import datetime, timedelta
 from flask import current_app
-from sqlalchemy import and_
+from sqlalchemy import and_, or_, case, exists, literal, select, union, \
+    union_all
 from sqlalchemy.sql import func
-from sqlalchemy.orm import aliased
 from werkzeug.security import generate_password_hash, check_password_hash
 
 from src import db
 from src.lib.mixins import ResourceMixin, SearchableMixin
-from src.blueprints.posts.models import Post, post_tags
-from src.blueprints.admin.models import Permission
+from src.lib.pagination import seek_after
+from src.blueprints.posts.models import Post, post_likes, post_tags
+from src.blueprints.admin.models import Permission, grp_members, grp_perms, \
+    update_permission_bits
 from src.blueprints.messages.models import Message, Chat, \
     LastReadMessage, Notification
 
 
+class RevokedToken(db.Model):
+    __tablename__ = 'revoked_tokens'
+
+    jti = db.Column(db.String(32), primary_key=True)
+    revoked_on = db.Column(
+        db.DateTime, index=True, default=datetime.utcnow, nullable=False)
+    expires_on = db.Column(db.DateTime, index=True, nullable=False)
+
+    def __repr__(self):
+        return f'<RevokedToken {self.jti}>'
+
+    @classmethod
+    def prune(cls):
+        """
+        Delete revoked tokens that have expired anyway.
+
+        :return: int, number of deleted tokens
+        """
+        count = cls.query.filter(cls.expires_on < datetime.utcnow()).delete(
+            synchronize_session=False)
+        db.session.commit()
+        return count
+
+
 user_perms = db.Table(
     'user_permissions',
     db.Column(
@@ -48,7 +74,11 @@ followers = db.Table(
         'followed_id',
         db.Integer,
         db.ForeignKey('users.id', ondelete='CASCADE', onupdate='CASCADE'),
-        primary_key=True)
+        primary_key=True),
+    db.Column('created_on', db.DateTime, default=datetime.utcnow),
+    # follower counts of the search documents are read by followed_id,
+    # the latest followers sample follow notifications
+    db.Index('ix_followers_followed_created', 'followed_id', 'created_on')
 )
 
 
@@ -65,7 +95,10 @@ user_tags = db.Table(
         db.Integer,
         db.ForeignKey('tags.id', ondelete='CASCADE',  onupdate='CASCADE'),
         primary_key=True
-    )
+    ),
+    db.Column('created_on', db.DateTime, default=datetime.utcnow),
+    # a tag's latest followers fill its follower sample
+    db.Index('ix_user_tags_tag_created', 'tag_id', 'created_on')
 )
 
 deleted_msgs = db.Table(
@@ -85,14 +118,203 @@ deleted_msgs = db.Table(
 )
 
 
+class TimelineEntry(db.Model):
+    __tablename__ = 'timeline_entries'
+    __table_args__ = (
+        db.Index(
+            'ix_timeline_entries_user_created',
+            'user_id', 'created_on', 'post_id'),
+    )
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE', onupdate='CASCADE'),
+        primary_key=True
+    )
+    post_id = db.Column(
+        db.Integer,
+        db.ForeignKey('posts.id', ondelete='CASCADE', onupdate='CASCADE'),
+        primary_key=True
+    )
+    # copied from the post, so timelines are read off a single index
+    created_on = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<TimelineEntry user_{self.user_id} post_{self.post_id}>'
+
+    @classmethod
+    def add(cls, post):
+        '''
+        Add a new post to its author's own timeline. The timelines of
+        their followers get it from the `fan_out_post` job.
+        '''
+        db.session.add(cls(
+            user_id=post.user_id, post_id=post.id,
+            created_on=post.created_on))
+
+    @classmethod
+    def fan_out(cls, post, author):
+        '''
+        Add a post to the timelines of its author's followers and the
+        subscribers of its tags that don't have it yet, with one
+        INSERT ... SELECT. Followers of authors with more than
+        TIMELINE_FANOUT_LIMIT followers read their posts on demand
+        instead, see `User.get_timeline`.
+        '''
+        if not author.fanout_on_read and author.followers.count() > \
+                current_app.config['TIMELINE_FANOUT_LIMIT']:
+            author.fanout_on_read = True
+
+        recipients = []
+
+        if not author.fanout_on_read:
+            recipients.append(select([followers.c.follower_id.label(
+                'user_id')]).where(followers.c.followed_id == author.id))
+
+        tag_ids = [tag.id for tag in post.tags]
+        if tag_ids:
+            recipients.append(select([user_tags.c.user_id]).where(
+                user_tags.c.tag_id.in_(tag_ids)))
+
+        if not recipients:
+            return
+
+        recipients = union(*recipients).alias()
+        db.session.execute(cls.__table__.insert().from_select(
+            ['user_id', 'post_id', 'created_on'],
+            select([
+                recipients.c.user_id,
+                literal(post.id),
+                literal(post.created_on, db.DateTime)]).where(
+                    ~exists().where(and_(
+                        cls.user_id == recipients.c.user_id,
+                        cls.post_id == post.id)))))
+
+    @classmethod
+    def rebuild(cls, user_id, size):
+        '''
+        Refill a user's timeline with the latest posts of the users and
+        tags they follow, and their own.
+        '''
+        posts = Post.__table__
+        followed = select([posts.c.id, posts.c.created_on]).select_from(
+            posts.join(
+                followers, followers.c.followed_id == posts.c.user_id).join(
+                    User.__table__, User.id == posts.c.user_id)).where(and_(
+                        followers.c.follower_id == user_id,
+                        User.fanout_on_read.is_(False),
+                        posts.c.comment_id.is_(None)))
+        tagged = select([posts.c.id, posts.c.created_on]).select_from(
+            posts.join(post_tags, post_tags.c.post_id == posts.c.id).join(
+                user_tags, user_tags.c.tag_id == post_tags.c.tag_id)).where(
+                    and_(user_tags.c.user_id == user_id,
+                         posts.c.comment_id.is_(None)))
+        own = select([posts.c.id, posts.c.created_on]).where(and_(
+            posts.c.user_id == user_id, posts.c.comment_id.is_(None)))
+        recent = union(followed, tagged, own).alias()
+
+        db.session.flush()
+        cls.query.filter(cls.user_id == user_id).delete(
+            synchronize_session=False)
+        db.session.execute(cls.__table__.insert().from_select(
+            ['user_id', 'post_id', 'created_on'],
+            select([literal(user_id), recent.c.id, recent.c.created_on])
+            .order_by(recent.c.created_on.desc()).limit(size)))
+
+
+class FollowSuggestion(db.Model):
+    __tablename__ = 'follow_suggestions'
+    __table_args__ = (
+        db.Index(
+            'ix_follow_suggestions_user_score',
+            'user_id', 'score', 'candidate_id'),
+    )
+    # weight of each path from a user to a candidate
+    followed_weight = 1.0
+    co_liker_weight = 0.5
+    tag_weight = 0.25
+    # bounds of the co-liker scan: the user's latest likes, and the
+    # rows read from the other likes of those posts
+    like_sample = 100
+    co_liker_limit = 5000
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE', onupdate='CASCADE'),
+        primary_key=True
+    )
+    candidate_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE', onupdate='CASCADE'),
+        primary_key=True
+    )
+    score = db.Column(db.Float, nullable=False)
+
+    def __repr__(self):
+        return f'<FollowSuggestion user_{self.user_id} ' \
+            f'candidate_{self.candidate_id}>'
+
+    @classmethod
+    def rebuild(cls, user_id, size):
+        '''
+        Recompute a user's ranked follow candidates with one
+        INSERT ... SELECT. Candidates are scored by the users they are
+        followed by among the ones the user follows, the posts both
+        liked and the tags both follow. Users already followed are left
+        out. Only the co-likers of the user's ``like_sample`` latest
+        likes are counted, up to ``co_liker_limit`` of them.
+        '''
+        f1, f2 = followers.alias(), followers.alias()
+        l2 = post_likes.alias()
+        t1, t2 = user_tags.alias(), user_tags.alias()
+
+        followed = select([
+            f2.c.followed_id.label('candidate_id'),
+            literal(cls.followed_weight).label('weight')]).select_from(
+                f1.join(f2, f2.c.follower_id == f1.c.followed_id)).where(
+                    f1.c.follower_id == user_id)
+        liked = select([post_likes.c.post_id]).where(
+            post_likes.c.user_id == user_id).order_by(
+                post_likes.c.post_id.desc()).limit(cls.like_sample).alias()
+        co_liked = select([l2.c.user_id]).select_from(
+            liked.join(l2, l2.c.post_id == liked.c.post_id)).where(
+                l2.c.user_id != user_id).limit(cls.co_liker_limit).alias()
+        co_likers = select([
+            co_liked.c.user_id, literal(cls.co_liker_weight)])
+        tagged = select([
+            t2.c.user_id, literal(cls.tag_weight)]).select_from(
+                t1.join(t2, t2.c.tag_id == t1.c.tag_id)).where(
+                    t1.c.user_id == user_id)
+        paths = union_all(followed, co_likers, tagged).alias()
+        already_followed = select([followers.c.followed_id]).where(
+            followers.c.follower_id == user_id)
+        score = func.sum(paths.c.weight)
+
+        db.session.flush()
+        cls.query.filter(cls.user_id == user_id).delete(
+            synchronize_session=False)
+        db.session.execute(cls.__table__.insert().from_select(
+            ['user_id', 'candidate_id', 'score'],
+            select([literal(user_id), paths.c.candidate_id, score]).where(
+                and_(paths.c.candidate_id != user_id,
+                     paths.c.candidate_id.notin_(already_followed)))
+            .group_by(paths.c.candidate_id)
+            .order_by(score.desc(), paths.c.candidate_id).limit(size)))
+
+
 class User(db.Model, ResourceMixin, SearchableMixin):
     __tablename__ = 'users'
+    __search_index__ = 'users'
 
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(128), index=True, unique=True, nullable=False)
     password = db.Column(db.String(128), nullable=False)
     is_active = db.Column(db.Boolean(), default=True, nullable=False)
     is_admin = db.Column(db.Boolean(), default=False, nullable=False)
+    # popular authors' posts are merged into timelines on read
+    fanout_on_read = db.Column(db.Boolean(), default=False, nullable=False)
+    # hex encoded bitset over Permission.id of the user's own and group perms
+    perm_bits = db.Column(db.Text, default='0', nullable=False)
 
     # Relationships
     profile = db.relationship(
@@ -117,6 +339,14 @@ class User(db.Model, ResourceMixin, SearchableMixin):
     deleted_messages = db.relationship(
         'Message', secondary=deleted_msgs, lazy='dynamic')
     last_notif_read_time = db.Column(db.DateTime, default=datetime.utcnow)
+    # notifications newer than last_notif_read_time, and a number bumped
+    # on every change to the user's notifications, served as an ETag
+    unread_notifs = db.Column(db.Integer, default=0, nullable=False)
+    notifs_version = db.Column(db.Integer, default=0, nullable=False)
+    # columns changed by bulk UPDATEs that bypass save(), left out of the
+    # identity cache and loaded from the database when read
+    uncached_columns = ('fanout_on_read', 'last_notif_read_time',
+                        'unread_notifs', 'notifs_version')
     notifications = db.relationship(
         'Notification',
         backref='user',
@@ -137,6 +367,9 @@ class User(db.Model, ResourceMixin, SearchableMixin):
     def __str__(self):
         return f'<User {self.id} {self.email}>'
 
+    def identity_key(self):
+        return self.id
+
     @classmethod
     def find_by_email(cls, email):
         return cls.query.filter((cls.email == email)).first()
@@ -151,7 +384,8 @@ class User(db.Model, ResourceMixin, SearchableMixin):
         :return: str
         """
         if password:
-            return generate_password_hash(password)
+            return generate_password_hash(
+                password, current_app.config['PASSWORD_HASH_METHOD'])
 
         return None
 
@@ -173,6 +407,7 @@ class User(db.Model, ResourceMixin, SearchableMixin):
                     seconds=current_app.config.get('TOKEN_EXPIRATION_SECONDS')
                 ),
                 'iat': datetime.utcnow(),
+                'jti': uuid.uuid4().hex,
                 'sub': {
                     'id': self.id,
                 }
@@ -199,35 +434,73 @@ class User(db.Model, ResourceMixin, SearchableMixin):
                 current_app.config.get('SECRET_KEY'),
                 algorithms='HS256'
             )
+
+            if current_app.revoked_tokens.is_revoked(payload.get('jti')):
+                return 'Token revoked. Please log in again.'
+
             return payload.get('sub')
         except jwt.ExpiredSignatureError:
             return 'Signature expired. Please log in again.'
         except jwt.InvalidTokenError:
             return 'Invalid token. Please log in again.'
 
+    @staticmethod
+    def revoke_auth_token(token):
+        """
+        Revokes the auth token until it expires
+
+        :param string: token
+        :return: None
+        """
+        payload = jwt.decode(
+            token,
+            current_app.config.get('SECRET_KEY'),
+            algorithms='HS256'
+        )
+
+        if payload.get('jti'):
+            current_app.revoked_tokens.revoke(
+                payload['jti'], datetime.utcfromtimestamp(payload['exp']))
+
     def follow(self, user):
         if not self.is_following(user):
             self.followed.append(user)
+            user.search_touch()
 
     def unfollow(self, user):
         if self.is_following(user):
             self.followed.remove(user)
+            user.search_touch()
 
     def is_following(self, user):
         return self.followed.filter(
             followers.c.followed_id == user.id).count() > 0
 
-    def get_users_to_follow(self, count=3):
-        likes = self.likes.subquery()
-        liked_posts = db.session.query(User).join(
-            likes, User.id == likes.c.user_id).distinct().except_(
-                self.followed).order_by(User.updated_on).limit(count)
-
-        if liked_posts.count() > 0:
-            return liked_posts.all()
+    def get_follower_ids(self):
+        '''Get the ids of self's followers, latest first.'''
+        return db.session.query(followers.c.follower_id).filter(
+            followers.c.followed_id == self.id).order_by(
+                followers.c.created_on.desc(), followers.c.follower_id.desc())
 
-        return [User.find_by_id(random.randrange(
-            User.query.count())) for _ in range(count)] 
+    def get_users_to_follow(self, count=3):
+        '''
+        Get the best precomputed follow candidates. Users without any,
+        e.g. new ones, get the newest users they don't follow yet.
+        '''
+        suggested = User.query.join(
+            FollowSuggestion, FollowSuggestion.candidate_id == User.id).filter(
+                FollowSuggestion.user_id == self.id).order_by(
+                    FollowSuggestion.score.desc(),
+                    FollowSuggestion.candidate_id).limit(count).all()
+
+        if suggested:
+            return suggested
+
+        return User.query.filter(
+            User.id != self.id,
+            User.id.notin_(select([followers.c.followed_id]).where(
+                followers.c.follower_id == self.id))).order_by(
+                    User.id.desc()).limit(count).all()
 
     def get_followed_posts(self):
         followed_users_posts = db.session.query(Post.id).join(
@@ -243,24 +516,155 @@ class User(db.Model, ResourceMixin, SearchableMixin):
                     user_tags.c.user_id == self.id).union(
                         followed_users_posts.union(own_posts))
 
+    def get_timeline(self, limit, cursor=None):
+        '''
+        Get a page of the user's home timeline, newest first. Entries
+        fanned out on write are one range read over the timeline index,
+        posts of followed popular authors are merged in on read.
+
+        :param limit: Number of posts
+        :param cursor: (created_on, post_id) of the last post seen
+        :return: list of Post instances
+        '''
+        timeline = select([
+            TimelineEntry.post_id.label('id'),
+            TimelineEntry.created_on]).where(
+                TimelineEntry.user_id == self.id)
+        popular = select([Post.id, Post.created_on]).select_from(
+            Post.__table__.join(
+                followers, followers.c.followed_id == Post.user_id).join(
+                    User.__table__, User.id == Post.user_id)).where(and_(
+                        followers.c.follower_id == self.id,
+                        User.fanout_on_read.is_(True),
+                        Post.comment_id.is_(None)))
+
+        if cursor:
+            created_on, post_id = cursor
+            timeline = timeline.where(or_(
+                TimelineEntry.created_on < created_on, and_(
+                    TimelineEntry.created_on == created_on,
+                    TimelineEntry.post_id < post_id)))
+            popular = popular.where(or_(
+                Post.created_on < created_on, and_(
+                    Post.created_on == created_on, Post.id < post_id)))
+
+        timeline = timeline.order_by(
+            TimelineEntry.created_on.desc(),
+            TimelineEntry.post_id.desc()).limit(limit).alias()
+        popular = popular.order_by(
+            Post.created_on.desc(), Post.id.desc()).limit(limit).alias()
+        page = union(select([timeline]), select([popular])).alias()
+
+        return Post.query.join(page, page.c.id == Post.id).order_by(
+            page.c.created_on.desc(), page.c.id.desc()).limit(limit).all()
+
+    def get_timeline_posts(self):
+        '''Get the ids of every post on the user's home timeline.'''
+        timeline = db.session.query(TimelineEntry.post_id).filter(
+            TimelineEntry.user_id == self.id)
+        popular = db.session.query(Post.id).join(
+            followers, followers.c.followed_id == Post.user_id).join(
+                User, User.id == Post.user_id).filter(
+                    followers.c.follower_id == self.id,
+                    User.fanout_on_read.is_(True),
+                    Post.comment_id.is_(None))
+        return timeline.union(popular)
+
     def follow_tag(self, tag):
         if not self.is_following_tag(tag):
             self.tags.append(tag)
+            tag.add_follower(self)
 
     def unfollow_tag(self, tag):
         if self.is_following_tag(tag):
             self.tags.remove(tag)
+            tag.remove_follower(self)
 
     def is_following_tag(self, tag):
         return self.tags.filter(user_tags.c.tag_id == tag.id).count() > 0
 
+    def following_among(self, tag_ids=(), user_ids=()):
+        '''
+        Get which of some tags and users this user follows, in a single
+        query.
+
+        :param tag_ids: Tag ids
+        :param user_ids: User ids
+        :return: tuple of (set of followed tag ids, set of followed user ids)
+        '''
+        tags = select([literal('tag').label('kind'),
+                       user_tags.c.tag_id.label('id')]).where(and_(
+                           user_tags.c.user_id == self.id,
+                           user_tags.c.tag_id.in_(tag_ids)))
+        users = select([literal('user').label('kind'),
+                        followers.c.followed_id.label('id')]).where(and_(
+                            followers.c.follower_id == self.id,
+                            followers.c.followed_id.in_(user_ids)))
+        followed = {'tag': set(), 'user': set()}
+
+        if tag_ids or user_ids:
+            for kind, id in db.session.execute(union_all(tags, users)):
+                followed[kind].add(id)
+
+        return followed['tag'], followed['user']
+
     def add_notification(self, subject, item_id, id, **kwargs):
         notif = Notification(
             subject=subject, item_id=item_id, user_id=id, doer_id=self.
-            id, **kwargs)
+            id, actor_sample=[self.id], **kwargs)
         db.session.add(notif)
+        User.notifs_changed([id], unread=1)
         return notif
 
+    @classmethod
+    def notif_unread(cls, timestamp):
+        '''
+        SQL condition telling if a notification with a timestamp is
+        unread by the user of the row being updated.
+        '''
+        return or_(cls.last_notif_read_time.is_(None),
+                   cls.last_notif_read_time < timestamp)
+
+    @classmethod
+    def notifs_changed(cls, user_ids, unread=0):
+        '''
+        Bump the notifications version of users and add to their unread
+        count, which never goes below zero.
+
+        :param user_ids: Ids of the users, or a query selecting them
+        :param unread: Number, or SQL expression, to add to the count
+        '''
+        count = cls.unread_notifs + unread
+        cls.query.filter(cls.id.in_(user_ids)).update({
+            cls.unread_notifs: case([(count < 0, 0)], else_=count),
+            cls.notifs_version: cls.notifs_version + 1,
+        }, synchronize_session=False)
+
+    @classmethod
+    def read_notifs(cls, user_id):
+        '''
+        Mark all of a user's notifications as read. A user with none
+        unread is left alone, so their notifications keep their ETag.
+        '''
+        cls.query.filter(cls.id == user_id, cls.unread_notifs > 0).update({
+            cls.last_notif_read_time: datetime.utcnow(),
+            cls.unread_notifs: 0,
+            cls.notifs_version: cls.notifs_version + 1,
+        }, synchronize_session=False)
+
+    @classmethod
+    def reconcile_unread_notifs(cls, first_id, last_id):
+        '''
+        Recount the unread notifications of the users with ids in a range.
+        '''
+        cls.query.filter(cls.id >= first_id, cls.id <= last_id).update({
+            cls.unread_notifs: select([func.count()]).where(and_(
+                Notification.user_id == cls.id,
+                cls.notif_unread(Notification.timestamp))).as_scalar(),
+            cls.notifs_version: cls.notifs_version + 1,
+        }, synchronize_session=False)
+        db.session.commit()
+
     def get_notifications(self):
         return Notification.query.filter_by(user_id=self.id).order_by(
             Notification.timestamp.desc())
@@ -278,29 +682,50 @@ class User(db.Model, ResourceMixin, SearchableMixin):
             and_(Chat.user1_id == user.id, Chat.user2_id == self.id)).except_(
                     self.deleted_messages).order_by(Message.created_on.desc())
 
-    def get_chat_last_messages(self):
-        '''Get the last messages in all chats with self.'''
-        user1 = aliased(User)
-        user2 = aliased(User)
-        # get the last message in all chats.
-        last_msgs = db.session.query(Message.chat_id, func.max(
-            Message.created_on).label('last_messages')).group_by(
-                Message.chat_id).subquery()
-        # return the users and messages involved in the conversation with self
-        return last_msgs, db.session.query(
-            Message, user1, user2, last_msgs.c.last_messages).join(
-            last_msgs, Message.created_on == last_msgs.c.last_messages).join(
-                Chat, Chat.id == Message.chat_id).join(
-                    user1, user1.id == Chat.user1_id).join(
-                        user2, user2.id == Chat.user2_id).filter((
-                            Chat.user1_id == self.id) | (
-                                Chat.user2_id == self.id)).order_by(
-                                    last_msgs.c.last_messages.desc())
-
-    def last_read_msg_ts(self, chat_id):
-        return LastReadMessage.query.filter(and_(
-            LastReadMessage.user_id == self.id,
-            LastReadMessage.chat_id == chat_id)).first()
+    def get_chat_last_messages(self, limit, cursor=None):
+        '''
+        Get a page of the chats of self that have messages, by latest
+        activity, with their last message, the other user and how many
+        messages self hasn't read. Self is either side of a chat, so
+        each side is a range read over its own activity index, and the
+        two are merged.
+
+        :param limit: Number of chats
+        :param cursor: (last_activity_at, id) of the last chat seen
+        :return: list of (Chat, Message, User, unread count)
+        '''
+        keys = (Chat.last_activity_at.desc(), Chat.id.desc())
+        sides = []
+
+        # a chat with oneself is only read from the first side
+        for side in (Chat.user1_id == self.id,
+                     and_(Chat.user2_id == self.id, Chat.user1_id != self.id)):
+            chats = select([Chat.id, Chat.last_activity_at]).where(
+                and_(side, Chat.last_message_id.isnot(None)))
+
+            if cursor:
+                chats = chats.where(seek_after(keys, cursor))
+            sides.append(select([chats.order_by(*keys).limit(limit).alias()]))
+
+        page = union_all(*sides).alias()
+        other_id = case(
+            [(Chat.user1_id == self.id, Chat.user2_id)], else_=Chat.user1_id)
+        return db.session.query(
+            Chat, Message, User, LastReadMessage.unread_count).join(
+                page, page.c.id == Chat.id).join(
+                    Message, Message.id == Chat.last_message_id).join(
+                        User, User.id == other_id).outerjoin(
+                            LastReadMessage, and_(
+                                LastReadMessage.chat_id == Chat.id,
+                                LastReadMessage.user_id == self.id)).order_by(
+                    page.c.last_activity_at.desc(), page.c.id.desc()).limit(
+                        limit).all()
+
+    def get_total_unread(self):
+        '''Get the number of unread messages across all chats.'''
+        return db.session.query(func.coalesce(func.sum(
+            LastReadMessage.unread_count), 0)).filter(
+                LastReadMessage.user_id == self.id).scalar()
 
     def delete_message_for_me(self, message):
         self.deleted_messages.append(message)
@@ -311,16 +736,31 @@ class User(db.Model, ResourceMixin, SearchableMixin):
             user_perms.c.perm_id == perm.id).count() > 0
 
     def add_permissions(self, perms):
+        added = []
+
         for perm in perms:
             if not self.user_has_perm(perm):
                 self.permissions.append(perm)
+                added.append(perm)
                 self.save()
 
+        if added:
+            mask = Permission.mask_of(perm.id for perm in added)
+            update_permission_bits(
+                [self], lambda user: user.grant_perm_bits(mask))
+
     def remove_permissions(self, perms):
+        removed = False
+
         for perm in perms:
             if self.user_has_perm(perm):
                 self.permissions.remove(perm)
-                self.save()
+                removed = True
+
+        if removed:
+            self.save()
+            update_permission_bits(
+                [self], lambda user: user.rebuild_perm_bits())
 
     def get_perms(self):
         perms = []
@@ -339,15 +779,43 @@ class User(db.Model, ResourceMixin, SearchableMixin):
 
         return list(set(perms).union(set(self.get_perms())))
 
+    @property
+    def perm_mask(self):
+        return int(self.perm_bits or '0', 16)
+
+    def grant_perm_bits(self, mask):
+        """
+        Add permissions to the user's effective permission set.
+
+        :param mask: Bitset over Permission.id
+        :return: None
+        """
+        self.perm_bits = format(self.perm_mask | mask, 'x')
+
+    def rebuild_perm_bits(self):
+        """
+        Recompute the user's effective permission set from their own
+        permissions and those of their groups, in a single query.
+
+        :return: None
+        """
+        own_perms = db.session.query(user_perms.c.perm_id).filter(
+            user_perms.c.user_id == self.id)
+        group_perms = db.session.query(grp_perms.c.perm_id).join(
+            grp_members,
+            grp_members.c.group_id == grp_perms.c.group_id).filter(
+                grp_members.c.user_id == self.id)
+
+        self.perm_bits = format(Permission.mask_of(
+            perm_id for perm_id, in own_perms.union(group_perms)), 'x')
+
     def has_permission(self, name):
-        perm = Permission.find_by_name(name)
-        return perm in self.get_all_perms()
+        return self.has_permissions([name])
 
     def has_permissions(self, perms_list):
-        perms = []
+        mask = Permission.mask_for(perms_list)
 
-        for perm in perms_list:
-            p = Permission.find_by_name(perm)
-            perms.append(p)
+        if mask is None:
+            return False
 
-        return set(perms).issubset(set(self.get_all_perms()))
+        return self.perm_mask & mask == mask
@@ -1,11 +1,12 @@
 from sqlalchemy import exc
 from marshmallow import ValidationError
-from flask import jsonify, request, url_for
+from flask import current_app, jsonify, request, url_for
 
 from src import db
 from src.lib.auth import authenticate
+from src.lib.hashing import HasherBusy
 from src.blueprints.errors import error_response, bad_request, \
-    server_error
+    server_error, service_unavailable
 from src.blueprints.users.models import User
 from src.blueprints.users.schema import UserSchema, AuthSchema
 from src.blueprints.profiles.models import Profile
@@ -25,6 +26,12 @@ def check_email():
     return {'res': not isinstance(user, User)}
 
 
+def hasher_busy():
+    return service_unavailable(
+        'Too many sign in attempts, please try again shortly.',
+        current_app.config['PASSWORD_HASH_RETRY_AFTER'])
+
+
 @users.route('/register', methods=['POST'])
 def register_user():
     post_data = request.get_json()
@@ -48,12 +55,18 @@ def register_user():
     if user:
         return bad_request('That user already exists.')
 
+    try:
+        password_hash = current_app.password_hasher.hash(password)
+    except HasherBusy:
+        return hasher_busy()
+
     profile = Profile()
     profile.name = name
     profile.username = username
     profile.avatar = profile.set_avatar(email)
 
-    user = User(password=password)
+    user = User()
+    user.password = password_hash
     user.email = email
     user.profile = profile
 
@@ -76,21 +89,42 @@ def login_user():
     if data is None:
         return bad_request("No input data provided")
 
+    hasher = current_app.password_hasher
+    password = data.get('password')
+
     try:
         # check for existing user
         user = User.find_by_email(data.get('email'))
 
-        if user and user.check_password(data.get('password')):
-            return jsonify({'token': user.encode_auth_token()})
-        else:
+        if not user or not hasher.verify(user.password, password):
             return error_response(401, 'Incorrect email or password.')
+
+        if hasher.needs_rehash(user.password):
+            try:
+                user.password = hasher.hash(password)
+                user.save()
+            except HasherBusy:
+                pass
+
+        return jsonify({'token': user.encode_auth_token()})
+    except HasherBusy:
+        return hasher_busy()
     except Exception:
+        db.session.rollback()
         return server_error('Something went wrong, please try again.')
 
 
 @users.route('/logout', methods=['GET'])
 @authenticate
 def logout_user(user):
+    token = request.headers.get('Authorization').split(" ")[1]
+
+    try:
+        User.revoke_auth_token(token)
+    except (exc.IntegrityError, ValueError):
+        db.session.rollback()
+        return server_error('Something went wrong, please try again.')
+
     return jsonify({'message': 'Successfully logged out.'})
 
 
@@ -1,11 +1,14 @@
 from sqlalchemy import exc
-from flask import current_app, jsonify, request
+from flask import current_app, jsonify
 
 from src import db
-from src.lib import urlsafe_base64
 from src.lib.auth import authenticate
+from src.lib.broker import user_channel
+from src.lib.jobs import enqueue
+from src.lib.pagination import page_args, paginate
 from src.blueprints.errors import server_error, not_found
 from src.blueprints.users.models import User
+from src.blueprints.users import jobs  # noqa: F401, registers job handlers
 from src.blueprints.posts.models import Post
 from src.blueprints.profiles.models import Profile
 from src.blueprints.messages.models import Notification
@@ -24,11 +27,17 @@ def follow(user, id):
     if not to_follow:
         return not_found('User not found')
 
-    user.follow(to_follow)
-
-    db.session.add(
-        user.add_notification(
-            subject='follow', item_id=user.id, id=to_follow.id))
+    if not user.is_following(to_follow):
+        user.follow(to_follow)
+        Notification.aggregate(
+            'follow', to_follow.id, to_follow.id, user.id, item_id=user.id)
+        current_app.broker.publish(
+            user_channel(to_follow.id), 'notification',
+            {'subject': 'follow', 'itemId': user.id})
+        enqueue('rebuild_timeline', key=f'user:{user.id}', user_id=user.id)
+        enqueue('rebuild_follow_suggestions', key=f'user:{user.id}',
+                delay=current_app.config['FOLLOW_SUGGESTIONS_DELAY'],
+                user_id=user.id)
 
     try:
         user.save()
@@ -49,12 +58,15 @@ def unfollow(user, id):
     if not followed:
         return not_found('User not found')
 
-    user.unfollow(followed)
-
-    notif = Notification.find_by_attr(subject='follow', item_id=user.id)
-
-    if (notif):
-        db.session.delete(notif)
+    if user.is_following(followed):
+        user.unfollow(followed)
+        Notification.retract(
+            'follow', followed.id, followed.id, user.id,
+            followed.get_follower_ids())
+        enqueue('rebuild_timeline', key=f'user:{user.id}', user_id=user.id)
+        enqueue('rebuild_follow_suggestions', key=f'user:{user.id}',
+                delay=current_app.config['FOLLOW_SUGGESTIONS_DELAY'],
+                user_id=user.id)
 
     try:
         user.save()
@@ -89,30 +101,18 @@ def get_followers(user, username):
     if not a_user:
         return not_found('User not found.')
 
-    cursor = request.args.get('cursor')
-    items_per_page = current_app.config['ITEMS_PER_PAGE']
-    nextCursor = None
-    followers = None
+    after, limit = page_args()
 
     try:
-        query = a_user.followers.order_by(User.id.desc())
-
-        if cursor == '0':
-            followers = query.limit(items_per_page + 1).all()
-        else:
-            cursor = int(urlsafe_base64(cursor, from_base64=True))
-            followers = query.filter(
-                User.id < cursor).limit(items_per_page + 1).all()
-
+        query = a_user.followers
+        followers, nextCursor = paginate(
+            query, (User.id.desc(),), after, limit)
     except (exc.IntegrityError, ValueError):
         db.session.rollback()
         return server_error('Something went wrong, please try again.')
     else:
-        if len(followers) > items_per_page:
-            nextCursor = urlsafe_base64(str(followers[items_per_page - 1].id))
-
         user_followers = []
-        for a_user in followers[:items_per_page]:
+        for a_user in followers:
             follower = UserSchema(only=('id', 'profile',)).dump(a_user)
             follower['isFollowing'] = user.is_following(a_user)
             user_followers.append(follower)
@@ -133,30 +133,18 @@ def get_following(user, username):
     if not a_user:
         return not_found('User not found.')
 
-    cursor = request.args.get('cursor')
-    items_per_page = current_app.config['ITEMS_PER_PAGE']
-    nextCursor = None
-    following = None
+    after, limit = page_args()
 
     try:
-        query = a_user.followed.order_by(User.id.desc())
-
-        if cursor == '0':
-            following = query.limit(items_per_page + 1).all()
-        else:
-            cursor = int(urlsafe_base64(cursor, from_base64=True))
-            following = query.filter(
-                User.id < cursor).limit(items_per_page + 1).all()
-
+        query = a_user.followed
+        following, nextCursor = paginate(
+            query, (User.id.desc(),), after, limit)
     except (exc.IntegrityError, ValueError):
         db.session.rollback()
         return server_error('Something went wrong, please try again.')
     else:
-        if len(following) > items_per_page:
-            nextCursor = urlsafe_base64(str(following[items_per_page - 1].id))
-
         users_following = []
-        for a_user in following[:items_per_page]:
+        for a_user in following:
             following = UserSchema(only=('id', 'profile',)).dump(a_user)
             following['isFollowing'] = user.is_following(a_user)
             users_following.append(following)
@@ -177,32 +165,20 @@ def get_user_posts(user, username):
     if not a_user:
         return not_found('User not found.')
 
-    cursor = request.args.get('cursor')
-    items_per_page = current_app.config['ITEMS_PER_PAGE']
-    nextCursor = None
-    posts = None
+    after, limit = page_args()
 
     try:
         query = Post.query.with_parent(a_user).filter(
-            Post.comment_id.is_(None)).order_by(Post.created_on.desc())
-
-        if cursor == '0':
-            posts = query.limit(items_per_page + 1).all()
-        else:
-            cursor = urlsafe_base64(cursor, from_base64=True)
-            posts = query.filter(
-                Post.created_on < cursor).limit(items_per_page + 1).all()
+            Post.comment_id.is_(None))
+        posts, nextCursor = paginate(
+            query, (Post.created_on.desc(), Post.id.desc()), after, limit)
     except (exc.IntegrityError, ValueError) as e:
         db.session.rollback()
         print(e)
         return server_error('Something went wrong, please try again.')
 
-    if len(posts) > items_per_page:
-        nextCursor = urlsafe_base64(
-            posts[items_per_page - 1].created_on.isoformat())
-
     return {
-        'data': [post.to_dict(user) for post in posts[:items_per_page]],
+        'data': Post.to_dicts(posts, user),
         'nextCursor': nextCursor,
         'total': query.count(),
     }
@@ -217,33 +193,22 @@ def get_user_comments(user, username):
     if not a_user:
         return not_found('User not found.')
 
-    cursor = request.args.get('cursor')
-    items_per_page = current_app.config['ITEMS_PER_PAGE']
-    nextCursor = None
-    comments = None
+    after, limit = page_args()
 
     try:
         query = Post.query.with_parent(a_user).filter(
-            Post.comment_id.isnot(None)).order_by(Post.created_on.desc())
-
-        if cursor == '0':
-            comments = query.limit(items_per_page + 1).all()
-        else:
-            cursor = urlsafe_base64(cursor, from_base64=True)
-            comments = query.filter(
-                Post.created_on < cursor).limit(items_per_page + 1).all()
+            Post.comment_id.isnot(None))
+        page, nextCursor = paginate(
+            query, (Post.created_on.desc(), Post.id.desc()), after, limit)
     except (exc.IntegrityError, ValueError) as e:
         db.session.rollback()
         print(e)
         return server_error('Something went wrong, please try again.')
 
-    if len(comments) > items_per_page:
-        nextCursor = urlsafe_base64(
-            comments[items_per_page - 1].created_on.isoformat())
+    Post.load_parents(page)
 
     comment_list = []
-    for c in comments[:items_per_page]:
-        comment = c.to_dict(user)
+    for c, comment in zip(page, Post.to_dicts(page, user)):
         comment['parent'] = PostSchema(
             only=('id', 'body', 'author',)).dump(c.parent)
         comment_list.append(comment)
@@ -264,31 +229,21 @@ def get_liked_posts(user, username):
     if not a_user:
         return not_found('User not found.')
 
-    cursor = request.args.get('cursor')
-    items_per_page = current_app.config['ITEMS_PER_PAGE']
-    nextCursor = None
-    posts = None
+    after, limit = page_args()
 
     try:
-        query = a_user.likes.order_by(Post.created_on.desc())
-        if cursor == '0':
-            posts = query.limit(items_per_page + 1).all()
-        else:
-            cursor = urlsafe_base64(cursor, from_base64=True)
-            posts = query.filter(
-                Post.created_on < cursor).limit(items_per_page + 1).all()
+        query = a_user.likes
+        page, nextCursor = paginate(
+            query, (Post.created_on.desc(), Post.id.desc()), after, limit)
     except (exc.IntegrityError, ValueError) as e:
         db.session.rollback()
         print(e)
         return server_error('Something went wrong, please try again.')
 
-    if len(posts) > items_per_page:
-        nextCursor = urlsafe_base64(
-            posts[items_per_page - 1].created_on.isoformat())
+    Post.load_parents(page)
 
     liked_posts = []
-    for p in posts[:items_per_page]:
-        post = p.to_dict(user)
+    for p, post in zip(page, Post.to_dicts(page, user)):
 
         if p.parent:
             post['parent'] = PostSchema(
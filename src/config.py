@@ -8,11 +8,56 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 class BaseConfig:
     """Base configuration"""
     ITEMS_PER_PAGE = 7
+    ITEMS_PER_PAGE_MAX = 50
     SECRET_KEY = os.environ.get('SECRET_DEV_KEY')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     TESTING = False
     TOKEN_EXPIRATION_DAYS = 30
     TOKEN_EXPIRATION_SECONDS = 0
+    IDENTITY_CACHE_SIZE = 1024
+    IDENTITY_CACHE_TTL = 60
+    PERMISSION_CACHE_SIZE = 512
+    PERMISSION_CACHE_TTL = 3600
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:150000'
+    PASSWORD_HASH_WORKERS = 2
+    PASSWORD_HASH_QUEUE_SIZE = 16
+    PASSWORD_HASH_TIMEOUT = 10
+    PASSWORD_HASH_RETRY_AFTER = 2
+    TOKEN_REVOCATION_REFRESH = 5
+    TOKEN_REVOCATION_REBUILD = 3600
+    TOKEN_REVOCATION_FILTER_BITS = 1 << 20
+    TOKEN_REVOCATION_FILTER_HASHES = 7
+    HOT_SCORE_DECAY = 45000
+    TIMELINE_FANOUT_LIMIT = 5000
+    TIMELINE_SIZE = 500
+    FEATURED_POSTS = 5
+    FEATURED_POOL_SIZE = 200
+    FEATURED_POOL_REFRESH = 300
+    FOLLOW_SUGGESTIONS_SIZE = 50
+    FOLLOW_SUGGESTIONS_DELAY = 60
+    FOLLOW_SUGGESTIONS_CHUNK_SIZE = 100
+    FOLLOW_SUGGESTIONS_FANOUT_LIMIT = 1000
+    TAG_STATS_INTERVAL = 300
+    LOCAL_SEARCH_REFRESH = 300
+    SEARCH_POOL_SIZE = 10
+    SEARCH_TIMEOUT = 2
+    SEARCH_CACHE_SIZE = 2048
+    SEARCH_CACHE_TTL = 30
+    SEARCH_BREAKER_THRESHOLD = 5
+    SEARCH_BREAKER_RESET = 30
+    SEARCH_RESULT_SIZE = 10
+    SEARCH_RESULT_SIZES = {'tags': 5, 'users': 10}
+    EVENT_BROKER = os.environ.get('EVENT_BROKER', 'memory')
+    EVENT_BUFFER_SIZE = 1000
+    EVENT_POLL_INTERVAL = 1
+    EVENT_RETENTION = 3600
+    EVENT_GAP_TIMEOUT = 10
+    EVENT_WAIT_TIMEOUT = 25
+    NOTIFY_FOLLOWERS_CHUNK_SIZE = 1000
+    JOB_MAX_ATTEMPTS = 5
+    JOB_RETRY_DELAY = 30
+    JOB_LEASE = 600
+    JOB_RETENTION = 86400
 
 
 class DevelopmentConfig(BaseConfig):
@@ -32,6 +77,7 @@ class TestingConfig(BaseConfig):
     TESTING = True
     TOKEN_EXPIRATION_DAYS = 0
     TOKEN_EXPIRATION_SECONDS = 3
+    PASSWORD_HASH_WORKERS = 0
 
 
 class ProductionConfig(BaseConfig):
@@ -1,29 +1,132 @@
 from functools import wraps
 
-from flask import request
+from flask import request, current_app
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
 
+from src import db
 from src.blueprints.errors import error_response
 from src.blueprints.users.models import User
 
 
+def _detached_copy(instance, exclude=()):
+    """
+    Copy the loaded column state of an instance into a new detached
+    instance that is not bound to any session.
+
+    :param instance: Model instance
+    :param exclude: Names of the columns to leave unloaded
+    :return: Detached model instance
+    """
+    mapper = inspect(instance).mapper
+    copy = mapper.class_manager.new_instance()
+
+    for attr in mapper.column_attrs:
+        if attr.key not in exclude:
+            set_committed_value(copy, attr.key, getattr(instance, attr.key))
+
+    make_transient_to_detached(copy)
+    return copy
+
+
+def cache_identity(user):
+    """
+    Cache a detached snapshot of a user and its profile. The columns
+    in `User.uncached_columns` are left out, so reading them on a
+    cached user queries their current values.
+
+    :param user: User instance
+    :return: None
+    """
+    snapshot = _detached_copy(user, exclude=User.uncached_columns)
+
+    if user.profile is not None:
+        set_committed_value(snapshot, 'profile', _detached_copy(user.profile))
+
+    current_app.identity_cache.set(user.id, snapshot)
+
+
+def load_identity(user_id):
+    """
+    Get the user a token was issued to, from the identity cache when
+    possible. Cached users are merged into the current session without
+    emitting a query.
+
+    :param user_id: The token subject's id
+    :return: User instance or None
+    """
+    user_id = int(user_id)
+    cached = current_app.identity_cache.get(user_id)
+
+    if cached is not None:
+        return db.session.merge(cached, load=False)
+
+    user = User.find_by_id(user_id)
+
+    if user is not None:
+        cache_identity(user)
+
+    return user
+
+
+def get_auth_user():
+    """
+    Get the user identified by the request's bearer token.
+
+    :return: tuple of (User instance, None) or (None, error response)
+    """
+    auth_header = request.headers.get('Authorization')
+
+    if not auth_header:
+        return None, error_response(403, message='No authorization.')
+
+    token = auth_header.split(" ")[1]
+    payload = User.decode_auth_token(token)
+
+    if not isinstance(payload, dict):
+        return None, error_response(401, message=payload)
+
+    user = load_identity(payload.get('id'))
+
+    if user is None:
+        return None, error_response(401, message='Invalid token.')
+
+    return user, None
+
+
 def authenticate(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
-        auth_header = request.headers.get('Authorization')
+        user, error = get_auth_user()
+
+        if error is not None:
+            return error
+
+        return func(user, *args, **kwargs)
+    return wrapper
 
-        if not auth_header:
-            return error_response(403, message='No authorization.')
 
-        token = auth_header.split(" ")[1]
-        payload = User.decode_auth_token(token)
+def permission_required(perms):
+    """
+    Only let users through who hold all of the given permissions,
+    either directly or through a group. Admins hold every permission.
+    Checks run against the user's materialized permission bitset, so
+    on a warm cache they cost no queries.
 
-        if not isinstance(payload, dict):
-            return error_response(401, message=payload)
+    :param perms: List of permission code names
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            user, error = get_auth_user()
 
-        user = User.find_by_id(payload.get('id'))
+            if error is not None:
+                return error
 
-        if user is None:
-            return error_response(401, message='Invalid token.')
+            if not (user.is_admin or user.has_permissions(perms)):
+                return error_response(403, message='Permission denied.')
 
-        return func(user, *args, **kwargs)
-    return wrapper
+            return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,87 @@
+import time
+import threading
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling a service that keeps failing."""
+
+
+class CircuitBreaker(object):
+    """
+    Stop calling a failing service for a while.
+
+    After ``failure_threshold`` consecutive failures the circuit opens
+    and calls fail fast with `CircuitOpen`. Once ``reset_timeout``
+    seconds have passed a single trial call is let through, closing the
+    circuit again if it succeeds and reopening it if it fails.
+    """
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = 0
+        self.rejected = 0
+        self._opened_at = 0
+        self._lock = threading.Lock()
+
+    def _before_call(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+
+            if self.state == self.OPEN and \
+                    time.monotonic() >= self._opened_at + self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return
+
+            self.rejected += 1
+            raise CircuitOpen()
+
+    def _on_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def _on_failure(self):
+        with self._lock:
+            self.failures += 1
+
+            if self.state == self.HALF_OPEN or \
+                    self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened += 1
+                self._opened_at = time.monotonic()
+
+    def call(self, func, *args, **kwargs):
+        """
+        Call a function through the breaker.
+
+        :param func: Function calling the service
+        :return: The function's result
+        """
+        self._before_call()
+
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self._on_failure()
+            raise
+
+        self._on_success()
+        return result
+
+    def stats(self):
+        """
+        Report the breaker's state and counters.
+
+        :return: dict
+        """
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'opened': self.opened,
+            'rejected': self.rejected,
+        }
@@ -0,0 +1,296 @@
+import os
+import time
+import threading
+from abc import ABC, abstractmethod
+from collections import deque
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from src import db
+
+
+class Event(db.Model):
+    """
+    An event published to a channel, kept for the workers polling the
+    table when the database broker is used.
+    """
+    __tablename__ = 'events'
+
+    id = db.Column(db.Integer, primary_key=True)
+    channel = db.Column(db.String(64), nullable=False)
+    type = db.Column(db.String(32), nullable=False)
+    data = db.Column(db.JSON)
+    created_on = db.Column(
+        db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+    def to_dict(self):
+        return {'id': self.id, 'type': self.type, 'data': self.data}
+
+
+def user_channel(user_id):
+    """
+    Get the channel of a user's own events.
+
+    :param user_id: User id
+    :return: str
+    """
+    return f'user:{user_id}'
+
+
+class Broker(ABC):
+    """
+    Deliver published events to the clients of this worker that wait on
+    their channels.
+
+    Events are kept in a buffer of the last ``buffer_size`` events, so a
+    client coming back with the id of the last event it saw gets what
+    it missed in between, as long as it is still buffered. Waiting on
+    the buffer costs no query.
+    """
+
+    def __init__(self, buffer_size=1000):
+        self.buffer_size = buffer_size
+        self._events = deque(maxlen=buffer_size)
+        self._last_id = 0
+        # id of the last event pushed out of the buffer
+        self._dropped_id = 0
+        self._cond = threading.Condition()
+
+    def publish(self, channel, type, data=None):
+        """
+        Publish an event, delivered once the current transaction
+        commits.
+
+        :param channel: Channel name
+        :param type: Event type
+        :param data: JSON serializable payload
+        :return: None
+        """
+        self.publish_many([channel], type, data)
+
+    @abstractmethod
+    def publish_many(self, channels, type, data=None):
+        """
+        Publish an event to several channels, delivered once the current
+        transaction commits.
+
+        :param channels: Channel names
+        :param type: Event type
+        :param data: JSON serializable payload
+        :return: None
+        """
+
+    def _dispatch(self, events):
+        with self._cond:
+            for event in events:
+                if len(self._events) == self.buffer_size:
+                    self._dropped_id = self._events[0]['id']
+                self._events.append(event)
+                self._last_id = max(self._last_id, event['id'])
+            self._cond.notify_all()
+
+    def _start(self):
+        pass
+
+    def wait(self, channels, after=None, timeout=25):
+        """
+        Wait for events on some channels.
+
+        :param channels: Channel names
+        :param after: Id of the last event seen, None to only get new ones
+        :param timeout: Seconds to wait for an event
+        :return: tuple of (list of events, id to resume after, boolean
+            telling if events may have been missed)
+        """
+        self._start()
+        channels = set(channels)
+        deadline = time.monotonic() + timeout
+
+        with self._cond:
+            if after is None or after > self._last_id:
+                after = self._last_id
+            missed = after < self._dropped_id
+
+            while True:
+                events = [e for e in self._events
+                          if e['id'] > after and e['channel'] in channels]
+                remaining = deadline - time.monotonic()
+
+                if events or remaining <= 0:
+                    return [{k: e[k] for k in ('id', 'type', 'data')}
+                            for e in events], self._last_id, missed
+
+                self._cond.wait(remaining)
+
+
+class InProcessBroker(Broker):
+    """
+    Deliver events to clients of the worker that published them. Only
+    fit for a single worker process.
+    """
+
+    def __init__(self, buffer_size=1000):
+        super().__init__(buffer_size)
+        self._next_id = 0
+        self._id_lock = threading.Lock()
+
+    def publish_many(self, channels, type, data=None):
+        db.session.info.setdefault('broker_events', []).extend(
+            {'channel': channel, 'type': type, 'data': data}
+            for channel in channels)
+
+    def deliver(self, events):
+        with self._id_lock:
+            for event in events:
+                self._next_id += 1
+                event['id'] = self._next_id
+            self._dispatch(events)
+
+
+class NullBroker(Broker):
+    """
+    Drop published events. Used by processes that serve no clients
+    while the in-process broker is used, e.g. the job runner, whose
+    events could not reach the clients of the web workers anyway.
+    """
+
+    def publish_many(self, channels, type, data=None):
+        pass
+
+
+class DatabaseBroker(Broker):
+    """
+    Deliver events across worker processes through the events table.
+
+    Events are inserted in the publishing transaction. Each worker runs
+    a single poller thread, started on the first wait, that reads the
+    new rows every ``poll_interval`` seconds and hands them to the
+    worker's waiting clients. Rows older than ``retention`` seconds are
+    pruned by the pollers.
+
+    Ids are taken on INSERT but transactions commit in any order, so an
+    id missing from the rows read may still be committed later. Events
+    are delivered in id order: the poller holds back the events after a
+    missing id until it shows up, or for ``gap_timeout`` seconds, after
+    which the id is taken to be rolled back. An event committed later
+    than that is not delivered.
+    """
+
+    def __init__(self, app, buffer_size=1000, poll_interval=1,
+                 retention=3600, batch_size=500, gap_timeout=10):
+        super().__init__(buffer_size)
+        self.app = app
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.batch_size = batch_size
+        self.gap_timeout = gap_timeout
+        # (first missing id, time it was first found missing)
+        self._gap = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def publish_many(self, channels, type, data=None):
+        db.session.execute(Event.__table__.insert(), [
+            {'channel': channel, 'type': type, 'data': data,
+             'created_on': datetime.utcnow()} for channel in channels])
+
+    def _start(self):
+        # gunicorn forks after the app is created, so every worker
+        # process starts its own poller on first use.
+        if self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._pid != os.getpid():
+                self._last_id = self._dropped_id = db.session.query(
+                    db.func.max(Event.id)).scalar() or 0
+                self._events.clear()
+                self._gap = None
+                self._pid = os.getpid()
+                threading.Thread(target=self._poll, daemon=True).start()
+
+    def _fetch(self):
+        rows = Event.query.filter(Event.id > self._last_id).order_by(
+            Event.id).limit(self.batch_size).all()
+        return [dict(row.to_dict(), channel=row.channel) for row in rows]
+
+    def _in_order(self, events):
+        """
+        Keep the fetched events that can be delivered, i.e. those
+        before the first missing id that may still be committed.
+
+        :param events: Events fetched after the last delivered one
+        :return: list of events
+        """
+        expected = self._last_id + 1
+
+        for i, event in enumerate(events):
+            if event['id'] != expected:
+                now = time.monotonic()
+
+                if self._gap is None or self._gap[0] != expected:
+                    self._gap = (expected, now)
+
+                if now - self._gap[1] < self.gap_timeout:
+                    return events[:i]
+
+                self._gap = None
+            expected = event['id'] + 1
+
+        return events
+
+    def _prune(self):
+        Event.query.filter(Event.created_on < datetime.utcnow() - timedelta(
+            seconds=self.retention)).delete(synchronize_session=False)
+        db.session.commit()
+
+    def poll(self):
+        """
+        Read the new events and hand them to the waiting clients.
+
+        :return: int, number of events read
+        """
+        fetched = self._fetch()
+        events = self._in_order(fetched)
+
+        if events:
+            self._dispatch(events)
+
+        return len(fetched)
+
+    def _poll(self):
+        next_prune = 0
+
+        while True:
+            with self.app.app_context():
+                try:
+                    count = self.poll()
+
+                    if time.monotonic() >= next_prune:
+                        self._prune()
+                        next_prune = time.monotonic() + self.retention
+                except Exception as e:
+                    db.session.rollback()
+                    self.app.logger.exception(e)
+                    count = 0
+                finally:
+                    db.session.remove()
+
+            if count < self.batch_size or self._gap is not None:
+                time.sleep(self.poll_interval)
+
+
+def after_commit(session):
+    events = session.info.pop('broker_events', None)
+
+    if events:
+        current_app.broker.deliver(events)
+
+
+def after_rollback(session):
+    session.info.pop('broker_events', None)
+
+
+db.event.listen(db.session, 'after_commit', after_commit)
+db.event.listen(db.session, 'after_rollback', after_rollback)
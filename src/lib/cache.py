@@ -0,0 +1,91 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class TTLCache(object):
+    """
+    A bounded, thread-safe LRU cache whose entries expire after a
+    fixed number of seconds.
+
+    Each gunicorn worker holds its own instance, so entries are only
+    as fresh as ``ttl`` allows across workers.
+    """
+    _missing = object()
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        """
+        Get a cached value, marking it as the most recently used.
+
+        :param key: Cache key
+        :param default: Value returned on a miss
+        :return: Cached value or default
+        """
+        with self._lock:
+            value, expires = self._data.get(key, (self._missing, 0))
+
+            if value is self._missing or expires < time.monotonic():
+                if value is not self._missing:
+                    del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """
+        Cache a value, evicting the least recently used entry when full.
+
+        :param key: Cache key
+        :param value: Value to cache
+        :return: None
+        """
+        if self.maxsize <= 0:
+            return
+
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """
+        Report the cache counters, used to size the cache.
+
+        :return: dict
+        """
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hitRate': round(self.hits / lookups, 4) if lookups else None,
+        }
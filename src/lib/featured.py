@@ -0,0 +1,68 @@
+import time
+import random
+import threading
+
+from sqlalchemy.orm import joinedload
+
+from src import db
+
+
+class FeaturedPool(object):
+    """
+    Pick featured posts at random from a bounded pool of candidates.
+
+    The pool holds the ids of the ``size`` hottest top-level posts and
+    is reloaded with a single index scan at most once every
+    ``refresh_interval`` seconds. Sampling happens in memory, so serving
+    a request costs one small IN query no matter how many posts exist.
+    """
+
+    def __init__(self, size=200, refresh_interval=300):
+        self.size = size
+        self.refresh_interval = refresh_interval
+        self._ids = None
+        self._next_refresh = 0
+        self._lock = threading.Lock()
+
+    def _load(self, model):
+        return [post_id for post_id, in db.session.query(model.id).filter(
+            model.comment_id.is_(None)).order_by(
+                model.hot_score.desc(), model.id.desc()).limit(self.size)]
+
+    def candidates(self):
+        """
+        Get the candidate ids, reloading them when they are due.
+
+        :return: list of post ids
+        """
+        from src.blueprints.posts.models import Post
+
+        now = time.monotonic()
+
+        if not self._ids or now >= self._next_refresh:
+            with self._lock:
+                if not self._ids or now >= self._next_refresh:
+                    self._ids = self._load(Post)
+                    self._next_refresh = now + self.refresh_interval
+
+        return self._ids
+
+    def sample(self, k):
+        """
+        Get up to ``k`` distinct random posts from the pool. Posts
+        deleted since the last reload are skipped.
+
+        :param k: Number of posts
+        :return: list of Post instances
+        """
+        from src.blueprints.posts.models import Post
+
+        ids = self.candidates()
+        picked = random.sample(ids, min(len(ids), k))
+
+        if not picked:
+            return []
+
+        posts = {post.id: post for post in Post.query.options(
+            joinedload(Post.author)).filter(Post.id.in_(picked))}
+        return [posts[post_id] for post_id in picked if post_id in posts]
@@ -0,0 +1,91 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class HasherBusy(Exception):
+    """Raised when the hashing pool has no room for another job."""
+
+
+class PasswordHasher(object):
+    """
+    Run password hashing and verification on a process pool, so PBKDF2
+    does not block the worker that is serving requests.
+
+    At most ``workers + queue_size`` jobs may be in flight, anything
+    beyond that is rejected with `HasherBusy` instead of queueing. With
+    ``workers=0`` hashing runs inline, which is what the tests use.
+    """
+
+    def __init__(self, method, workers=2, queue_size=16, timeout=10):
+        self.method = method
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # gunicorn forks after the app is created, so every worker
+        # process starts its own pool on first use.
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                self._pid = os.getpid()
+
+            return self._executor
+
+    def _run(self, func, *args):
+        if not self.workers:
+            return func(*args)
+
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy()
+
+        try:
+            future = self._get_executor().submit(func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+
+        future.add_done_callback(lambda _: self._slots.release())
+
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise HasherBusy()
+
+    def hash(self, password):
+        """
+        Hash a plaintext password with the configured method.
+
+        :param password: Password in plain text
+        :return: str
+        """
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        """
+        Check a plaintext password against a hash.
+
+        :param pwhash: Password hash
+        :param password: Password in plain text
+        :return: boolean
+        """
+        if not pwhash:
+            return False
+
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """
+        Check if a hash was made with other parameters than the
+        configured ones.
+
+        :param pwhash: Password hash
+        :return: boolean
+        """
+        return pwhash.split('$', 1)[0] != self.method
@@ -0,0 +1,246 @@
+import os
+import socket
+import traceback
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy.orm.attributes import set_committed_value
+
+from src import db
+
+
+# job name -> function taking the job, filled in by the `handler` decorator
+handlers = {}
+
+
+class LeaseLost(Exception):
+    """The job was requeued and may be run by another worker."""
+
+
+class Job(db.Model):
+    """
+    A unit of background work, queued in the same transaction as the
+    write that calls for it and run by the `run_jobs` workers.
+    """
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        db.Index('ix_jobs_state_run_after', 'state', 'run_after', 'id'),
+        db.Index('ix_jobs_name_key_state', 'name', 'key', 'state'),
+    )
+    QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(64), nullable=False)
+    # queued jobs with the same name and key are run once, see `enqueue`
+    key = db.Column(db.String(64))
+    payload = db.Column(db.JSON, default=dict, nullable=False)
+    state = db.Column(db.String(16), default=QUEUED, nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    error = db.Column(db.Text)
+    locked_by = db.Column(db.String(128))
+    created_on = db.Column(
+        db.DateTime, default=datetime.utcnow, nullable=False)
+    run_after = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    started_on = db.Column(db.DateTime)
+    finished_on = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.name}: {self.state}>'
+
+    def checkpoint(self, **progress):
+        """
+        Record a job's progress, committed with the work done so far so
+        a retry resumes from there. The worker's lease on the job is
+        renewed, unless the job was requeued in the meantime, in which
+        case the work done since the last checkpoint must be dropped.
+
+        :param progress: Payload keys to update
+        :raises LeaseLost: When the worker no longer holds the job
+        :return: None
+        """
+        payload = dict(self.payload, **progress)
+        renewed = Job.query.filter(
+            Job.id == self.id, Job.state == Job.RUNNING,
+            Job.locked_by == self.locked_by).update({
+                Job.payload: payload,
+                Job.started_on: datetime.utcnow(),
+            }, synchronize_session=False)
+
+        if not renewed:
+            raise LeaseLost(f'Job {self.id} was requeued.')
+
+        set_committed_value(self, 'payload', payload)
+
+
+def handler(name):
+    """
+    Register a function as the handler of a job.
+
+    :param name: Job name
+    :return: decorator
+    """
+    def decorator(func):
+        handlers[name] = func
+        return func
+    return decorator
+
+
+def enqueue(name, key=None, delay=0, **payload):
+    """
+    Queue a job in the current transaction. A job given a key is not
+    queued again while one with the same name and key still waits to
+    run, so a burst of writes calling for the same work runs it once.
+
+    :param name: Job name
+    :param key: Key of the work to run once, e.g. 'user:<id>'
+    :param delay: Seconds to wait before running the job
+    :param payload: JSON serializable arguments of the job
+    :return: Job instance
+    """
+    if key is not None:
+        job = Job.query.filter_by(
+            name=name, key=key, state=Job.QUEUED).first()
+
+        if job is not None:
+            return job
+
+    job = Job(name=name, key=key, payload=payload,
+              run_after=datetime.utcnow() + timedelta(seconds=delay))
+    db.session.add(job)
+    return job
+
+
+def worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def requeue_stale(lease):
+    """
+    Requeue the jobs whose worker has held them for longer than a lease
+    without a checkpoint, e.g. because it died.
+
+    :param lease: Seconds a worker may hold a job
+    :return: int, number of requeued jobs
+    """
+    count = Job.query.filter(
+        Job.state == Job.RUNNING,
+        Job.started_on < datetime.utcnow() - timedelta(seconds=lease)).update({
+            Job.state: Job.QUEUED, Job.locked_by: None,
+        }, synchronize_session=False)
+    db.session.commit()
+    return count
+
+
+def prune(retention):
+    """
+    Delete the jobs that finished more than a while ago.
+
+    :param retention: Seconds finished jobs are kept for
+    :return: int, number of deleted jobs
+    """
+    count = Job.query.filter(
+        Job.state.in_((Job.DONE, Job.FAILED)),
+        Job.finished_on < datetime.utcnow() - timedelta(
+            seconds=retention)).delete(synchronize_session=False)
+    db.session.commit()
+    return count
+
+
+def claim(worker):
+    """
+    Take the oldest job that is due. The claim is a conditional UPDATE,
+    so concurrent workers never run the same job.
+
+    :param worker: Id of the claiming worker
+    :return: Job instance or None
+    """
+    while True:
+        job_id = db.session.query(Job.id).filter(
+            Job.state == Job.QUEUED,
+            Job.run_after <= datetime.utcnow()).order_by(Job.id).limit(
+                1).scalar()
+
+        if job_id is None:
+            db.session.commit()
+            return None
+
+        claimed = Job.query.filter(
+            Job.id == job_id, Job.state == Job.QUEUED).update({
+                Job.state: Job.RUNNING,
+                Job.locked_by: worker,
+                Job.started_on: datetime.utcnow(),
+                Job.attempts: Job.attempts + 1,
+            }, synchronize_session=False)
+        db.session.commit()
+
+        if claimed:
+            return Job.query.get(job_id)
+
+
+def run_next(worker, max_attempts=5, retry_delay=30):
+    """
+    Claim and run one job. Failed jobs are retried with an exponential
+    backoff until they have been attempted ``max_attempts`` times.
+
+    :param worker: Id of the worker
+    :param max_attempts: Attempts before a job is marked as failed
+    :param retry_delay: Seconds to wait before the first retry
+    :return: Job instance or None when no job was due
+    """
+    job = claim(worker)
+
+    if job is None:
+        return None
+
+    try:
+        handlers[job.name](job)
+    except LeaseLost as e:
+        # another worker holds the job now, leave its state alone
+        db.session.rollback()
+        current_app.logger.exception(e)
+        return job
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.exception(e)
+        job = Job.query.get(job.id)
+        values = {Job.error: traceback.format_exc()}
+
+        if job.attempts >= max_attempts:
+            values.update({
+                Job.state: Job.FAILED, Job.finished_on: datetime.utcnow()})
+        else:
+            values.update({
+                Job.state: Job.QUEUED,
+                Job.run_after: datetime.utcnow() + timedelta(
+                    seconds=retry_delay * 2 ** (job.attempts - 1)),
+            })
+    else:
+        values = {Job.state: Job.DONE, Job.finished_on: datetime.utcnow()}
+
+    values[Job.locked_by] = None
+    Job.query.filter(Job.id == job.id, Job.locked_by == worker).update(
+        values, synchronize_session=False)
+    db.session.commit()
+    return job
+
+
+def queue_stats():
+    """
+    Count the jobs by state and measure how far behind the queue is.
+
+    :return: dict
+    """
+    now = datetime.utcnow()
+    counts = dict(db.session.query(Job.state, db.func.count()).group_by(
+        Job.state).all())
+    oldest = db.session.query(db.func.min(Job.created_on)).filter(
+        Job.state == Job.QUEUED, Job.run_after <= now).scalar()
+
+    return {
+        'queued': counts.get(Job.QUEUED, 0),
+        'running': counts.get(Job.RUNNING, 0),
+        'done': counts.get(Job.DONE, 0),
+        'failed': counts.get(Job.FAILED, 0),
+        'lagSeconds': round((now - oldest).total_seconds(), 3)
+        if oldest else 0,
+    }
@@ -1,5 +1,7 @@
 from datetime import datetime
 
+from flask import current_app
+
 from src import db
 
 
@@ -26,14 +28,24 @@ class ResourceMixin(object):
         """
         return cls.query.get(int(id))
 
+    def identity_key(self):
+        """
+        Get the id of the cached identity this instance is part of.
+
+        :return: User id or None
+        """
+        return None
+
     def save(self):
         """
         Save a model instance.
 
         :return: Model instance
         """
+        key = self.identity_key()
         db.session.add(self)
         db.session.commit()
+        self.invalidate_identity(key)
 
         return self
 
@@ -43,5 +55,20 @@ class ResourceMixin(object):
 
         :return: db.session.commit()'s result
         """
+        key = self.identity_key()
         db.session.delete(self)
-        return db.session.commit()
+        result = db.session.commit()
+        self.invalidate_identity(key)
+
+        return result
+
+    @staticmethod
+    def invalidate_identity(key):
+        """
+        Drop a user from the identity cache used by `authenticate`.
+
+        :param key: User id
+        :return: None
+        """
+        if key is not None:
+            current_app.identity_cache.invalidate(key)
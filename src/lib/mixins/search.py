@@ -1,9 +1,16 @@
+from flask import current_app
+from sqlalchemy.orm.attributes import get_history
+
 from src import db
-from src.lib.search import add_to_index, remove_from_index, \
-    query_index, TagsIndex, UsersIndex
+from src.lib.search import reindex, query_index, SearchChange
 
 
 class SearchableMixin(object):
+    # name of the search index the model feeds documents into, and the
+    # columns those documents are built from
+    __search_index__ = None
+    __search_fields__ = ()
+
     @classmethod
     def search(cls, indexDoc, expression):
         ids, total = query_index(indexDoc, expression)
@@ -11,6 +18,19 @@ class SearchableMixin(object):
         if total == 0:
             return []
 
+        return cls.get_ranked(ids)
+
+    @classmethod
+    def get_ranked(cls, ids):
+        """
+        Load the instances behind search hits, in the order of the hits.
+
+        :param ids: Ids of the hits
+        :return: list
+        """
+        if not ids:
+            return []
+
         when = []
         for i in range(len(ids)):
             when.append((ids[i], i))
@@ -20,40 +40,80 @@ class SearchableMixin(object):
 
     @classmethod
     def reindex(cls, doc):
-        add_to_index(doc, cls)
+        reindex(current_app.elasticsearch, doc)
 
-    @classmethod
-    def before_commit(cls, session):
-        session._changes = {
-            'add': list(session.new),
-            'update': list(session.dirty),
-            'delete': list(session.deleted)
-        }
+    def search_key(self):
+        """
+        Get the id of the search document this instance is part of.
 
-    @classmethod
-    def after_commit(cls, session):
-        for obj in session._changes['add']:
-            if isinstance(obj, SearchableMixin):
-                if str(type(obj)) == 'User':
-                    add_to_index(UsersIndex, obj)
-                if str(type(obj)) == 'Tag':
-                    add_to_index(TagsIndex, obj)
-
-        for obj in session._changes['update']:
-            if isinstance(obj, SearchableMixin):
-                if str(type(obj)) == 'User':
-                    add_to_index(UsersIndex, obj)
-                if str(type(obj)) == 'Tag':
-                    add_to_index(TagsIndex, obj)
-
-        for obj in session._changes['delete']:
-            if isinstance(obj, SearchableMixin):
-                if str(type(obj)) == 'User':
-                    remove_from_index(UsersIndex, obj)
-                if str(type(obj)) == 'Tag':
-                    remove_from_index(TagsIndex, obj)
-        session._changes = None
-
-
-db.event.listen(db.session, 'before_commit', SearchableMixin.before_commit)
+        :return: Document id
+        """
+        return self.id
+
+    def search_changed(self):
+        """
+        Check if a flush changes any column the search document is
+        built from.
+
+        :return: boolean
+        """
+        return any(get_history(self, field).has_changes()
+                   for field in self.__search_fields__)
+
+    def search_touch(self):
+        """
+        Mark the search document as changed by a write the ORM doesn't
+        track, e.g. a bulk counter update, so it is resynced with the
+        next flush.
+
+        :return: None
+        """
+        db.session.info.setdefault('search_touched', set()).add(
+            (self.__search_index__, self.search_key()))
+
+    @staticmethod
+    def after_flush(session, flush_context):
+        """
+        Collect the search documents touched by a flush. With
+        Elasticsearch they are queued in the search_changes table, in the
+        same transaction, for the sync worker to apply.
+        """
+        changed = [obj for obj in session.new | session.deleted
+                   if isinstance(obj, SearchableMixin)]
+        changed += [obj for obj in session.dirty
+                    if isinstance(obj, SearchableMixin)
+                    and obj.search_changed()]
+        keys = {(obj.__search_index__, obj.search_key()) for obj in changed}
+        keys |= session.info.pop('search_touched', set())
+
+        if not keys:
+            return
+
+        if current_app.elasticsearch is None:
+            session.info.setdefault('search_changes', set()).update(keys)
+            return
+
+        session.connection().execute(
+            SearchChange.__table__.insert(),
+            [{'index': index, 'doc_id': doc_id}
+             for index, doc_id in sorted(keys)])
+
+    @staticmethod
+    def after_commit(session):
+        """
+        Hand the committed changes to the in-process search engine.
+        """
+        keys = session.info.pop('search_changes', None)
+
+        if keys and current_app.local_search is not None:
+            current_app.local_search.invalidate(keys)
+
+    @staticmethod
+    def after_rollback(session):
+        session.info.pop('search_changes', None)
+        session.info.pop('search_touched', None)
+
+
+db.event.listen(db.session, 'after_flush', SearchableMixin.after_flush)
 db.event.listen(db.session, 'after_commit', SearchableMixin.after_commit)
+db.event.listen(db.session, 'after_rollback', SearchableMixin.after_rollback)
@@ -0,0 +1,155 @@
+import json
+import base64
+from datetime import datetime
+
+from flask import request, current_app
+from sqlalchemy import and_, or_, tuple_, literal
+from sqlalchemy.sql import operators
+
+
+class InvalidCursor(Exception):
+    """Raised when a cursor was not issued by this paginator."""
+
+
+def encode_cursor(values):
+    """
+    Encode the key values of a row into an opaque cursor. Numbers and
+    strings are kept as JSON values, datetimes are tagged so they come
+    back as datetimes.
+
+    :param values: Sequence of key values
+    :return: str
+    """
+    data = [{'d': v.isoformat()} if isinstance(v, datetime) else v
+            for v in values]
+    raw = json.dumps(data, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor made by `encode_cursor`.
+
+    :param cursor: Cursor string
+    :return: list of key values
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        data = json.loads(raw.decode('utf-8'))
+
+        if not isinstance(data, list):
+            raise InvalidCursor()
+
+        values = [datetime.fromisoformat(v['d']) if isinstance(v, dict)
+                  else v for v in data]
+    except (TypeError, KeyError, ValueError):
+        raise InvalidCursor()
+
+    if not values or not all(
+            isinstance(v, (int, float, str, datetime)) for v in values):
+        raise InvalidCursor()
+
+    return values
+
+
+def page_args():
+    """
+    Read the page position and size of a list request. A missing cursor,
+    or the cursor '0', asks for the first page. The page size defaults
+    to ITEMS_PER_PAGE and is clamped to ITEMS_PER_PAGE_MAX.
+
+    :return: tuple of (key values to start after or None, page size)
+    """
+    cursor = request.args.get('cursor')
+    limit = request.args.get(
+        'limit', current_app.config['ITEMS_PER_PAGE'], int)
+    limit = max(1, min(limit, current_app.config['ITEMS_PER_PAGE_MAX']))
+
+    if not cursor or cursor == '0':
+        return None, limit
+
+    return decode_cursor(cursor), limit
+
+
+def _key_column(key):
+    if getattr(key, 'modifier', None) in (operators.desc_op,
+                                          operators.asc_op):
+        return key.element, key.modifier is operators.desc_op
+    return key, False
+
+
+def seek_after(keys, values):
+    """
+    Build the condition selecting the rows that sort after the given key
+    values. When all keys sort the same way this is a single row value
+    comparison, which the database answers with a range scan of an
+    index on the keys, so each keyset needs a matching composite index.
+
+    :param keys: Ordered key columns
+    :param values: Key values of the last row seen
+    :return: SQL expression
+    """
+    columns = [_key_column(key) for key in keys]
+
+    if len(values) != len(columns):
+        raise InvalidCursor()
+
+    bounds = [literal(value, column.type)
+              for (column, _), value in zip(columns, values)]
+
+    if len({desc for _, desc in columns}) == 1:
+        row = tuple_(*[column for column, _ in columns])
+        bound = tuple_(*bounds)
+        return row < bound if columns[0][1] else row > bound
+
+    clauses = []
+    for i, ((column, desc), bound) in enumerate(zip(columns, bounds)):
+        ties = [c == b for (c, _), b in zip(columns[:i], bounds[:i])]
+        clauses.append(and_(*ties, column < bound if desc else column > bound))
+    return or_(*clauses)
+
+
+def split_page(rows, limit, key):
+    """
+    Split the ``limit + 1`` rows fetched for a page into the page and
+    the cursor of the next page.
+
+    :param rows: Fetched rows
+    :param limit: Page size
+    :param key: Callable returning the key values of a row
+    :return: tuple of (list of rows, next cursor or None)
+    """
+    if len(rows) <= limit:
+        return rows, None
+    return rows[:limit], encode_cursor(key(rows[limit - 1]))
+
+
+def paginate(query, keys, after=None, limit=None, key=None):
+    """
+    Get one page of a query with keyset pagination.
+
+    Rows are ordered by ``keys``, the last of which has to be unique,
+    usually the primary key, so the order is total and ties neither skip
+    nor repeat rows between pages. Each page starts right after the last
+    row of the previous one instead of at an offset.
+
+    :param query: Query to paginate
+    :param keys: Ordered key columns, each may be wrapped in .desc()
+    :param after: Key values of the last row seen, None for the first page
+    :param limit: Page size, defaults to ITEMS_PER_PAGE
+    :param key: Callable returning the key values of a row, by default
+        they are read off the row by column name
+    :return: tuple of (list of rows, next cursor or None)
+    """
+    limit = limit or current_app.config['ITEMS_PER_PAGE']
+
+    if key is None:
+        names = [_key_column(k)[0].key for k in keys]
+        key = lambda row: [getattr(row, name) for name in names]  # noqa
+
+    query = query.order_by(None).order_by(*keys)
+
+    if after is not None:
+        query = query.filter(seek_after(keys, after))
+
+    return split_page(query.limit(limit + 1).all(), limit, key)
@@ -0,0 +1,147 @@
+import time
+import threading
+from hashlib import blake2b
+from datetime import datetime, timedelta
+
+from src import db
+
+
+class BloomFilter(object):
+    """
+    A fixed size Bloom filter over strings. Lookups never give false
+    negatives, false positives have to be confirmed by the caller.
+    """
+
+    def __init__(self, size=1 << 20, hashes=7):
+        self.size = size
+        self.hashes = hashes
+        self._bits = bytearray((size + 7) // 8)
+
+    def _positions(self, key):
+        digest = blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:], 'big') | 1
+
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key):
+        return all(
+            self._bits[pos >> 3] & (1 << (pos & 7))
+            for pos in self._positions(key))
+
+
+class RevocationList(object):
+    """
+    Keep track of revoked auth tokens by their jti.
+
+    Revoked tokens live in the revoked_tokens table, and each worker
+    mirrors them in a Bloom filter. The filter is refreshed with the rows
+    revoked since its last refresh at most once every
+    ``refresh_interval`` seconds, so checking a token that was never
+    revoked costs no query. Only filter hits are confirmed against the
+    table. The filter is rebuilt from the unexpired rows every
+    ``rebuild_interval`` seconds, so expired tokens drop out of it. The
+    expired rows themselves are deleted by the `prune_revoked_tokens`
+    command.
+    """
+    # rows may commit slightly out of order, so every refresh re-reads
+    # this much of the window it already saw.
+    overlap = timedelta(seconds=60)
+
+    def __init__(self, refresh_interval=5, rebuild_interval=3600,
+                 size=1 << 20, hashes=7):
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self.size = size
+        self.hashes = hashes
+        self._filter = None
+        self._synced_to = None
+        self._next_refresh = 0
+        self._next_rebuild = 0
+        self._lock = threading.Lock()
+
+    def _rebuild(self, model):
+        bloom = BloomFilter(self.size, self.hashes)
+        synced_to = datetime.utcnow()
+
+        for jti, in db.session.query(model.jti).filter(
+                model.expires_on >= synced_to):
+            bloom.add(jti)
+
+        self._filter = bloom
+        self._synced_to = synced_to
+
+    def _refresh(self, model):
+        synced_to = datetime.utcnow()
+
+        for jti, in db.session.query(model.jti).filter(
+                model.revoked_on >= self._synced_to - self.overlap):
+            self._filter.add(jti)
+
+        self._synced_to = synced_to
+
+    def sync(self):
+        """
+        Bring the filter up to date with the table when it is due.
+
+        :return: None
+        """
+        from src.blueprints.users.models import RevokedToken
+
+        now = time.monotonic()
+
+        if self._filter is not None and now < self._next_refresh:
+            return
+
+        with self._lock:
+            if self._filter is None or now >= self._next_rebuild:
+                self._rebuild(RevokedToken)
+                self._next_rebuild = now + self.rebuild_interval
+            elif now >= self._next_refresh:
+                self._refresh(RevokedToken)
+
+            self._next_refresh = now + self.refresh_interval
+
+    def revoke(self, jti, expires_on):
+        """
+        Revoke a token.
+
+        :param jti: The token's id
+        :param expires_on: When the token expires
+        :return: None
+        """
+        from src.blueprints.users.models import RevokedToken
+
+        if db.session.query(RevokedToken.jti).filter_by(jti=jti).first():
+            return
+
+        db.session.add(RevokedToken(jti=jti, expires_on=expires_on))
+        db.session.commit()
+
+        if self._filter is not None:
+            self._filter.add(jti)
+
+    def is_revoked(self, jti):
+        """
+        Check if a token has been revoked.
+
+        :param jti: The token's id
+        :return: boolean
+        """
+        from src.blueprints.users.models import RevokedToken
+
+        if not jti:
+            return False
+
+        self.sync()
+
+        if jti not in self._filter:
+            return False
+
+        return db.session.query(RevokedToken.jti).filter_by(
+            jti=jti).first() is not None
@@ -1,57 +1,441 @@
+import time
+import threading
+from collections import deque
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
 from flask import current_app
+from elasticsearch.helpers import bulk, BulkIndexError
 from elasticsearch_dsl.query import MultiMatch
-from elasticsearch_dsl import SearchAsYouType, Document, connections
+from elasticsearch_dsl import SearchAsYouType, Keyword, Integer, Document, \
+    MultiSearch
+
+from src import db
+from src.lib.cache import TTLCache
+from src.lib.breaker import CircuitBreaker, CircuitOpen
+
+
+class SearchChange(db.Model):
+    """
+    Outbox of search documents to update, filled in the transaction
+    that changes their rows and drained by `sync_changes`.
+    """
+    __tablename__ = 'search_changes'
+
+    id = db.Column(db.Integer, primary_key=True)
+    index = db.Column(db.String(32), nullable=False)
+    doc_id = db.Column(db.Integer, nullable=False)
+    created_on = db.Column(
+        db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<SearchChange {self.index} {self.doc_id}>'
 
 
 class TagsIndex(Document):
     name = SearchAsYouType(max_shingle_size=3)
+    followers = Integer()
+    # fields matched by queries, and fields results are rendered from
+    search_fields = ('name',)
+    display_fields = ('name', 'followers')
 
     class Index:
         name = "tags"
         settings = {"number_of_shards": 1, "number_of_replicas": 0}
 
+    @classmethod
+    def rows(cls, ids=None, since=None):
+        """
+        Query the rows tag documents are built from, the document id
+        labeled 'id' and every other column a source field.
+
+        :param ids: Only the tags with these ids
+        :param since: Only the tags changed since then
+        :return: Query
+        """
+        from src.blueprints.tags.models import Tag
+
+        query = db.session.query(
+            Tag.id, Tag.name, Tag.follower_count.label('followers'))
+
+        if ids is not None:
+            query = query.filter(Tag.id.in_(ids))
+        if since is not None:
+            query = query.filter(Tag.updated_on >= since)
+        return query
+
 
 class UsersIndex(Document):
     name = SearchAsYouType(max_shingle_size=3)
     username = SearchAsYouType(max_shingle_size=3)
+    avatar = Keyword(index=False)
+    followers = Integer()
+    # fields matched by queries, and fields results are rendered from
+    search_fields = ('name', 'username')
+    display_fields = ('name', 'username', 'avatar', 'followers')
 
     class Index:
         name = "users"
         settings = {"number_of_shards": 1, "number_of_replicas": 0}
 
+    @classmethod
+    def rows(cls, ids=None, since=None):
+        """
+        Query the rows user documents are built from, the document id
+        labeled 'id' and every other column a source field.
 
-def add_to_index(doc, model):
-    connections.create_connection(hosts=current_app.search_host, timeout=60)
-    doc.init()
+        :param ids: Only the users with these ids
+        :param since: Only the users whose profile changed since then
+        :return: Query
+        """
+        from src.blueprints.profiles.models import Profile
+        from src.blueprints.users.models import followers
 
-    if model.__tablename__ == 'users':
-        for i in model.query:
-            doc(_id=i.id, name=i.profile.name, username=i.profile.username).save()
-    else:
-        for i in model.query:
-            doc(_id=i.id, name=i.name).save()
+        follower_count = db.select([db.func.count()]).where(
+            followers.c.followed_id == Profile.user_id).as_scalar()
+        query = db.session.query(
+            Profile.user_id.label('id'), Profile.name, Profile.username,
+            Profile.avatar, follower_count.label('followers'))
 
-    doc._index.refresh()
+        if ids is not None:
+            query = query.filter(Profile.user_id.in_(ids))
+        if since is not None:
+            query = query.filter(Profile.updated_on >= since)
+        return query
 
 
-def remove_from_index(index, model):
-    if not current_app.elasticsearch:
-        return
-    current_app.elasticsearch.delete(index=index, id=model.id)
+SEARCH_INDICES = {doc.Index.name: doc for doc in (TagsIndex, UsersIndex)}
 
 
-def query_index(index, term):
-    connections.create_connection(hosts=current_app.search_host, timeout=20)
-    results = []
+def document_source(row):
+    """
+    Turn a row of `rows()` into a document source.
+
+    :param row: Result row
+    :return: dict
+    """
+    return {k: v for k, v in row._asdict().items() if k != 'id'}
+
+
+def reindex(client, doc, chunk_size=500, threads=4, progress=None):
+    """
+    Rebuild a search index without downtime. Rows are streamed from the
+    database and sent as chunked bulk requests from a pool of threads
+    into a new, versioned index. Once its document count matches the
+    rows sent, the index's alias is moved to it in one atomic update
+    and the previous version is dropped. Rows changed while the index
+    was built are queued for the sync worker afterwards.
+
+    :param client: Elasticsearch client
+    :param doc: Document class of the index
+    :param chunk_size: Documents per bulk request
+    :param threads: Number of parallel bulk requests
+    :param progress: Called with the number of documents sent and the
+        seconds elapsed whenever a chunk is done
+    :return: Name of the new index
+    """
+    alias = doc.Index.name
+    started = datetime.utcnow()
+    name = f'{alias}-{started:%Y%m%d%H%M%S}'
+    doc._index.clone(name).create(using=client)
+
+    def send(chunk):
+        return bulk(client, chunk, chunk_size=chunk_size)[0]
+
+    # rows are streamed on this thread, only the bulk requests run on
+    # the pool, with at most two chunks per thread waiting to be sent.
+    rows = doc.rows().order_by('id').yield_per(chunk_size)
+    clock = time.monotonic()
+    pending = set()
+    chunk = []
+    sent = 0
+
+    def collect(futures):
+        nonlocal sent
+        for future in futures:
+            sent += future.result()
+            if progress:
+                progress(sent, time.monotonic() - clock)
 
     try:
-        s = index.search()
-        s.query = MultiMatch(query=term, type="bool_prefix", fields=["*"])
-        response = s.execute()
-    except Exception as e:
-        print(e)
-        return None
-
-    for res in response:
-        results.append(res.meta.id)
-    return results, len(response)
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            for row in rows:
+                chunk.append({'_index': name, '_id': row.id,
+                              '_source': document_source(row)})
+
+                if len(chunk) == chunk_size:
+                    pending.add(pool.submit(send, chunk))
+                    chunk = []
+
+                if len(pending) >= 2 * threads:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+
+            if chunk:
+                pending.add(pool.submit(send, chunk))
+            collect(wait(pending).done)
+    except Exception:
+        client.indices.delete(index=name, ignore=404)
+        raise
+
+    client.indices.refresh(index=name)
+    indexed = client.count(index=name)['count']
+
+    if indexed != sent:
+        client.indices.delete(index=name)
+        raise RuntimeError(f'Indexed {indexed} of {sent} {alias} documents, '
+                           f'kept the current index.')
+
+    swap = [{'add': {'index': name, 'alias': alias}}]
+    old = []
+
+    if client.indices.exists_alias(name=alias):
+        old = list(client.indices.get_alias(name=alias))
+        swap += [{'remove': {'index': i, 'alias': alias}} for i in old]
+    elif client.indices.exists(index=alias):
+        swap.append({'remove_index': {'index': alias}})
+
+    client.indices.update_aliases(body={'actions': swap})
+
+    for index in old:
+        client.indices.delete(index=index)
+
+    db.session.bulk_insert_mappings(SearchChange, [
+        {'index': alias, 'doc_id': row.id}
+        for row in doc.rows(since=started)])
+    db.session.commit()
+
+    return name
+
+
+def sync_changes(client, batch_size=500):
+    """
+    Apply the oldest queued search changes with one bulk request. Each
+    document is rebuilt from its current rows, documents whose rows are
+    gone are deleted. Changes are only dequeued once applied.
+
+    :param client: Elasticsearch client
+    :param batch_size: Maximum number of changes to apply
+    :return: Number of changes applied
+    """
+    changes = SearchChange.query.order_by(
+        SearchChange.id).limit(batch_size).all()
+    actions = []
+
+    for index, doc in SEARCH_INDICES.items():
+        ids = {c.doc_id for c in changes if c.index == index}
+
+        if not ids:
+            continue
+
+        if not client.indices.exists(index=index):
+            doc.init(using=client)
+
+        sources = {row.id: document_source(row)
+                   for row in doc.rows(ids=ids)}
+        actions += [
+            {'_index': index, '_id': id, '_source': sources[id]}
+            if id in sources else
+            {'_op_type': 'delete', '_index': index, '_id': id}
+            for id in sorted(ids)]
+
+    if actions:
+        _, errors = bulk(client, actions, raise_on_error=False)
+        failed = [e for e in errors
+                  if e.get('delete', {}).get('status') != 404]
+
+        if failed:
+            db.session.rollback()
+            raise BulkIndexError(
+                f'{len(failed)} document(s) failed to sync.', failed)
+
+    SearchChange.query.filter(
+        SearchChange.id.in_([c.id for c in changes])).delete(
+            synchronize_session=False)
+    db.session.commit()
+    return len(changes)
+
+
+class SearchClient(object):
+    """
+    Run search-as-you-type queries on Elasticsearch through the app's
+    long-lived, pooled client. The queries of a search box, one per
+    index, go out together in a single multi-search request.
+
+    Results are kept in a short-lived LRU cache, since the search box
+    sends the same prefixes again and again. Calls go through a circuit
+    breaker. While the cluster is failing or slower than ``timeout``,
+    a query is answered from the cached results of its longest cached
+    prefix, or with no results, instead of waiting on the cluster.
+    """
+
+    def __init__(self, client, timeout=2, cache=None, breaker=None):
+        self.client = client
+        self.timeout = timeout
+        self.cache = cache or TTLCache()
+        self.breaker = breaker or CircuitBreaker()
+        self.calls = 0
+        self.errors = 0
+        self.fallbacks = 0
+        self._latencies = deque(maxlen=1000)
+        self._lock = threading.Lock()
+
+    def _timed_search(self, requests, term):
+        start = time.monotonic()
+
+        try:
+            return self._search(requests, term)
+        finally:
+            with self._lock:
+                self.calls += 1
+                self._latencies.append(time.monotonic() - start)
+
+    def _search(self, requests, term):
+        ms = MultiSearch(using=self.client).params(
+            request_timeout=self.timeout)
+
+        for index, size in requests:
+            fields = [f'{field}{gram}' for field in index.search_fields
+                      for gram in ('', '._2gram', '._3gram')]
+            s = index.search().source(list(index.display_fields))[:size]
+            s.query = MultiMatch(
+                query=term, type="bool_prefix", fields=fields)
+            ms = ms.add(s)
+
+        return [([dict(hit.to_dict(), id=int(hit.meta.id))
+                  for hit in response], len(response))
+                for response in ms.execute(raise_on_error=True)]
+
+    def _fallback(self, name, term, size):
+        for end in range(len(term) - 1, 0, -1):
+            cached = self.cache.get((name, term[:end], size))
+
+            if cached is not None:
+                return cached
+
+        return [], 0
+
+    def query_many(self, requests, term):
+        """
+        Search several indices for the same text. The queries that are
+        not cached are sent in one multi-search request.
+
+        :param requests: list of (Document class of the index, number of
+            hits to return)
+        :param term: Query text
+        :return: list of (list of hits, number of hits) in the order of
+            the requests, a hit being the document's display fields and
+            its id
+        """
+        term = ' '.join(term.lower().split())
+        keys = [(index.Index.name, term, size) for index, size in requests]
+        results = [self.cache.get(key) for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+
+        if not missing:
+            return results
+
+        try:
+            found = self.breaker.call(
+                self._timed_search, [requests[i] for i in missing], term)
+        except CircuitOpen:
+            with self._lock:
+                self.fallbacks += 1
+            found = [self._fallback(*keys[i]) for i in missing]
+        except Exception as e:
+            current_app.logger.exception(e)
+            with self._lock:
+                self.errors += 1
+                self.fallbacks += 1
+            found = [self._fallback(*keys[i]) for i in missing]
+        else:
+            for i, result in zip(missing, found):
+                self.cache.set(keys[i], result)
+
+        for i, result in zip(missing, found):
+            results[i] = result
+
+        return results
+
+    def query(self, index, term, size=10):
+        """
+        Search an index.
+
+        :param index: Document class of the index
+        :param term: Query text
+        :param size: Number of hits to return
+        :return: tuple of (list of hits, number of hits), a hit being
+            the document's display fields and its id
+        """
+        return self.query_many([(index, size)], term)[0]
+
+    def stats(self):
+        """
+        Report latency, error and cache counters, and the breaker state.
+
+        :return: dict
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return round(latencies[int(p * (len(latencies) - 1))] * 1000, 2)
+
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'fallbacks': self.fallbacks,
+            'latencyMs': {'p50': percentile(0.5), 'p95': percentile(0.95),
+                          'max': percentile(1)},
+            'cache': self.cache.stats(),
+            'breaker': self.breaker.stats(),
+        }
+
+
+def result_size(index):
+    """
+    Get the number of hits the search box shows for an index.
+
+    :param index: Document class of the index
+    :return: int
+    """
+    return current_app.config['SEARCH_RESULT_SIZES'].get(
+        index.Index.name, current_app.config['SEARCH_RESULT_SIZE'])
+
+
+def search_many(indices, term):
+    """
+    Search several indices for documents to render as they are, in a
+    single round trip to Elasticsearch.
+
+    :param indices: Document classes of the indices
+    :param term: Query text
+    :return: list of (list of hits, number of hits) in the order of the
+        indices, a hit being the document's display fields and its id
+    """
+    requests = [(index, result_size(index)) for index in indices]
+
+    if current_app.elasticsearch is None:
+        return [current_app.local_search.query(index.Index.name, term, size)
+                for index, size in requests]
+
+    return current_app.search_client.query_many(requests, term)
+
+
+def search_documents(index, term):
+    """
+    Search an index for documents to render as they are.
+
+    :param index: Document class of the index
+    :param term: Query text
+    :return: tuple of (list of hits, number of hits), a hit being the
+        document's display fields and its id
+    """
+    return search_many([index], term)[0]
+
+
+def query_index(index, term):
+    hits, total = search_documents(index, term)
+    return [hit['id'] for hit in hits], total
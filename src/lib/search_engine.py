@@ -0,0 +1,175 @@
+import re
+import time
+import threading
+
+
+def tokenize(text):
+    """
+    Split text into lowercase word tokens.
+
+    :param text: Text
+    :return: list of str
+    """
+    return re.findall(r'\w+', (text or '').lower())
+
+
+class PrefixIndex(object):
+    """
+    An in-memory search-as-you-type index. Every word of a document is
+    posted under each of its prefixes (edge n-grams) up to
+    ``max_prefix`` characters, so a query token is looked up directly.
+    """
+
+    def __init__(self, max_prefix=20):
+        self.max_prefix = max_prefix
+        self._postings = {}
+        self._tokens = {}
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def _prefixes(self, tokens):
+        return {token[:i] for token in tokens
+                for i in range(1, min(len(token), self.max_prefix) + 1)}
+
+    def add(self, doc_id, *texts):
+        """
+        Index a document, replacing an older version of it.
+
+        :param doc_id: Document id
+        :param texts: Searchable field values
+        :return: None
+        """
+        self.remove(doc_id)
+        tokens = {token for text in texts for token in tokenize(text)}
+        self._tokens[doc_id] = tokens
+
+        for prefix in self._prefixes(tokens):
+            self._postings.setdefault(prefix, set()).add(doc_id)
+
+    def remove(self, doc_id):
+        tokens = self._tokens.pop(doc_id, None)
+
+        if tokens is None:
+            return
+
+        for prefix in self._prefixes(tokens):
+            ids = self._postings[prefix]
+            ids.discard(doc_id)
+
+            if not ids:
+                del self._postings[prefix]
+
+    def search(self, term, size=10):
+        """
+        Find the documents with a word starting with any query token.
+        Documents score 2 for every token they hold as a whole word and
+        1 for every token they only hold as a prefix.
+
+        :param term: Query text
+        :param size: Number of ids to return
+        :return: tuple of (list of best matching ids, number of matches)
+        """
+        scores = {}
+
+        for token in set(tokenize(term)):
+            for doc_id in self._postings.get(token[:self.max_prefix], ()):
+                tokens = self._tokens[doc_id]
+
+                if token in tokens:
+                    scores[doc_id] = scores.get(doc_id, 0) + 2
+                elif any(t.startswith(token) for t in tokens):
+                    scores[doc_id] = scores.get(doc_id, 0) + 1
+
+        ranked = sorted(scores, key=lambda doc_id: (-scores[doc_id], doc_id))
+        return ranked[:size], len(ranked)
+
+
+class LocalSearch(object):
+    """
+    Serve `query_index` from in-process prefix indices when there is no
+    Elasticsearch cluster.
+
+    Each index is built from its documents' rows on first use and fully
+    rebuilt every ``refresh_interval`` seconds, which picks up writes
+    made by other workers. Writes committed by this worker are applied
+    before its next query.
+    """
+
+    def __init__(self, indices, refresh_interval=300, max_prefix=20):
+        self.indices = indices
+        self.refresh_interval = refresh_interval
+        self.max_prefix = max_prefix
+        self._index = {}
+        self._sources = {}
+        self._built = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _build(self, name):
+        doc = self.indices[name]
+        index = PrefixIndex(self.max_prefix)
+        sources = {}
+
+        for row in doc.rows():
+            index.add(row.id, *[getattr(row, f) for f in doc.search_fields])
+            sources[row.id] = {f: getattr(row, f) for f in doc.display_fields}
+
+        self._index[name] = index
+        self._sources[name] = sources
+        self._built[name] = time.monotonic()
+        self._pending[name] = set()
+
+    def _apply_pending(self, name):
+        ids, self._pending[name] = self._pending[name], set()
+
+        if not ids:
+            return
+
+        doc = self.indices[name]
+        index = self._index[name]
+        sources = self._sources[name]
+        found = set()
+
+        for row in doc.rows(ids=ids):
+            index.add(row.id, *[getattr(row, f) for f in doc.search_fields])
+            sources[row.id] = {f: getattr(row, f) for f in doc.display_fields}
+            found.add(row.id)
+
+        for doc_id in ids - found:
+            index.remove(doc_id)
+            sources.pop(doc_id, None)
+
+    def invalidate(self, keys):
+        """
+        Mark documents as changed, they are reloaded before the next
+        query.
+
+        :param keys: Iterable of (index name, document id)
+        :return: None
+        """
+        with self._lock:
+            for name, doc_id in keys:
+                if name in self._pending:
+                    self._pending[name].add(doc_id)
+
+    def query(self, name, term, size=10):
+        """
+        Search an index.
+
+        :param name: Index name
+        :param term: Query text
+        :param size: Number of hits to return
+        :return: tuple of (list of hits, number of matches), a hit being
+            the document's display fields and its id
+        """
+        with self._lock:
+            if name not in self._index or time.monotonic() >= \
+                    self._built[name] + self.refresh_interval:
+                self._build(name)
+            else:
+                self._apply_pending(name)
+
+            ids, total = self._index[name].search(term, size)
+            sources = self._sources[name]
+            return [dict(sources[id], id=id) for id in ids], total
@@ -6,7 +6,7 @@ from src.utils.perms import set_model_perms
 from src.tests.utils import add_user, add_group, add_post, add_comment
 from src.blueprints.auth.models import User
 from src.blueprints.posts.models import Post
-from src.blueprints.admin.models import Group
+from src.blueprints.admin.models import Group, grp_members, grp_perms
 
 
 @pytest.fixture(scope='session')
@@ -52,6 +52,8 @@ def db(app):
 
     set_model_perms(User)
     set_model_perms(Group)
+    set_model_perms(grp_members, is_table=True)
+    set_model_perms(grp_perms, is_table=True)
 
     add_user(name='admin', username='user', email='adminuser@test.com')
 
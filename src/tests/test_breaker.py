@@ -0,0 +1,51 @@
+import time
+
+import pytest
+
+from src.lib.breaker import CircuitBreaker, CircuitOpen
+
+
+def fail():
+    raise IOError('down')
+
+
+def test_breaker_opens_after_failures():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+
+    for _ in range(2):
+        with pytest.raises(IOError):
+            breaker.call(fail)
+
+    assert breaker.state == CircuitBreaker.OPEN
+
+    with pytest.raises(CircuitOpen):
+        breaker.call(lambda: 'ok')
+    assert breaker.rejected == 1
+
+
+def test_breaker_success_resets_failures():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+
+    with pytest.raises(IOError):
+        breaker.call(fail)
+
+    assert breaker.call(lambda: 'ok') == 'ok'
+    assert breaker.failures == 0
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_breaker_half_open_trial():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+
+    with pytest.raises(IOError):
+        breaker.call(fail)
+
+    time.sleep(0.02)
+    with pytest.raises(IOError):
+        breaker.call(fail)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.opened == 2
+
+    time.sleep(0.02)
+    assert breaker.call(lambda: 'ok') == 'ok'
+    assert breaker.state == CircuitBreaker.CLOSED
@@ -0,0 +1,186 @@
+import os
+import threading
+
+import pytest
+
+from src import create_app, db
+from src.config import TestingConfig
+from src.lib.broker import Broker, InProcessBroker, DatabaseBroker, \
+    NullBroker, Event, user_channel
+from src.blueprints.users.models import User
+
+
+def event(channel, type='message'):
+    return {'channel': channel, 'type': type, 'data': {}}
+
+
+def test_wait_returns_buffered_events_for_channels():
+    broker = InProcessBroker()
+    broker.deliver([event('user:1'), event('user:2'), event('user:1')])
+
+    events, cursor, missed = broker.wait(['user:1'], after=0, timeout=0)
+
+    assert [e['id'] for e in events] == [1, 3]
+    assert cursor == 3
+    assert missed is False
+
+
+def test_wait_without_cursor_only_gets_new_events():
+    broker = InProcessBroker()
+    broker.deliver([event('user:1')])
+
+    events, cursor, _ = broker.wait(['user:1'], timeout=0)
+
+    assert events == []
+    assert cursor == 1
+
+
+def test_wait_wakes_up_on_delivery():
+    broker = InProcessBroker()
+    timer = threading.Timer(0.05, broker.deliver, [[event('user:1')]])
+    timer.start()
+
+    events, _, _ = broker.wait(['user:1'], after=0, timeout=5)
+    timer.join()
+
+    assert [e['id'] for e in events] == [1]
+
+
+def test_wait_flags_events_dropped_from_buffer():
+    broker = InProcessBroker(buffer_size=2)
+    broker.deliver([event('user:1') for _ in range(4)])
+
+    events, _, missed = broker.wait(['user:1'], after=1, timeout=0)
+
+    assert [e['id'] for e in events] == [3, 4]
+    assert missed is True
+
+
+@pytest.fixture
+def broker_app(tmp_path):
+    class Config(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{tmp_path}/broker.db'
+        ELASTICSEARCH_URL = None
+        SECRET_KEY = 'secret'
+        EVENT_WAIT_TIMEOUT = 0
+
+    app = create_app(config=Config)
+    ctx = app.app_context()
+    ctx.push()
+    db.create_all()
+
+    yield app
+
+    db.session.remove()
+    ctx.pop()
+
+
+def database_broker(app, **kwargs):
+    broker = DatabaseBroker(app, **kwargs)
+    # polled by hand instead of from the poller thread
+    broker._pid = os.getpid()
+    return broker
+
+
+def insert_event(id, channel='user:1'):
+    db.session.add(Event(id=id, channel=channel, type='message', data={}))
+    db.session.commit()
+
+
+def test_rollback_drops_published_events(broker_app):
+    broker_app.broker.publish('user:1', 'message')
+    db.session.rollback()
+    broker_app.broker.publish('user:1', 'like')
+    db.session.commit()
+
+    events, _, _ = broker_app.broker.wait(['user:1'], after=0, timeout=0)
+
+    assert [e['type'] for e in events] == ['like']
+
+
+def test_null_broker_drops_published_events(broker_app):
+    broker = NullBroker()
+    broker.publish('user:1', 'message')
+    db.session.commit()
+
+    events, cursor, _ = broker.wait(['user:1'], after=0, timeout=0)
+
+    assert events == []
+    assert cursor == 0
+    assert Event.query.count() == 0
+
+
+def test_database_broker_delivers_committed_events(broker_app):
+    broker = database_broker(broker_app, gap_timeout=10)
+    broker.publish_many(['user:1', 'user:2'], 'post', {'postId': 1})
+    db.session.commit()
+
+    assert broker.poll() == 2
+
+    events, cursor, missed = broker.wait(['user:2'], after=0, timeout=0)
+
+    assert events == [{'id': 2, 'type': 'post', 'data': {'postId': 1}}]
+    assert cursor == 2
+    assert missed is False
+
+
+def test_database_broker_holds_events_after_uncommitted_id(broker_app):
+    broker = database_broker(broker_app, gap_timeout=10)
+    insert_event(1)
+    insert_event(3)
+    broker.poll()
+
+    assert broker.wait(['user:1'], after=0, timeout=0)[1] == 1
+
+    # the transaction that took id 2 commits after the one that took 3
+    insert_event(2)
+    broker.poll()
+    events, cursor, _ = broker.wait(['user:1'], after=1, timeout=0)
+
+    assert [e['id'] for e in events] == [2, 3]
+    assert cursor == 3
+
+
+def test_database_broker_skips_rolled_back_id(broker_app):
+    broker = database_broker(broker_app, gap_timeout=0)
+    insert_event(1)
+    insert_event(3)
+    broker.poll()
+
+    events, cursor, _ = broker.wait(['user:1'], after=0, timeout=0)
+
+    assert [e['id'] for e in events] == [1, 3]
+    assert cursor == 3
+
+
+def test_events_endpoint_returns_events_after_cursor(broker_app):
+    client = broker_app.test_client()
+    response = client.post('/api/users/register', json={
+        'name': 'events', 'username': 'events',
+        'email': 'events@test.com', 'password': 'password'})
+    token = response.get_json()['token']
+    user_id = User.query.filter_by(email='events@test.com').first().id
+    broker_app.broker.publish(user_channel(user_id), 'message', {'id': 1})
+    broker_app.broker.publish(user_channel(user_id + 1), 'message')
+    db.session.commit()
+
+    response = client.get(
+        '/api/events?cursor=0',
+        headers={'Authorization': f'Bearer {token}'})
+    data = response.get_json()
+
+    assert response.status_code == 200
+    assert data['data'] == [{'id': 1, 'type': 'message', 'data': {'id': 1}}]
+    assert data['cursor'] == 2
+    assert data['missed'] is False
+
+
+def test_events_endpoint_requires_token(broker_app):
+    response = broker_app.test_client().get('/api/events')
+
+    assert response.status_code == 403
+
+
+def test_broker_requires_publish_many():
+    with pytest.raises(TypeError):
+        Broker()
@@ -0,0 +1,38 @@
+import time
+
+from src.lib.cache import TTLCache
+
+
+def test_cache_hit_and_miss():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set(1, 'one')
+    assert cache.get(1) == 'one'
+    assert cache.get(2) is None
+    assert cache.hits == 1
+    assert cache.misses == 1
+
+
+def test_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set(1, 'one')
+    cache.set(2, 'two')
+    cache.get(1)
+    cache.set(3, 'three')
+    assert cache.get(2) is None
+    assert cache.get(1) == 'one'
+    assert cache.stats()['evictions'] == 1
+
+
+def test_cache_expires_entries():
+    cache = TTLCache(maxsize=2, ttl=0.01)
+    cache.set(1, 'one')
+    time.sleep(0.02)
+    assert cache.get(1) is None
+    assert len(cache) == 0
+
+
+def test_cache_invalidate():
+    cache = TTLCache()
+    cache.set(1, 'one')
+    cache.invalidate(1)
+    assert cache.get(1) is None
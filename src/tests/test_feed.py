@@ -0,0 +1,105 @@
+import pytest
+from sqlalchemy import event
+
+from src import create_app, db
+from src.config import TestingConfig
+from src.blueprints.posts.models import Post
+from src.blueprints.users.models import User
+
+
+@pytest.fixture
+def feed_app(tmp_path):
+    class Config(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{tmp_path}/feed.db'
+        ELASTICSEARCH_URL = None
+        SECRET_KEY = 'secret'
+
+    app = create_app(config=Config)
+    ctx = app.app_context()
+    ctx.push()
+    db.create_all()
+
+    yield app
+
+    db.session.remove()
+    ctx.pop()
+
+
+def register(client, username):
+    response = client.post('/api/users/register', json={
+        'name': username, 'username': username,
+        'email': f'{username}@test.com', 'password': 'password'})
+    user_id = User.query.filter_by(email=f'{username}@test.com').first().id
+    return user_id, {'Authorization': f'Bearer {response.get_json()["token"]}'}
+
+
+def count_queries(client, url, headers):
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', count)
+    try:
+        response = client.get(url, headers=headers)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count)
+
+    assert response.status_code == 200
+    return len(statements), response.get_json()
+
+
+@pytest.fixture
+def feed(feed_app):
+    '''Posts by several authors with likes, comments, tags and follows.'''
+    client = feed_app.test_client()
+    reader_id, reader = register(client, 'reader')
+    authors = [register(client, name) for name in ('anna', 'bert', 'cleo')]
+    tag_ids = [client.post('/api/tags', json={'name': name},
+                           headers=reader).get_json()['id']
+               for name in ('python', 'flask')]
+
+    client.post(f'/api/users/{authors[0][0]}/follow', headers=reader)
+    client.post(f'/api/users/{authors[1][0]}/follow', headers=reader)
+
+    for i in range(8):
+        author_id, author = authors[i % len(authors)]
+        post_id = client.post('/api/posts', json={
+            'post': f'post {i}', 'tags': tag_ids[:i % 3]},
+            headers=author).get_json()['id']
+
+        if i % 2:
+            client.post(f'/api/posts/{post_id}/likes', headers=reader)
+        if i % 3:
+            client.post(f'/api/posts/{post_id}/comments',
+                        json={'post': 'comment'}, headers=reader)
+
+    return client, reader_id, reader
+
+
+def test_to_dicts_matches_to_dict(feed):
+    _, reader_id, _ = feed
+    reader = User.query.get(reader_id)
+    posts = Post.query.order_by(Post.id).all()
+
+    assert Post.to_dicts(posts, reader) == [
+        post.to_dict(reader) for post in posts]
+
+
+def test_feed_page_takes_constant_queries(feed):
+    client, _, reader = feed
+    # warm the identity and permission caches
+    client.get('/api/posts/explore?feed=latest&limit=1', headers=reader)
+
+    small, data = count_queries(
+        client, '/api/posts/explore?feed=latest&limit=2', headers=reader)
+    assert len(data['data']) == 2
+
+    large, data = count_queries(
+        client, '/api/posts/explore?feed=latest&limit=8', headers=reader)
+    assert len(data['data']) == 8
+    assert any(post['tags'] for post in data['data'])
+    assert any(post['isLiked'] for post in data['data'])
+    assert any(post['author']['isFollowing'] for post in data['data'])
+
+    assert small == large
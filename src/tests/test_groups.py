@@ -1,38 +1,58 @@
 import json
 
+import pytest
+
 from src import create_app
 from src.config import TestingConfig
-from src.blueprints.auth.models import User
+from src.blueprints.users.models import User
 from src.blueprints.admin.models import Group, Permission
 
 app = create_app(config=TestingConfig)
 
 
-def test_get_group(client, groups):
+def auth_headers(user):
+    return {'Authorization': f'Bearer {user.encode_auth_token()}'}
+
+
+@pytest.fixture(scope='function')
+def headers(users):
+    """
+    Authorize as a regular user holding every group permission.
+
+    :return: dict of request headers
+    """
+    user = User.find_by_identity('regularuser@test.com')
+    user.add_permissions(Permission.query.filter(
+        Permission.code_name.like('%group%')).all())
+    return auth_headers(user)
+
+
+def test_get_group(client, groups, headers):
     group = Group.find_by_name('test group 1')
-    response = client.get(f'/api/admin/groups/{group.id}',)
+    response = client.get(
+        f'/api/admin/groups/{group.id}', headers=headers)
     data = json.loads(response.data.decode())
     assert response.status_code == 200
     assert data.get('name') == 'test group 1'
 
 
-def test_get_group_invalid_id(client, groups):
-    response = client.get('/api/admin/groups/66853')
+def test_get_group_invalid_id(client, groups, headers):
+    response = client.get('/api/admin/groups/66853', headers=headers)
     data = json.loads(response.data.decode())
     assert response.status_code == 404
     assert 'Group not found' in data.get('message')
     assert 'Not Found' in data.get('error')
 
 
-def test_get_all_groups(client, groups):
-    response = client.get('/api/admin/groups')
+def test_get_all_groups(client, groups, headers):
+    response = client.get('/api/admin/groups', headers=headers)
     data = json.loads(response.data.decode())
     assert response.status_code == 200
     assert len(data.get('items')) == app.config['ITEMS_PER_PAGE']
 
 
-def test_all_groups_with_pagination_first_page(client, groups):
-    response = client.get('/api/admin/groups/page/1')
+def test_all_groups_with_pagination_first_page(client, groups, headers):
+    response = client.get('/api/admin/groups/page/1', headers=headers)
     data = json.loads(response.data.decode())
     assert response.status_code == 200
     assert len(data.get('items')) <= app.config['ITEMS_PER_PAGE']
@@ -40,8 +60,8 @@ def test_all_groups_with_pagination_first_page(client, groups):
     assert data.get('prev_url') is None
 
 
-def test_all_groups_with_pagination_last_page(client, groups):
-    response = client.get('/api/admin/groups/page/2')
+def test_all_groups_with_pagination_last_page(client, groups, headers):
+    response = client.get('/api/admin/groups/page/2', headers=headers)
     data = json.loads(response.data.decode())
     assert response.status_code == 200
     assert len(data.get('items')) <= app.config['ITEMS_PER_PAGE']
@@ -49,53 +69,57 @@ def test_all_groups_with_pagination_last_page(client, groups):
     assert data.get('next_url') is None
 
 
-def test_add_group_no_data(client):
+def test_add_group_no_data(client, headers):
     response = client.post(
         '/api/admin/groups',
         data=json.dumps({}),
-        content_type='application/json'
+        content_type='application/json',
+        headers=headers
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 400
     assert 'No input data provided' in data.get('message')
 
 
-def test_add_group_invalid_data(client):
+def test_add_group_invalid_data(client, headers):
     response = client.post(
         '/api/admin/groups',
         data=json.dumps({
             'name': 'co/d^mmon',
             'description': 'just a common group',
         }),
-        content_type='application/json'
+        content_type='application/json',
+        headers=headers
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 422
     assert data.get('message') is not None
 
 
-def test_add_group_duplicate_name(client, groups):
+def test_add_group_duplicate_name(client, groups, headers):
     response = client.post(
         '/api/admin/groups',
         data=json.dumps({
             'name': 'test group 1',
             'description': 'Another common group',
         }),
-        content_type='application/json'
+        content_type='application/json',
+        headers=headers
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 400
     assert 'Group already exist.' in data.get('message')
 
 
-def test_add_group_valid(client, groups):
+def test_add_group_valid(client, groups, headers):
     response = client.post(
         '/api/admin/groups',
         data=json.dumps({
             'name': 'test group 4',
             'description': 'just a test group',
         }),
-        content_type='application/json'
+        content_type='application/json',
+        headers=headers
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 201
@@ -104,7 +128,7 @@ def test_add_group_valid(client, groups):
     assert data.get('name') == 'test group 4'
 
 
-def test_update_group_duplicate_name(client, groups):
+def test_update_group_duplicate_name(client, groups, headers):
     group = Group.find_by_name('test group 2')
     response = client.put(
         f'/api/admin/groups/{group.id}',
@@ -112,38 +136,41 @@ def test_update_group_duplicate_name(client, groups):
             'name': 'test group 1',
             'description': 'just a common group',
         }),
-        content_type='application/json'
+        content_type='application/json',
+        headers=headers
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 400
     assert 'Group already exists.' in data.get('message')
 
 
-def test_update_group_no_data(client, groups):
+def test_update_group_no_data(client, groups, headers):
     group = Group.find_by_name('test group 2')
     response = client.put(
         f'/api/admin/groups/{group.id}',
         data=json.dumps({}),
-        content_type='application/json'
+        content_type='application/json',
+        headers=headers
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 400
     assert 'No input data provided' in data.get('message')
 
 
-def test_update_group_invalid_data(client, groups):
+def test_update_group_invalid_data(client, groups, headers):
     group = Group.find_by_name('test group 2')
     response = client.put(
         f'/api/admin/groups/{group.id}',
         data=json.dumps({'name': 'tr*st1'}),
-        content_type='application/json'
+        content_type='application/json',
+        headers=headers
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 422
     assert data.get('message') is not None
 
 
-def test_update_group(client, groups):
+def test_update_group(client, groups, headers):
     group = Group.find_by_name('test group 2')
     response = client.put(
         f'/api/admin/groups/{group.id}',
@@ -151,7 +178,8 @@ def test_update_group(client, groups):
             'description': 'test group',
             'name': 'test group',
         }),
-        content_type='application/json'
+        content_type='application/json',
+        headers=headers
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 200
@@ -159,22 +187,23 @@ def test_update_group(client, groups):
     assert data.get('name') == 'test group'
 
 
-def test_delete_group(client, groups):
+def test_delete_group(client, groups, headers):
     group = Group.find_by_name('test group 2')
-    response = client.delete(f'/api/admin/groups/{group.id}')
+    response = client.delete(
+        f'/api/admin/groups/{group.id}', headers=headers)
     data = json.loads(response.data.decode())
     assert response.status_code == 200
     assert 'deleted group' in data.get('message')
 
 
-def test_delete_group_invalid_id(client, groups):
-    response = client.delete('/api/admin/groups/333')
+def test_delete_group_invalid_id(client, groups, headers):
+    response = client.delete('/api/admin/groups/333', headers=headers)
     data = json.loads(response.data.decode())
     assert response.status_code == 404
     assert 'Group does not exist.' in data.get('message')
 
 
-def test_add_group_members(client, users, groups):
+def test_add_group_members(client, users, groups, headers):
     user1 = User.find_by_identity('adminuser@test.com')
     user2 = User.find_by_identity('regularuser@test.com')
     group = Group.find_by_name('test group 1')
@@ -182,7 +211,8 @@ def test_add_group_members(client, users, groups):
     response = client.put(
         f'/api/admin/groups/{group.id}/members',
         content_type='application/json',
-        data=json.dumps({'users': [user1.id, user2.id]})
+        data=json.dumps({'users': [user1.id, user2.id]}),
+        headers=headers
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 200
@@ -191,7 +221,7 @@ def test_add_group_members(client, users, groups):
     assert data.get('members')[1]['username'] == 'regularuser'
 
 
-def test_remove_group_members(client, users, groups):
+def test_remove_group_members(client, users, groups, headers):
     user1 = User.find_by_identity('adminuser@test.com')
     user2 = User.find_by_identity('regularuser@test.com')
     group = Group.find_by_name('test group 3')
@@ -201,14 +231,15 @@ def test_remove_group_members(client, users, groups):
     response = client.delete(
         f'/api/admin/groups/{group.id}/members',
         content_type='application/json',
-        data=json.dumps({'users': [user1.id, user2.id]})
+        data=json.dumps({'users': [user1.id, user2.id]}),
+        headers=headers
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 200
     assert len(data.get('members')) == 0
 
 
-def test_add_group_perms(client, groups):
+def test_add_group_perms(client, groups, headers):
     name1 = Permission.set_code_name('can view groups')
     name2 = Permission.set_code_name('can delete users')
     perm1 = Permission.find_by_name(name1)
@@ -218,7 +249,8 @@ def test_add_group_perms(client, groups):
     response = client.put(
         f'/api/admin/groups/{group.id}/permissions',
         content_type='application/json',
-        data=json.dumps({'perms': [perm1.id, perm2.id]})
+        data=json.dumps({'perms': [perm1.id, perm2.id]}),
+        headers=headers
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 200
@@ -227,7 +259,7 @@ def test_add_group_perms(client, groups):
     assert data.get('permissions')[0]['name'] == 'can delete users'
 
 
-def test_remove_group_perms(client, groups):
+def test_remove_group_perms(client, groups, headers):
     name1 = Permission.set_code_name('can view groups')
     name2 = Permission.set_code_name('can delete users')
     perm1 = Permission.find_by_name(name1)
@@ -239,8 +271,37 @@ def test_remove_group_perms(client, groups):
     response = client.delete(
         f'/api/admin/groups/{group.id}/permissions',
         content_type='application/json',
-        data=json.dumps({'perms': [perm1.id, perm2.id]})
+        data=json.dumps({'perms': [perm1.id, perm2.id]}),
+        headers=headers
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 200
     assert len(data.get('permissions')) == 0
+
+
+def test_get_all_groups_no_token(client, groups):
+    response = client.get('/api/admin/groups')
+    data = json.loads(response.data.decode())
+    assert response.status_code == 403
+    assert 'No authorization.' in data.get('message')
+
+
+def test_get_all_groups_invalid_token(client, groups):
+    response = client.get(
+        '/api/admin/groups', headers={'Authorization': 'Bearer invalid'})
+    data = json.loads(response.data.decode())
+    assert response.status_code == 401
+    assert 'Invalid token' in data.get('message')
+
+
+def test_add_group_no_permission(client, users):
+    user = User.find_by_identity('commonuser@test.com')
+    response = client.post(
+        '/api/admin/groups',
+        data=json.dumps({'name': 'test group 5'}),
+        content_type='application/json',
+        headers=auth_headers(user)
+    )
+    data = json.loads(response.data.decode())
+    assert response.status_code == 403
+    assert 'Permission denied.' in data.get('message')
@@ -0,0 +1,18 @@
+from werkzeug.security import generate_password_hash
+
+from src.lib.hashing import PasswordHasher
+
+
+def test_hash_and_verify_inline():
+    hasher = PasswordHasher('pbkdf2:sha256:1000', workers=0)
+    pwhash = hasher.hash('password')
+    assert hasher.verify(pwhash, 'password') is True
+    assert hasher.verify(pwhash, 'secret') is False
+    assert hasher.verify(None, 'password') is False
+
+
+def test_needs_rehash():
+    hasher = PasswordHasher('pbkdf2:sha256:1000', workers=0)
+    assert hasher.needs_rehash(hasher.hash('password')) is False
+    assert hasher.needs_rehash(
+        generate_password_hash('password', 'pbkdf2:sha256:500')) is True
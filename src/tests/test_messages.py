@@ -0,0 +1,131 @@
+import pytest
+from sqlalchemy import event
+
+from src import create_app, db
+from src.config import TestingConfig
+from src.blueprints.users.models import User
+
+
+@pytest.fixture
+def messages_app(tmp_path):
+    class Config(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{tmp_path}/messages.db'
+        ELASTICSEARCH_URL = None
+        SECRET_KEY = 'secret'
+
+    app = create_app(config=Config)
+    ctx = app.app_context()
+    ctx.push()
+
+    # enforce foreign keys as the production database does
+    @event.listens_for(db.engine, 'connect')
+    def enable_foreign_keys(connection, record):
+        connection.execute('PRAGMA foreign_keys=ON')
+
+    db.engine.dispose()
+    db.create_all()
+
+    yield app
+
+    db.session.remove()
+    ctx.pop()
+
+
+def register(client, username):
+    response = client.post('/api/users/register', json={
+        'name': username, 'username': username,
+        'email': f'{username}@test.com', 'password': 'password'})
+    user_id = User.query.filter_by(email=f'{username}@test.com').first().id
+    return user_id, {'Authorization': f'Bearer {response.get_json()["token"]}'}
+
+
+def send(client, headers, user_id, body):
+    response = client.post(
+        f'/api/messages?user={user_id}', json={'body': body},
+        headers=headers)
+    assert response.status_code == 201
+    return response.get_json()['id']
+
+
+def test_delete_latest_message_repoints_chat(messages_app):
+    client = messages_app.test_client()
+    alice_id, alice = register(client, 'alice')
+    bob_id, bob = register(client, 'bobby')
+    send(client, alice, bob_id, 'first')
+    last_id = send(client, alice, bob_id, 'second')
+
+    response = client.delete(f'/api/messages/{last_id}', headers=alice)
+    assert response.status_code == 200
+
+    data = client.get('/api/chats', headers=bob).get_json()
+    assert len(data['data']) == 1
+    assert data['data'][0]['body'] == '"first"'
+
+
+def test_chats_are_paged_by_latest_activity(messages_app):
+    client = messages_app.test_client()
+    alice_id, alice = register(client, 'alice')
+    others = [register(client, name) for name in ('bobby', 'carol', 'dave')]
+    # alice starts the first chat, the others start theirs with her
+    send(client, alice, others[0][0], 'to bobby')
+    send(client, others[1][1], alice_id, 'from carol')
+    send(client, others[2][1], alice_id, 'from dave')
+    send(client, alice, others[0][0], 'to bobby again')
+
+    data = client.get('/api/chats?limit=2', headers=alice).get_json()
+    bodies = [chat['body'] for chat in data['data']]
+    data = client.get(
+        f'/api/chats?limit=2&cursor={data["nextCursor"]}',
+        headers=alice).get_json()
+    bodies += [chat['body'] for chat in data['data']]
+
+    assert bodies == ['"to bobby again"', '"from dave"', '"from carol"']
+    assert data['nextCursor'] is None
+
+
+def notifications_count(client, headers, etag=None):
+    if etag:
+        headers = dict(headers, **{'If-None-Match': etag})
+    response = client.get('/api/notifications/count', headers=headers)
+    data = response.get_json() if response.status_code == 200 else None
+    return response.status_code, data, response.headers['ETag']
+
+
+def test_notifications_count_etag(messages_app):
+    client = messages_app.test_client()
+    _, alice = register(client, 'alice')
+    likers = [register(client, name)[1] for name in ('bobby', 'carol')]
+    post_id = client.post(
+        '/api/posts', json={'post': 'hello'}, headers=alice).get_json()['id']
+
+    client.post(f'/api/posts/{post_id}/likes', headers=likers[0])
+    status, data, etag = notifications_count(client, alice)
+    assert (status, data) == (200, {'count': 1})
+    assert notifications_count(client, alice, etag) == (304, None, etag)
+
+    # a new actor joins the unread group: new version, same count
+    client.post(f'/api/posts/{post_id}/likes', headers=likers[1])
+    status, data, new_etag = notifications_count(client, alice, etag)
+    assert (status, data) == (200, {'count': 1})
+    assert new_etag != etag
+
+
+def test_notifications_count_after_read(messages_app):
+    client = messages_app.test_client()
+    _, alice = register(client, 'alice')
+    likers = [register(client, name)[1] for name in ('bobby', 'carol')]
+    post_id = client.post(
+        '/api/posts', json={'post': 'hello'}, headers=alice).get_json()['id']
+    client.post(f'/api/posts/{post_id}/likes', headers=likers[0])
+
+    assert client.get('/api/notifications', headers=alice).status_code == 200
+    status, data, etag = notifications_count(client, alice)
+    assert (status, data) == (200, {'count': 0})
+
+    # reading again changes nothing, so the ETag still matches
+    client.get('/api/notifications', headers=alice)
+    assert notifications_count(client, alice, etag)[0] == 304
+
+    # a read group becomes unread again with its next actor
+    client.post(f'/api/posts/{post_id}/likes', headers=likers[1])
+    assert notifications_count(client, alice)[:2] == (200, {'count': 1})
@@ -135,3 +135,24 @@ def test_group_perms(groups):
     grp.remove_permissions([perm2])
     assert grp.has_perm(perm2) is False
     assert grp.permissions.count() == 1
+
+
+def test_user_perm_bits(users, groups):
+    name1 = Permission.set_code_name('can add users')
+    name2 = Permission.set_code_name('can edit groups')
+    perm1 = Permission.find_by_name(name1)
+    perm2 = Permission.find_by_name(name2)
+    user = User.find_by_identity('adminuser@test.com')
+    grp = Group.find_by_name('test group 1')
+
+    grp.add_permissions([perm2])
+    grp.add_members([user])
+    user.add_permissions([perm1])
+    assert user.has_permissions([perm1.code_name, perm2.code_name]) is True
+
+    grp.remove_members([user])
+    assert user.has_permission(perm2.code_name) is False
+    assert user.has_permission(perm1.code_name) is True
+
+    user.remove_permissions([perm1])
+    assert user.perm_mask == 0
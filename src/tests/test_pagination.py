@@ -0,0 +1,53 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import Column, DateTime, Float, Integer, MetaData, Table
+
+from src.lib.pagination import InvalidCursor, encode_cursor, \
+    decode_cursor, seek_after
+
+
+posts = Table('posts', MetaData(), Column('id', Integer, primary_key=True),
+              Column('created_on', DateTime), Column('score', Float))
+
+
+def test_cursor_round_trip():
+    values = [datetime(2021, 1, 1, 5, 30, 0, 123), 1.5, 'abc', 42]
+    cursor = encode_cursor(values)
+    assert '=' not in cursor
+    assert decode_cursor(cursor) == values
+
+
+def test_cursor_keeps_types():
+    ts, score, post_id = decode_cursor(
+        encode_cursor([datetime(2021, 1, 1), 2.0, 7]))
+    assert isinstance(ts, datetime)
+    assert isinstance(score, float)
+    assert isinstance(post_id, int)
+
+
+# the last one is the JSON object {"a":1}
+@pytest.mark.parametrize(
+    'cursor', ['garbage', encode_cursor([]), 'W3t9XQ', 'eyJhIjoxfQ'])
+def test_invalid_cursor(cursor):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor)
+
+
+def test_seek_after_uses_row_comparison():
+    clause = seek_after(
+        (posts.c.created_on.desc(), posts.c.id.desc()),
+        [datetime(2021, 1, 1), 3])
+    assert str(clause) == \
+        '(posts.created_on, posts.id) < (:param_1, :param_2)'
+
+
+def test_seek_after_mixed_directions():
+    clause = seek_after((posts.c.score.desc(), posts.c.id), [1.5, 3])
+    assert str(clause) == ('posts.score < :param_1 OR '
+                           'posts.score = :param_1 AND posts.id > :param_2')
+
+
+def test_seek_after_checks_cursor_length():
+    with pytest.raises(InvalidCursor):
+        seek_after((posts.c.id.desc(),), [1, 2])
@@ -0,0 +1,18 @@
+from src.lib.revocation import BloomFilter
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(size=1 << 12, hashes=5)
+    keys = [f'jti-{i}' for i in range(100)]
+
+    for key in keys:
+        bloom.add(key)
+
+    assert all(key in bloom for key in keys)
+
+
+def test_bloom_filter_misses_unknown_keys():
+    bloom = BloomFilter(size=1 << 16, hashes=5)
+    bloom.add('revoked')
+    assert 'revoked' in bloom
+    assert sum(f'other-{i}' in bloom for i in range(1000)) < 10
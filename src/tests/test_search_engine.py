@@ -0,0 +1,48 @@
+from src.lib.search_engine import PrefixIndex, tokenize
+
+
+def test_tokenize():
+    assert tokenize('Ada Lovelace_1, ada!') == ['ada', 'lovelace_1', 'ada']
+    assert tokenize(None) == []
+
+
+def test_prefix_search():
+    index = PrefixIndex()
+    index.add(1, 'Ada Lovelace', 'ada')
+    index.add(2, 'Adam Smith', 'adams')
+    index.add(3, 'Grace Hopper', 'grace')
+
+    assert index.search('ad') == ([1, 2], 2)
+    assert index.search('ada') == ([1, 2], 2)
+    assert index.search('grace ho') == ([3], 1)
+    assert index.search('zed') == ([], 0)
+
+
+def test_whole_words_rank_first():
+    index = PrefixIndex()
+    index.add(1, 'Adams')
+    index.add(2, 'Adam')
+
+    assert index.search('adam')[0] == [2, 1]
+
+
+def test_update_and_remove():
+    index = PrefixIndex()
+    index.add(1, 'python')
+    index.add(1, 'rust')
+
+    assert index.search('py') == ([], 0)
+    assert index.search('ru') == ([1], 1)
+
+    index.remove(1)
+    assert index.search('ru') == ([], 0)
+    assert len(index) == 0
+
+
+def test_search_size():
+    index = PrefixIndex(max_prefix=3)
+    for i in range(5):
+        index.add(i, f'tag{i}')
+
+    assert index.search('tag', size=2) == ([0, 1], 5)
+    assert index.search('tag3') == ([3], 1)
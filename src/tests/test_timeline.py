@@ -0,0 +1,76 @@
+import pytest
+
+from src import create_app, db
+from src.config import TestingConfig
+from src.lib import jobs
+from src.blueprints.users.models import User, TimelineEntry
+
+
+@pytest.fixture
+def timeline_app(tmp_path):
+    class Config(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{tmp_path}/timeline.db'
+        ELASTICSEARCH_URL = None
+        SECRET_KEY = 'secret'
+        # authors with more than one follower are fanned out on read
+        TIMELINE_FANOUT_LIMIT = 1
+
+    app = create_app(config=Config)
+    ctx = app.app_context()
+    ctx.push()
+    db.create_all()
+
+    yield app
+
+    db.session.remove()
+    ctx.pop()
+
+
+def register(client, username):
+    response = client.post('/api/users/register', json={
+        'name': username, 'username': username,
+        'email': f'{username}@test.com', 'password': 'password'})
+    user_id = User.query.filter_by(email=f'{username}@test.com').first().id
+    return user_id, {'Authorization': f'Bearer {response.get_json()["token"]}'}
+
+
+def run_jobs():
+    while jobs.run_next('test') is not None:
+        pass
+
+
+def latest(client, headers):
+    response = client.get('/api/posts?latest=1', headers=headers)
+    assert response.status_code == 200
+    return [post['id'] for post in response.get_json()['data']]
+
+
+def test_latest_feed_merges_fanned_out_and_popular_posts(timeline_app):
+    client = timeline_app.test_client()
+    popular_id, popular = register(client, 'popular')
+    author_id, author = register(client, 'author')
+    _, reader = register(client, 'reader')
+    _, other = register(client, 'other')
+
+    client.post(f'/api/users/{author_id}/follow', headers=reader)
+    client.post(f'/api/users/{popular_id}/follow', headers=reader)
+    client.post(f'/api/users/{popular_id}/follow', headers=other)
+    run_jobs()
+
+    response = client.post('/api/posts', json={'post': 'a'}, headers=author)
+    author_post = response.get_json()['id']
+    response = client.post('/api/posts', json={'post': 'p'}, headers=popular)
+    popular_post = response.get_json()['id']
+
+    # authors see their post before the fan-out job runs
+    assert latest(client, author) == [author_post]
+    assert latest(client, reader) == []
+
+    run_jobs()
+
+    assert latest(client, reader) == [popular_post, author_post]
+    assert User.query.get(popular_id).fanout_on_read is True
+    # only the popular author's own timeline holds their post
+    assert [entry.user_id for entry in TimelineEntry.query.filter_by(
+        post_id=popular_post)] == [popular_id]
+    assert TimelineEntry.query.filter_by(post_id=author_post).count() == 2
@@ -1,39 +1,57 @@
 import json
 
-from src import create_app
+import pytest
+from sqlalchemy import event
+
+from src import create_app, db
 from src.config import TestingConfig
-from src.blueprints.auth.models import User
+from src.blueprints.users.models import User
 from src.blueprints.admin.models import Permission
 
 app = create_app(config=TestingConfig)
 
 
-def test_get_user(client, users):
+def auth_headers(user):
+    return {'Authorization': f'Bearer {user.encode_auth_token()}'}
+
+
+@pytest.fixture(scope='function')
+def headers(users):
+    """
+    Authorize as the admin user, who holds every permission.
+
+    :return: dict of request headers
+    """
+    return auth_headers(User.find_by_identity('adminuser@test.com'))
+
+
+def test_get_user(client, users, headers):
     user = User.find_by_identity('adminuser@test.com')
-    response = client.get(f'/api/admin/users/{user.id}',)
+    response = client.get(
+        f'/api/admin/users/{user.id}', headers=headers)
     data = json.loads(response.data.decode())
     assert response.status_code == 200
     assert data.get('username') == 'adminuser'
     assert data.get('profile')['name'] == 'admin'
 
 
-def test_get_user_invalid_id(client, users):
-    response = client.get('/api/admin/users/66853')
+def test_get_user_invalid_id(client, users, headers):
+    response = client.get('/api/admin/users/66853', headers=headers)
     data = json.loads(response.data.decode())
     assert response.status_code == 404
     assert 'User not found' in data.get('message')
     assert 'Not Found' in data.get('error')
 
 
-def test_get_all_users(client, users):
-    response = client.get('/api/admin/users')
+def test_get_all_users(client, users, headers):
+    response = client.get('/api/admin/users', headers=headers)
     data = json.loads(response.data.decode())
     assert response.status_code == 200
     assert len(data.get('items')) == app.config['ITEMS_PER_PAGE']
 
 
-def test_all_users_with_pagination_first_page(client, users):
-    response = client.get('/api/admin/users/page/1')
+def test_all_users_with_pagination_first_page(client, users, headers):
+    response = client.get('/api/admin/users/page/1', headers=headers)
     data = json.loads(response.data.decode())
     assert response.status_code == 200
     assert len(data.get('items')) <= app.config['ITEMS_PER_PAGE']
@@ -41,8 +59,8 @@ def test_all_users_with_pagination_first_page(client, users):
     assert data.get('prev_url') is None
 
 
-def test_all_users_with_pagination_last_page(client, users):
-    response = client.get('/api/admin/users/page/2')
+def test_all_users_with_pagination_last_page(client, users, headers):
+    response = client.get('/api/admin/users/page/2', headers=headers)
     data = json.loads(response.data.decode())
     assert response.status_code == 200
     assert len(data.get('items')) <= app.config['ITEMS_PER_PAGE']
@@ -50,18 +68,19 @@ def test_all_users_with_pagination_last_page(client, users):
     assert data.get('next_url') is None
 
 
-def test_add_user_no_data(client):
+def test_add_user_no_data(client, headers):
     response = client.post(
         '/api/admin/users',
         data=json.dumps({}),
-        content_type='application/json'
+        content_type='application/json',
+        headers=headers
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 400
     assert 'No input data provided' in data.get('message')
 
 
-def test_add_user_invalid_data(client):
+def test_add_user_invalid_data(client, headers):
     response = client.post(
         '/api/admin/users',
         data=json.dumps({
@@ -70,14 +89,15 @@ def test_add_user_invalid_data(client):
             'email': 'commonuser.host',
             'password': 'password',
         }),
-        content_type='application/json'
+        content_type='application/json',
+        headers=headers
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 422
     assert data.get('message') is not None
 
 
-def test_add_user_duplicate_email(client):
+def test_add_user_duplicate_email(client, headers):
     response = client.post(
         '/api/admin/users',
         data=json.dumps({
@@ -86,14 +106,15 @@ def test_add_user_duplicate_email(client):
             'email': 'adminuser@test.com',
             'password': 'password',
         }),
-        content_type='application/json'
+        content_type='application/json',
+        headers=headers
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 400
     assert 'user already exists.' in data.get('message')
 
 
-def test_add_user_duplicate_username(client):
+def test_add_user_duplicate_username(client, headers):
     response = client.post(
         '/api/admin/users',
         data=json.dumps({
@@ -102,14 +123,15 @@ def test_add_user_duplicate_username(client):
             'email': 'user@test.host',
             'password': 'password',
         }),
-        content_type='application/json'
+        content_type='application/json',
+        headers=headers
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 400
     assert 'user already exists.' in data.get('message')
 
 
-def test_add_user_valid(client):
+def test_add_user_valid(client, headers):
     response = client.post(
         '/api/admin/users',
         data=json.dumps({
@@ -118,7 +140,8 @@ def test_add_user_valid(client):
             'email': 'testuser@test.host',
             'password': 'password',
         }),
-        content_type='application/json'
+        content_type='application/json',
+        headers=headers
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 201
@@ -127,7 +150,7 @@ def test_add_user_valid(client):
     assert data.get('username') == 'test'
 
 
-def test_update_user_duplicate_username(client, users):
+def test_update_user_duplicate_username(client, users, headers):
     user = User.find_by_identity('regularuser@test.com')
     response = client.put(
         f'/api/admin/users/{user.id}',
@@ -140,26 +163,28 @@ def test_update_user_duplicate_username(client, users):
             'name': 'test',
             'bio': 'Another user.'
         }),
-        content_type='application/json'
+        content_type='application/json',
+        headers=headers
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 400
     assert 'Username already exists.' in data.get('message')
 
 
-def test_update_user_no_data(client, users):
+def test_update_user_no_data(client, users, headers):
     user = User.find_by_identity('adminuser@test.com')
     response = client.put(
         f'/api/admin/users/{user.id}',
         data=json.dumps({}),
-        content_type='application/json'
+        content_type='application/json',
+        headers=headers
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 400
     assert 'No input data provided' in data.get('message')
 
 
-def test_update_user_invalid_data(client, users):
+def test_update_user_invalid_data(client, users, headers):
     response = client.put(
         '/api/admin/users/2',
         data=json.dumps({
@@ -168,14 +193,15 @@ def test_update_user_invalid_data(client, users):
             'bio': 'test user',
             'email': 'user1@test.host',
         }),
-        content_type='application/json'
+        content_type='application/json',
+        headers=headers
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 422
     assert data.get('message') is not None
 
 
-def test_update_user(client, users):
+def test_update_user(client, users, headers):
     user = User.find_by_identity('commonuser@test.com')
     response = client.put(
         f'/api/admin/users/{user.id}',
@@ -188,7 +214,8 @@ def test_update_user(client, users):
                 'is_admin': True,
             }
         }),
-        content_type='application/json'
+        content_type='application/json',
+        headers=headers
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 200
@@ -196,25 +223,23 @@ def test_update_user(client, users):
     assert data.get('username') == 'testuser'
 
 
-def test_delete_user(client, users):
+def test_delete_user(client, users, headers):
     user = User.find_by_identity('commonuser@test.com')
     response = client.delete(
-        f'/api/admin/users/{user.id}',)
+        f'/api/admin/users/{user.id}', headers=headers)
     data = json.loads(response.data.decode())
     assert response.status_code == 200
     assert 'deleted user' in data.get('message')
 
 
-def test_delete_user_invalid_id(client, users):
-    response = client.delete(
-        '/api/admin/users/333',
-    )
+def test_delete_user_invalid_id(client, users, headers):
+    response = client.delete('/api/admin/users/333', headers=headers)
     data = json.loads(response.data.decode())
     assert response.status_code == 404
     assert 'User does not exist.' in data.get('message')
 
 
-def test_add_user_perms(client, users):
+def test_add_user_perms(client, users, headers):
     name1 = Permission.set_code_name('can view groups')
     name2 = Permission.set_code_name('can delete users')
     perm1 = Permission.find_by_name(name1)
@@ -224,7 +249,8 @@ def test_add_user_perms(client, users):
     response = client.put(
         f'/api/admin/users/{user.id}/permissions',
         content_type='application/json',
-        data=json.dumps({'perms': [perm1.id, perm2.id]})
+        data=json.dumps({'perms': [perm1.id, perm2.id]}),
+        headers=headers
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 200
@@ -233,7 +259,7 @@ def test_add_user_perms(client, users):
     assert data.get('permissions')[0]['name'] == 'can delete users'
 
 
-def test_remove_user_perms(client, users):
+def test_remove_user_perms(client, users, headers):
     name1 = Permission.set_code_name('can view groups')
     name2 = Permission.set_code_name('can delete users')
     perm1 = Permission.find_by_name(name1)
@@ -245,8 +271,47 @@ def test_remove_user_perms(client, users):
     response = client.delete(
         f'/api/admin/users/{user.id}/permissions',
         content_type='application/json',
-        data=json.dumps({'perms': [perm1.id, perm2.id]})
+        data=json.dumps({'perms': [perm1.id, perm2.id]}),
+        headers=headers
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 200
     assert len(data.get('permissions')) == 0
+
+
+def test_get_all_users_no_permission(client, users):
+    user = User.find_by_identity('commonuser@test.com')
+    response = client.get('/api/admin/users', headers=auth_headers(user))
+    data = json.loads(response.data.decode())
+    assert response.status_code == 403
+    assert 'Permission denied.' in data.get('message')
+
+
+def count_queries(client, url, headers):
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        response = client.get(url, headers=headers)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+    assert response.status_code == 200
+    return len(statements)
+
+
+def test_get_all_users_granted_permission(client, users, headers):
+    user = User.find_by_identity('regularuser@test.com')
+    user.add_permissions([Permission.find_by_name('can_view_users')])
+    granted = auth_headers(user)
+
+    # the first requests warm the identity and permission caches
+    for request_headers in (headers, granted):
+        count_queries(client, '/api/admin/users', request_headers)
+
+    # admins skip the check, so any extra query would be the check's
+    assert count_queries(client, '/api/admin/users', granted) == \
+        count_queries(client, '/api/admin/users', headers)